@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/cache.py
+# Created by Greg Kiar on 2018-02-28.
+# Email: gkiar@mcin.ca
+
+from contextlib import contextmanager
+from subprocess import Popen, PIPE
+import os.path as op
+import tempfile
+import hashlib
+import shutil
+import fcntl
+import time
+import os
+import re
+
+from clowdr import utils
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def defaultCacheDir():
+    """defaultCacheDir
+    Node-local directory used for the image cache when none is given.
+    """
+    return utils.cacheDir("images")
+
+
+def imageKey(container):
+    """imageKey
+    Name under which an image is cached, e.g. "docker-bids-example-0.0.4".
+    """
+    name = "{}-{}".format(container.get("type"), container.get("image"))
+    return re.sub(r'[^A-Za-z0-9_.-]', '-', name)
+
+
+def fileDigest(path):
+    """fileDigest
+    SHA-256 of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fhandle:
+        for chunk in iter(lambda: fhandle.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _docker(*args):
+    proc = Popen(["docker"] + list(args), stdout=PIPE, stderr=PIPE)
+    stdout, stderr = proc.communicate()
+    return proc.returncode, stdout.decode("utf-8", "replace").strip()
+
+
+@contextmanager
+def _locked(path, mode=fcntl.LOCK_EX):
+    with open(path, "a") as fhandle:
+        fcntl.flock(fhandle, mode)
+        try:
+            yield fhandle
+        finally:
+            fcntl.flock(fhandle, fcntl.LOCK_UN)
+
+
+class ImageCache:
+    """ImageCache
+    Container image cache shared by all tasks and runs on a node. Singularity
+    images are stored once per content digest, and each image name refers to
+    one of them; Docker images are kept in Docker's own store, and only the
+    pulls are coordinated. Concurrent tasks needing the same image wait for a
+    single pull, through file locks. Tasks hold a shared lock on the images
+    they use, and once the cache grows beyond its size limit, the least
+    recently used images which are not in use are evicted.
+
+    Parameters
+    ----------
+    root : str
+        Directory of the cache. Defaults to a node-local temporary directory
+    max_size : float
+        Size limit of the cache, in GB, or None for no limit
+    """
+    def __init__(self, root=None, max_size=None, verbose=False):
+        self.root = utils.truepath(root or defaultCacheDir())
+        self.max_bytes = max_size * 1024**3 if max_size else None
+        self.verbose = verbose
+        for subdir in ["blobs", "locks", "tmp"]:
+            os.makedirs(op.join(self.root, subdir), exist_ok=True)
+        self.indexfile = op.join(self.root, "index.json")
+
+    def lockfile(self, key):
+        return op.join(self.root, "locks", key + ".lock")
+
+    def index(self):
+        return utils.loadCache(self.indexfile)
+
+    def update(self, key, entry=None):
+        # Updates (or removes) an entry of the index; the caller holds the
+        # index lock
+        index = self.index()
+        if entry is None:
+            index.pop(key, None)
+        else:
+            index[key] = entry
+        utils.saveCache(self.indexfile, index, indent=4)
+
+    def touch(self, key):
+        with _locked(op.join(self.root, "index.lock")):
+            entry = self.index().get(key)
+            if entry is not None:
+                entry["used"] = time.time()
+                self.update(key, entry)
+            return entry
+
+    def pullSingularity(self, container, **kwargs):
+        tmpdir = tempfile.mkdtemp(dir=op.join(self.root, "tmp"))
+        try:
+            utils.getContainer(tmpdir, container, **kwargs)
+            images = [f for f in os.listdir(tmpdir) if f.endswith(".simg")]
+            if not images:
+                raise OSError("Unable to pull Singularity image: {}"
+                              "".format(container.get("image")))
+            pulled = op.join(tmpdir, images[0])
+            digest = fileDigest(pulled)
+            blob = op.join(self.root, "blobs", digest + ".simg")
+            if not op.exists(blob):
+                os.replace(pulled, blob)
+            return {"type": "singularity", "digest": digest, "path": blob,
+                    "size": op.getsize(blob), "pulled": True}
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def pullDocker(self, container, **kwargs):
+        image = container.get("image")
+        present = not _docker("image", "inspect", image)[0]
+        if not present:
+            if self.verbose:
+                print("docker pull {}".format(image), flush=True)
+            code, output = _docker("pull", image)
+            if code:
+                raise OSError("Unable to pull Docker image: {}"
+                              "".format(output))
+        _, digest = _docker("image", "inspect", "--format", "{{.Id}}", image)
+        _, size = _docker("image", "inspect", "--format", "{{.Size}}", image)
+        return {"type": "docker", "digest": digest, "image": image,
+                "size": int(size) if size.isdigit() else 0,
+                "pulled": not present}
+
+    def valid(self, entry):
+        if entry is None:
+            return False
+        if entry["type"] == "singularity":
+            return op.isfile(entry["path"])
+        return not _docker("image", "inspect", entry["image"])[0]
+
+    @contextmanager
+    def use(self, container, **kwargs):
+        """use
+        Provides an image, pulling it into the cache if needed. The image is
+        protected from eviction until the context is exited.
+
+        Parameters
+        ----------
+        container : dict
+            The "container-image" of a Boutiques descriptor
+        **kwargs : dict
+            Options of "utils.getContainer" (e.g. simg)
+
+        Yields
+        ------
+        dict
+            Cache entry of the image; for Singularity, "path" is the image
+        """
+        key = imageKey(container)
+        with open(self.lockfile(key), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entry = self.touch(key)
+                if not self.valid(entry):
+                    if self.verbose:
+                        print("Pulling {} into the image cache..."
+                              "".format(key), flush=True)
+                    if container.get("type") == "docker":
+                        entry = self.pullDocker(container, **kwargs)
+                    else:
+                        entry = self.pullSingularity(container, **kwargs)
+                    entry["used"] = time.time()
+                    with _locked(op.join(self.root, "index.lock")):
+                        self.update(key, entry)
+                elif self.verbose:
+                    print("Using cached image {}".format(key), flush=True)
+
+                # Downgrade to a shared lock while the image is in use
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                self.evict(keep=key)
+                yield entry
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def evict(self, keep=None):
+        """evict
+        Removes the least recently used images until the cache fits within
+        its size limit. Images in use, and the "keep" image, are skipped.
+        """
+        if self.max_bytes is None:
+            return []
+        evicted = []
+        with _locked(op.join(self.root, "index.lock")):
+            index = self.index()
+            # Blobs shared by several names are only counted once
+            sizes = {entry.get("path") or key: entry.get("size", 0)
+                     for key, entry in index.items()}
+            total = sum(sizes.values())
+            for key in sorted(index, key=lambda k: index[k].get("used", 0)):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                with open(self.lockfile(key), "a") as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # In use by a task
+                    total -= self.remove(key, index)
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                index.pop(key)
+                self.update(key, None)
+                evicted += [key]
+        if self.verbose and evicted:
+            print("Evicted from the image cache: {}"
+                  "".format(", ".join(evicted)), flush=True)
+        return evicted
+
+    def remove(self, key, index):
+        # Removes an image, returning the space freed
+        entry = index[key]
+        if entry["type"] == "singularity":
+            # Blobs are shared by all names with the same content
+            shared = [k for k, e in index.items()
+                      if k != key and e.get("path") == entry["path"]]
+            if shared:
+                return 0
+            if op.isfile(entry["path"]):
+                os.remove(entry["path"])
+        elif entry.get("pulled"):
+            # Only images pulled by the cache are removed from Docker
+            _docker("rmi", entry["image"])
+        return entry.get("size", 0)
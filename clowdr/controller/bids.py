@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/controller/bids.py
+# Created by Greg Kiar on 2018-06-11.
+# Email: gkiar@mcin.ca
+
+from concurrent.futures import ThreadPoolExecutor
+import os.path as op
+import hashlib
+import json
+import os
+
+from clowdr import utils
+
+
+def defaultCacheDir():
+    """defaultCacheDir
+    Directory in which the indices of BIDS datasets are cached by default.
+    """
+    return utils.cacheDir("bids")
+
+
+def _cachefile(bidsdir, cachedir):
+    key = hashlib.sha256(bidsdir.rstrip("/").encode("utf-8")).hexdigest()
+    return op.join(cachedir, "{}.json".format(key))
+
+
+def _localSessions(subdir):
+    return sorted(entry.name for entry in os.scandir(subdir)
+                  if entry.name.startswith("ses-") and entry.is_dir())
+
+
+def _scanLocal(bidsdir, cached, jobs):
+    # Subjects are listed every time; the sessions of a subject are only
+    # listed again if its directory was modified since it was indexed
+    subjects = {entry.name: entry.stat().st_mtime
+                for entry in os.scandir(bidsdir)
+                if entry.name.startswith("sub-") and entry.is_dir()}
+    previous = cached.get("subjects", {})
+    index = {"subjects": {}}
+    stale = []
+    for sub, mtime in subjects.items():
+        if sub in previous and previous[sub]["stamp"] == mtime:
+            index["subjects"][sub] = previous[sub]
+        else:
+            stale += [sub]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        sessions = executor.map(_localSessions,
+                                [op.join(bidsdir, sub) for sub in stale])
+        for sub, subsessions in zip(stale, sessions):
+            index["subjects"][sub] = {"stamp": subjects[sub],
+                                      "sessions": subsessions}
+    return index, len(stale)
+
+
+def _s3List(client, bucket, prefix):
+    # Lists the immediate "subdirectories" and objects under a prefix
+    prefixes, objects = [], []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix,
+                                   Delimiter="/"):
+        prefixes += [entry["Prefix"][len(prefix):].rstrip("/")
+                     for entry in page.get("CommonPrefixes", [])]
+        objects += [[entry["Key"], entry["ETag"]]
+                    for entry in page.get("Contents", [])]
+    return prefixes, objects
+
+
+def _scanS3(bidsdir, cached, jobs):
+    # Prefixes have no ETag of their own: the index is reused for as long as
+    # the ETags of the dataset's top-level files (e.g. participants.tsv) are
+    # unchanged, and only new subjects are listed
+    import boto3
+    client = boto3.client("s3")
+    bucket, prefix = utils.splitS3Path(bidsdir)
+    prefix = prefix.rstrip("/") + "/"
+    prefixes, objects = _s3List(client, bucket, prefix)
+    stamp = hashlib.sha256(json.dumps(sorted(objects)).encode("utf-8"))
+    stamp = stamp.hexdigest()
+    previous = cached.get("subjects", {}) \
+        if cached.get("stamp") == stamp else {}
+    index = {"stamp": stamp, "subjects": {}}
+    stale = []
+    for sub in prefixes:
+        if not sub.startswith("sub-"):
+            continue
+        if sub in previous:
+            index["subjects"][sub] = previous[sub]
+        else:
+            stale += [sub]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        listings = executor.map(lambda sub: _s3List(client, bucket,
+                                                    prefix + sub + "/")[0],
+                                stale)
+        for sub, subprefixes in zip(stale, listings):
+            index["subjects"][sub] = {"sessions": sorted(
+                ses for ses in subprefixes if ses.startswith("ses-"))}
+    return index, len(stale)
+
+
+def scanLayout(bidsdir, cachedir=None, jobs=16, verbose=False):
+    """scanLayout
+    Finds the participants of a BIDS dataset, and the sessions of each. Local
+    datasets are listed with os.scandir, and S3 datasets with paginated
+    prefix listings, in parallel across participants. The index is cached on
+    disk: on later scans, only participants whose directory was modified
+    (or, on S3, all of them if the dataset's top-level files changed) are
+    listed again.
+
+    Parameters
+    ----------
+    bidsdir : str
+        Local or S3 path of the BIDS dataset
+    cachedir : str
+        Directory of the cached indices (see "defaultCacheDir")
+    jobs : int
+        Number of participants listed at once
+    verbose : bool
+        Toggle verbose output printing
+
+    Returns
+    -------
+    dict
+        Session labels (e.g. ["test", "retest"], or [] for datasets without
+        sessions) of each participant label (e.g. "01"), or None if the
+        dataset couldn't be listed
+    """
+    cachefile = _cachefile(bidsdir, cachedir if cachedir
+                           else defaultCacheDir())
+    cached = utils.loadCache(cachefile)
+    try:
+        if bidsdir.startswith("s3://"):
+            from botocore.exceptions import BotoCoreError, ClientError
+            try:
+                index, scanned = _scanS3(bidsdir, cached, jobs)
+            except (BotoCoreError, ClientError) as e:
+                raise OSError(str(e))
+        else:
+            index, scanned = _scanLocal(bidsdir, cached, jobs)
+    except OSError as e:
+        if verbose:
+            print("Could not index BIDS dataset {}: {}".format(bidsdir, e),
+                  flush=True)
+        return None
+
+    if index != cached:
+        utils.saveCache(cachefile, index)
+    if verbose:
+        print("Indexed BIDS dataset {}: {} participant(s), {} listed"
+              "".format(bidsdir, len(index["subjects"]), scanned),
+              flush=True)
+    return {sub[len("sub-"):]: [ses[len("ses-"):]
+                                for ses in entry["sessions"]]
+            for sub, entry in index["subjects"].items()}
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/controller/history.py
+# Created by Greg Kiar on 2018-06-11.
+# Email: gkiar@mcin.ca
+
+import numpy as np
+import os.path as op
+import heapq
+import json
+import csv
+import os
+import re
+
+from clowdr.monitor import readUsage
+from clowdr import manifest
+from clowdr import utils
+
+
+# Margin added to the peak RAM of past runs when predicting a task's needs
+HEADROOM = 1.1
+
+
+def runDirs(path):
+    """runDirs
+    Lists the runs at a path: a run directory holds the task files directly,
+    and a provenance directory holds one run per subdirectory, as
+    "<run_id>/clowdr".
+    """
+    path = utils.truepath(path)
+    if any(re.match(r'^task-[0-9]+[.]json$', f) or f == manifest.MANIFEST
+           for f in os.listdir(path)):
+        return [path]
+    runs = [op.join(path, run, 'clowdr') for run in sorted(os.listdir(path))]
+    return [run for run in runs if op.isdir(run)]
+
+
+def taskKey(taskfile):
+    """taskKey
+    Identifies a task across runs, by the name of its invocation file.
+    """
+    return op.basename(manifest.loadTask(taskfile).invocation)
+
+
+def _toolName(descriptor):
+    try:
+        with open(descriptor) as fhandle:
+            return json.load(fhandle).get('name')
+    except (OSError, ValueError):
+        return None
+
+
+def loadHistory(paths, descriptor=None):
+    """loadHistory
+    Reads the usage and summary files of past runs.
+
+    Parameters
+    ----------
+    paths : list
+        Run directories, or provenance directories containing several runs.
+        When a task appears more than once, the latest run is used.
+    descriptor : str
+        Optional Boutiques descriptor; only runs of the same tool are read
+
+    Returns
+    -------
+    dict
+        Mapping of each task (see "taskKey") to its peak RAM ("ram", in MB),
+        the CPUs it kept busy ("cpus", the 95th percentile of CPU usage),
+        its duration ("duration", in seconds) and its exit code ("exitcode").
+    """
+    name = _toolName(descriptor) if descriptor else None
+    history = {}
+    for rundir in [run for path in paths for run in runDirs(path)]:
+        for taskf in manifest.listTasks(rundir):
+            task_id = manifest.r_task.match(op.basename(taskf)).group(1)
+            summaryf = op.join(rundir, 'task-{}-summary.json'.format(task_id))
+            if not op.isfile(summaryf):
+                continue
+            try:
+                task = manifest.loadTask(taskf)
+                with open(summaryf) as fhandle:
+                    summary = json.load(fhandle)
+                key = op.basename(task.invocation)
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            if name and _toolName(op.join(rundir,
+                                          op.basename(task.tool))) != name:
+                continue
+
+            record = {"ram": None,
+                      "cpus": None,
+                      "duration": summary.get("duration"),
+                      "exitcode": summary.get("exitcode")}
+            for ext in ['bin', 'csv']:
+                usagef = op.join(rundir,
+                                 'task-{}-usage.{}'.format(task_id, ext))
+                if op.isfile(usagef):
+                    usage = readUsage(usagef)
+                    if len(usage['ram']):
+                        record["ram"] = float(np.max(usage['ram']))
+                        record["cpus"] = float(np.percentile(usage['cpu'],
+                                                             95)) / 100
+                    break
+            history[key] = record
+    return history
+
+
+def taskDurations(rundir, known=None):
+    """taskDurations
+    Reads the durations of the tasks of a run which completed successfully,
+    from their summary files. Can be called repeatedly while the run goes
+    on: summaries already in "known" are not read again.
+
+    Parameters
+    ----------
+    rundir : str
+        Run directory
+    known : dict
+        Output of a previous call, updated in place
+
+    Returns
+    -------
+    dict
+        Mapping of each successful task's summary file to its duration
+    """
+    known = {} if known is None else known
+    r_summary = re.compile(r'^task-[0-9]+-summary[.]json$')
+    for summaryf in filter(r_summary.match, os.listdir(rundir)):
+        if summaryf in known:
+            continue
+        try:
+            with open(op.join(rundir, summaryf)) as fhandle:
+                summary = json.load(fhandle)
+        except (OSError, ValueError):
+            continue  # Possibly still being written
+        if summary.get("exitcode") == 0 and summary.get("duration"):
+            known[summaryf] = summary["duration"]
+    return known
+
+
+def taskDemand(taskfile, history=None, ram=None, cpus=None, descriptor=None):
+    """taskDemand
+    Predicts the RAM and CPUs a task will need. User-declared limits come
+    first, then the task's history, then the resources suggested in the
+    descriptor.
+
+    Parameters
+    ----------
+    taskfile : str
+        Path to the task file
+    history : dict
+        Output of "loadHistory"
+    ram : float
+        Declared RAM, in MB
+    cpus : float
+        Declared number of CPUs
+    descriptor : str
+        Path to the Boutiques descriptor of the tool
+
+    Returns
+    -------
+    dict
+        Predicted "ram" (in MB) and "cpus"; 0 when unknown
+    """
+    demand = {"ram": ram, "cpus": cpus}
+
+    past = (history or {}).get(taskKey(taskfile)) or {}
+    if demand["ram"] is None and past.get("ram") is not None:
+        demand["ram"] = past["ram"] * HEADROOM
+    if demand["cpus"] is None and past.get("cpus") is not None:
+        demand["cpus"] = past["cpus"]
+
+    if descriptor and None in demand.values():
+        with open(descriptor) as fhandle:
+            suggested = json.load(fhandle).get("suggested-resources") or {}
+        if demand["ram"] is None and suggested.get("ram"):
+            demand["ram"] = float(suggested["ram"]) * 1024
+        if demand["cpus"] is None and suggested.get("cpu-cores"):
+            demand["cpus"] = float(suggested["cpu-cores"])
+
+    return {k: v if v is not None else 0 for k, v in demand.items()}
+
+
+def groupDemand(taskgroup, **kwargs):
+    """groupDemand
+    Predicts the needs of a group of tasks which are run one after another:
+    the largest needs of any of its tasks. Accepts the options of
+    "taskDemand".
+    """
+    demands = [taskDemand(task, **kwargs) for task in taskgroup]
+    return {"ram": max(d["ram"] for d in demands),
+            "cpus": max(d["cpus"] for d in demands)}
+
+
+def loadCosts(costfile, column="cost"):
+    """loadCosts
+    Reads user-supplied task costs from a CSV (or TSV) file with a header.
+    The first column identifies each task, by the name of its invocation file
+    (with or without extension), or by its task ID.
+
+    Returns
+    -------
+    dict
+        Mapping of each task identifier to its cost
+    """
+    with open(costfile) as fhandle:
+        dialect = csv.Sniffer().sniff(fhandle.read(4096), delimiters=",\t")
+        fhandle.seek(0)
+        reader = csv.reader(fhandle, dialect)
+        header = next(reader)
+        if column not in header:
+            raise SystemExit("**Error: Column '{}' not found in {}"
+                             "".format(column, costfile))
+        idx = header.index(column)
+        return {row[0]: float(row[idx]) for row in reader if row}
+
+
+def taskCosts(tasks, history=None, costs=None, keys=None):
+    """taskCosts
+    Predicts the duration (or user-supplied cost) of each task. Costs take
+    precedence over the history; tasks with neither get the median of the
+    others, so they are spread evenly.
+
+    Parameters
+    ----------
+    tasks : list
+        Paths to task files
+    history : dict
+        Output of "loadHistory"
+    costs : dict
+        Output of "loadCosts"
+    keys : list
+        Key of each task (see "taskKey"), when already known; the task files
+        are then never read, and needn't exist
+
+    Returns
+    -------
+    list
+        Predicted cost of each task
+    """
+    predicted = []
+    for idx, task in enumerate(tasks):
+        key = keys[idx] if keys else taskKey(task)
+        ids = [key, op.splitext(key)[0],
+               re.sub(r'^.*task-([0-9]+)[.]json$', r'\1', task)]
+        cost = None
+        for tid in ids:
+            if costs and tid in costs:
+                cost = costs[tid]
+                break
+        if cost is None and history and key in history:
+            cost = history[key]["duration"]
+        predicted += [cost]
+
+    known = [cost for cost in predicted if cost is not None]
+    default = float(np.median(known)) if known else 1.0
+    return [cost if cost is not None else default for cost in predicted]
+
+
+def balanceGroups(tasks, gsize, costs):
+    """balanceGroups
+    Groups tasks so that all groups take about as long to run, using the
+    longest-processing-time-first heuristic: tasks are placed from the
+    longest to the shortest, each into the group with the least work so far.
+
+    Parameters
+    ----------
+    tasks : list
+        Paths to task files
+    gsize : int
+        Average number of tasks per group; sets the number of groups
+    costs : list
+        Predicted cost of each task (see "taskCosts")
+
+    Returns
+    -------
+    list
+        Groups of tasks, from the most to the least work
+    """
+    ngroups = max(int(np.ceil(len(tasks) / float(gsize))), 1)
+    groups = [(0.0, idx, []) for idx in range(ngroups)]
+    heapq.heapify(groups)
+    for cost, task in sorted(zip(costs, tasks), key=lambda ct: -ct[0]):
+        load, idx, group = groups[0]
+        group.append(task)
+        heapq.heapreplace(groups, (load + cost, idx, group))
+    return [group for _, _, group in sorted(groups, key=lambda g: -g[0])
+            if group]
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/controller/memo.py
+# Created by Greg Kiar on 2018-06-11.
+# Email: gkiar@mcin.ca
+
+from time import mktime, strptime
+import os.path as op
+import hashlib
+import json
+import os
+import re
+
+from clowdr.controller.history import runDirs
+from clowdr import manifest
+from clowdr import utils
+
+
+def _s3Manifest(path):
+    import boto3
+    bucket, prefix = utils.splitS3Path(path)
+    client = boto3.client("s3")
+    listing = []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            listing += [[obj["Key"], obj["Size"], obj["ETag"]]]
+    return listing
+
+
+def fileManifest(path, cache=None):
+    """fileManifest
+    Lists the files at a path, with their size and modification time (or
+    ETag, on S3). Directories are listed recursively.
+
+    Parameters
+    ----------
+    path : str
+        Local or S3 path
+    cache : dict
+        Optional cache of manifests, shared by all the tasks of a run
+
+    Returns
+    -------
+    list
+        [relative path, size, mtime or ETag] for each file
+    """
+    if cache is not None and path in cache:
+        return cache[path]
+
+    if path.startswith("s3://"):
+        listing = _s3Manifest(path)
+    elif op.isdir(path):
+        listing = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                fpath = op.join(root, fname)
+                stat = os.stat(fpath)
+                listing += [[op.relpath(fpath, path), stat.st_size,
+                             stat.st_mtime]]
+    elif op.exists(path):
+        stat = os.stat(path)
+        listing = [[op.basename(path), stat.st_size, stat.st_mtime]]
+    else:
+        listing = None
+
+    if cache is not None:
+        cache[path] = listing
+    return listing
+
+
+def _content(taskfile, basedir=None, cache=None, rundir=None):
+    # What determines the result of a task; tasks of past runs read their
+    # descriptor and invocation from their run directory, where available
+    task = manifest.loadTask(taskfile)
+    tool = task.tool
+    if rundir is not None and op.isfile(op.join(rundir, op.basename(tool))):
+        tool = op.join(rundir, op.basename(tool))
+    with open(tool) as fhandle:
+        descriptor = json.load(fhandle)
+    try:
+        invocation = task.loadInvocation(rundir)
+    except FileNotFoundError:
+        invocation = task.loadInvocation()
+
+    inputs = {}
+    for inp in descriptor.get("inputs", []):
+        if inp.get("type") != "File" or inp["id"] not in invocation:
+            continue
+        values = invocation[inp["id"]]
+        values = values if isinstance(values, list) else [values]
+        inputs[inp["id"]] = []
+        for value in values:
+            path = str(value)
+            if basedir and not path.startswith("s3://"):
+                path = op.join(basedir, path)
+            inputs[inp["id"]] += [fileManifest(path, cache)]
+    for dataloc in task.dataloc:
+        if dataloc.startswith("s3://"):
+            inputs[dataloc] = fileManifest(dataloc, cache)
+    return {"descriptor": descriptor,
+            "invocation": invocation,
+            "inputs": inputs}
+
+
+def _digest(content):
+    content = json.dumps(content, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def taskHash(taskfile, basedir=None, cache=None):
+    """taskHash
+    Hashes what determines the result of a task: its descriptor, its
+    invocation, and the files given to its File inputs (as well as its S3
+    input data, when running remotely).
+
+    Parameters
+    ----------
+    taskfile : str
+        Path to the task file
+    basedir : str
+        Directory against which relative input paths are resolved, i.e.
+        where the task will be executed
+    cache : dict
+        Optional cache of file manifests (see "fileManifest")
+
+    Returns
+    -------
+    str
+        SHA-256 of the task
+    """
+    return _digest(_content(taskfile, basedir, cache))
+
+
+def pastHash(summaryf, summary, basedir=None, cache=None):
+    """pastHash
+    Hashes a task of a past run launched without memoization, from its
+    stored task and the current state of its inputs. As these may have
+    changed since, the hash is only given if none of the input files was
+    modified after the task was launched; inputs on S3, which have no
+    modification time in their manifest, can't be checked this way.
+
+    Parameters
+    ----------
+    summaryf : str
+        Path to the summary of the past task
+    summary : dict
+        Content of the summary
+    basedir : str
+        Directory against which relative input paths are resolved (see
+        "taskHash")
+    cache : dict
+        Optional cache of file manifests (see "fileManifest")
+
+    Returns
+    -------
+    str
+        SHA-256 of the task, or None if it can't be trusted
+    """
+    rundir, fname = op.split(summaryf)
+    task_id = re.match(r'^task-([0-9]+)-summary[.]json$', fname).group(1)
+    taskfile = op.join(rundir, "task-{}.json".format(task_id))
+    try:
+        launch = mktime(strptime(summary["launchtime"], "%Y-%m-%d %H:%M:%S"))
+        content = _content(taskfile, basedir, cache, rundir=rundir)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    listings = [listing for key, listings in content["inputs"].items()
+                for listing in (listings if not key.startswith("s3://")
+                                else [listings])]
+    for listing in filter(None, listings):
+        if not all(isinstance(entry[2], (int, float)) and entry[2] < launch
+                   for entry in listing):
+            return None
+    return _digest(content)
+
+
+def memoIndex(paths, basedir=None, cache=None):
+    """memoIndex
+    Finds the tasks of past runs which completed successfully. Tasks of runs
+    launched without memoization are hashed from their stored task (see
+    "pastHash").
+
+    Parameters
+    ----------
+    paths : list
+        Run directories, or provenance directories containing several runs
+    basedir : str
+        Directory against which relative input paths are resolved (see
+        "taskHash")
+    cache : dict
+        Optional cache of file manifests (see "fileManifest")
+
+    Returns
+    -------
+    dict
+        Mapping of each task hash to the summary file of the latest
+        successful task with that hash
+    """
+    index = {}
+    r_summary = re.compile(r'^task-[0-9]+-summary[.]json$')
+    for rundir in [run for path in paths for run in runDirs(path)]:
+        for summaryf in sorted(filter(r_summary.match, os.listdir(rundir))):
+            summaryf = op.join(rundir, summaryf)
+            try:
+                with open(summaryf) as fhandle:
+                    summary = json.load(fhandle)
+            except (OSError, ValueError):
+                continue
+            if summary.get("exitcode") != 0:
+                continue
+            memo = summary.get("memo") or pastHash(summaryf, summary,
+                                                   basedir, cache)
+            if memo:
+                index[memo] = summaryf
+    return index
+
+
+def linkResult(taskfile, summaryf):
+    """linkResult
+    Records a past result as the result of a task: its summary is copied
+    (noting where it came from), and its usage and log files are linked.
+    """
+    taskdir = op.dirname(taskfile)
+    task_id = re.match(r'^.*task-([0-9]+)[.]json$', taskfile).group(1)
+    prev_dir = op.dirname(summaryf)
+    prev_id = re.match(r'^.*task-([0-9]+)-summary[.]json$',
+                       summaryf).group(1)
+
+    r_prov = re.compile(r'^task-{}-(usage.*|stdout.txt|stderr.txt)$'
+                        r''.format(prev_id))
+    for provf in filter(r_prov.match, os.listdir(prev_dir)):
+        link = op.join(taskdir, provf.replace("task-{}-".format(prev_id),
+                                              "task-{}-".format(task_id), 1))
+        if not op.lexists(link):
+            os.symlink(op.join(prev_dir, provf), link)
+
+    with open(summaryf) as fhandle:
+        summary = json.load(fhandle)
+    summary["memoized"] = summaryf
+    with open(op.join(taskdir, "task-{}-summary.json".format(task_id)),
+              "w") as fhandle:
+        fhandle.write(json.dumps(summary, indent=4, sort_keys=True) + "\n")
+
+
+def memoize(tasks, paths, basedir=None, verbose=False):
+    """memoize
+    Stamps each task with its hash, and links the results of those which
+    already completed successfully in a past run, instead of running them.
+
+    Parameters
+    ----------
+    tasks : list
+        Paths to task files
+    paths : list
+        Run directories, or provenance directories holding past runs
+    basedir : str
+        Directory where the tasks will be executed (see "taskHash")
+
+    Returns
+    -------
+    list
+        The tasks which still need to be run
+    """
+    cache = {}
+    index = memoIndex(paths, basedir=basedir, cache=cache)
+    remaining = []
+    stamps = {}
+    for taskfile in tasks:
+        memo = taskHash(taskfile, basedir=basedir, cache=cache)
+        if op.isfile(taskfile):
+            manifest.loadTask(taskfile).replace(memo=memo).save(taskfile)
+        else:
+            stamps.setdefault(op.dirname(taskfile), {})[taskfile] = memo
+
+        if memo in index:
+            if verbose:
+                print("... Reusing result of: {}".format(index[memo]))
+            linkResult(taskfile, index[memo])
+        else:
+            remaining += [taskfile]
+
+    # Tasks stored in a manifest are stamped all at once
+    for rundir, memos in stamps.items():
+        manifest.rewrite(rundir, lambda tid, record: dict(
+            record, memo=memos.get(op.join(rundir,
+                                           "task-{}.json".format(tid)),
+                                   record.get("memo"))))
+    return remaining
@@ -7,7 +7,6 @@
 # Created by Greg Kiar on 2018-02-28.
 # Email: gkiar@mcin.ca
 
-from copy import deepcopy
 import os.path as op
 import datetime
 import time
@@ -16,6 +15,9 @@ import json
 import sys
 import os
 
+from clowdr.controller import validator
+from clowdr.controller import bids
+from clowdr import manifest
 from clowdr import utils
 
 
@@ -34,13 +36,88 @@ def consolidateTask(tool, invocation, clowdrloc, dataloc, **kwargs):
     dataloc : str
         Path for accessing input data
     **kwargs : dict
-        Arbitrary keyword arguments (i.e. {'verbose': True})
+        Arbitrary keyword arguments (i.e. {'verbose': True}). With
+        "manifest", tasks are stored in a single manifest for the run (see
+        "manifest.ManifestWriter") rather than as individual files. With
+        "bids", participants and sessions which aren't specified are found
+        in the dataset, whose index is cached in "bids_cache" (see
+        "bids.scanLayout"). With "validate", all invocations are validated
+        against the descriptor before returning, with results cached in
+        "validation_cache" (see "validator.validateTasks").
 
     Returns
     -------
     tuple: (list, list)
         The task dictionary JSONs, and associated Boutiques invocation files.
     """
+    taskdictnames = []
+    invocations = []
+    for taskfname, invofname in generateTasks(tool, invocation, clowdrloc,
+                                              dataloc, **kwargs):
+        taskdictnames += [taskfname]
+        invocations += [invofname]
+
+    # Invalid invocations are reported before any task is launched
+    if kwargs.get("validate"):
+        invalid = validator.validateTasks(
+            utils.truepath(tool), taskdictnames,
+            cachedir=kwargs.get("validation_cache"),
+            verbose=kwargs.get("verbose"))
+        if invalid:
+            details = ["  {}: {}".format(op.basename(taskfname),
+                                         invalid[taskfname])
+                       for taskfname in taskdictnames if taskfname in invalid]
+            if len(details) > 10:
+                details = details[:10] + ["  ..."]
+            raise SystemExit("**Error: {} of {} invocation(s) are invalid:\n"
+                             "{}".format(len(invalid), len(taskdictnames),
+                                         "\n".join(details)))
+    return (taskdictnames, invocations)
+
+
+def generateTasks(tool, invocation, clowdrloc, dataloc, **kwargs):
+    """generateTasks
+    Creates Clowdr task JSON files lazily: each task, and its invocation, is
+    written to disk as it is produced, so that tasks can be launched before
+    all of them exist. Accepts the same arguments as "consolidateTask".
+
+    Yields
+    ------
+    tuple: (str, str)
+        A task dictionary JSON, and its associated Boutiques invocation file.
+    """
+    taskloc, tasks = createTasks(tool, invocation, clowdrloc, dataloc,
+                                 **kwargs)
+
+    # Store task definition files to disk, or append them to the manifest
+    if kwargs.get("manifest"):
+        with manifest.ManifestWriter(taskloc) as writer:
+            for task, invo in tasks:
+                yield (writer.append(task, invo), task.invocation)
+        return
+
+    for idx, (task, invo) in enumerate(tasks):
+        if invo is not None:
+            with open(task.invocation, 'w') as fhandle:
+                fhandle.write(json.dumps(invo, indent=4, sort_keys=True))
+        taskfname = op.join(taskloc, "task-{}.json".format(idx))
+        task.save(taskfname)
+        yield (taskfname, task.invocation)
+
+
+def createTasks(tool, invocation, clowdrloc, dataloc, **kwargs):
+    """createTasks
+    Creates the tasks of a run in memory, without storing any of them: only
+    the descriptor and invocation are copied to the run directory. Accepts
+    the same arguments as "consolidateTask".
+
+    Returns
+    -------
+    tuple: (str, iterator)
+        The run directory, and the tasks to store in it as lazily produced
+        (manifest.Task, dict) pairs; the invocation is None while its file is
+        already on disk.
+    """
 
     ts = time.time()
     dt = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d_%H-%M-%S')
@@ -53,185 +130,258 @@ def consolidateTask(tool, invocation, clowdrloc, dataloc, **kwargs):
     clowdrloc = utils.truepath(clowdrloc)
     dataloc = utils.truepath(dataloc)
 
-    # Initialize task dictionary
-    taskdict = {}
+    # Initialize task
     with open(tool) as fhandle:
         toolname = json.load(fhandle)["name"].replace(' ', '-')
     taskloc = op.join(clowdrloc, modif, 'clowdr')
     os.makedirs(taskloc)
 
-    taskdict["taskloc"] = op.join(clowdrloc, modif, toolname)
-    taskdict["dataloc"] = [dataloc]
-    taskdict["invocation"] = utils.get(invocation, taskloc)[0]
-    taskdict["tool"] = utils.get(tool, taskloc)[0]
+    task = manifest.Task(tool=utils.get(tool, taskloc)[0],
+                         invocation=utils.get(invocation, taskloc)[0],
+                         taskloc=op.join(clowdrloc, modif, toolname),
+                         dataloc=[dataloc])
+
+    # Tasks flow through the stages below as (Task, invocation)
+    # pairs; the invocation is None while its file is already on disk, and
+    # is otherwise only written once the task is final
 
     # Case 1: User supplies directory of invocations
     if op.isdir(invocation):
-        tempinvocations = os.listdir(invocation)
-        taskdicts = []
-        invocations = []
-        for invoc in tempinvocations:
-            tempdict = deepcopy(taskdict)
-            tempinvo = utils.get(op.join(invocation, invoc), taskloc)
-            tempdict["invocation"] = utils.truepath(tempinvo[0])
-            invocations += tempinvo
-            taskdicts += [tempdict]
+        tasks = invocationTasks(taskloc, task, invocation)
 
     # Case 2: User supplies a single invocation
     else:
         # Case 2a: User is running a BIDS app
         if kwargs.get("bids"):
-            taskdicts, invocations = bidsTasks(taskloc, taskdict)
+            tasks = bidsTasks(taskloc, task,
+                              cachedir=kwargs.get("bids_cache"),
+                              verbose=kwargs.get("verbose"))
 
         # Case 2b: User is quite simply just launching a single invocation
         else:
-            taskdicts = [taskdict]
-            invocations = [taskdict["invocation"]]
+            tasks = iter([(task, None)])
 
     # Post-case: User is performing a parameter sweep over invocations
     sweep = kwargs.get("sweep")
     if sweep:
-        for sweep_param in sweep:
-            taskdicts, invocations = sweepTasks(taskdicts, invocations,
-                                                sweep_param)
+        tasks = sweepTasks(tasks, sweep)
+    return (taskloc, tasks)
 
-    # Store task definition files to disk
-    taskdictnames = []
-    for idx, taskdict in enumerate(taskdicts):
-        taskfname = op.join(taskloc, "task-{}.json".format(idx))
-        taskdictnames += [taskfname]
-        with open(taskfname, 'w') as fhandle:
-            fhandle.write(json.dumps(taskdict, indent=4, sort_keys=True))
 
-    return (taskdictnames, invocations)
+def invocationTasks(clowdrloc, task, invocation):
+    """invocationTasks
+    Creates a task for each invocation in a directory.
+
+    Parameters
+    ----------
+    clowdrloc : str
+        Path for storing Clowdr intermediate files and outputs
+    task : manifest.Task
+        Task which the others are copied from
+    invocation : str
+        Directory of Boutiques invocations
 
+    Yields
+    ------
+    tuple: (manifest.Task, None)
+        Each task; its invocation is already on disk.
+    """
+    for invoc in os.listdir(invocation):
+        tempinvo = utils.get(op.join(invocation, invoc), clowdrloc)
+        yield (task.replace(invocation=utils.truepath(tempinvo[0])), None)
 
-def sweepTasks(taskdicts, invocations, sweep_param):
-    tdicts = []
-    invos = []
 
-    for ttdict, tinvo in zip(taskdicts, invocations):
-        invo = json.load(open(tinvo))
-        sweep_vals = invo.get(sweep_param)
+class ParameterSweep:
+    """ParameterSweep
+    Cartesian product of the values of swept parameters, indexed lazily:
+    the combination of any task is decoded from its index, as a mixed-radix
+    number with one digit per dimension, so no other combination is ever
+    built. The first dimension varies slowest. Parameters zipped into one
+    dimension vary together, and must have as many values as each other.
 
-        for sval in sweep_vals:
-            tempdict = deepcopy(ttdict)
-            invo[sweep_param] = sval
+    Parameters
+    ----------
+    invocation : dict
+        Invocation listing the values of each swept parameter
+    dimensions : list
+        Swept dimensions; each a parameter ID, or parameter IDs joined by
+        commas to zip them (e.g. ["subject", "seed,init"])
+    """
+    def __init__(self, invocation, dimensions):
+        self.invocation = invocation
+        self.dimensions = []
+        for dimension in dimensions:
+            params = dimension.split(",")
+            values = []
+            for param in params:
+                if not isinstance(invocation.get(param), list):
+                    raise SystemExit("**Error: Swept parameter '{}' must be "
+                                     "a list of values in the invocation"
+                                     "".format(param))
+                values += [invocation[param]]
+            if len(set(len(vals) for vals in values)) > 1:
+                raise SystemExit("**Error: Zipped parameters '{}' must have "
+                                 "as many values as each other"
+                                 "".format(dimension))
+            self.dimensions += [(params, values)]
+        self.radices = [len(values[0]) for _, values in self.dimensions]
+
+    def __len__(self):
+        size = 1
+        for radix in self.radices:
+            size *= radix
+        return size
+
+    def __getitem__(self, index):
+        """__getitem__
+        Combination of parameter values of a task.
+
+        Returns
+        -------
+        list
+            (parameter ID, value) pairs, in order of the dimensions
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("Sweep index out of range: {}".format(index))
+        digits = []
+        for radix in reversed(self.radices):
+            index, digit = divmod(index, radix)
+            digits.insert(0, digit)
+        return [(param, vals[digit])
+                for (params, values), digit in zip(self.dimensions, digits)
+                for param, vals in zip(params, values)]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def sweepTasks(tasks, sweep):
+    """sweepTasks
+    Expands each task into one task per combination of swept parameters
+    (see "ParameterSweep").
+
+    Parameters
+    ----------
+    tasks : iterable
+        Pairs of tasks and invocations (see "generateTasks")
+    sweep : list
+        Swept dimensions, as parameter IDs whose value, in each invocation,
+        lists the values to use (or comma-separated IDs, to zip them)
+
+    Yields
+    ------
+    tuple: (manifest.Task, dict)
+        Each task, and its invocation.
+    """
+    for ttask, tinvo in tasks:
+        invo = tinvo if tinvo is not None else ttask.loadInvocation()
+        base, ext = op.splitext(ttask.invocation)
+
+        for combination in ParameterSweep(invo, sweep):
+            suffix = "".join("_sweep-{0}-{1}".format(param, sval)
+                             for param, sval in combination)
+            yield (ttask.replace(invocation=base + suffix + ext),
+                   dict(invo, **dict(combination)))
 
-            invofname = op.join(tinvo.replace(".json", "_sweep-"
-                                "{0}-{1}.json".format(sweep_param, sval)))
-            with open(invofname, 'w') as fhandle:
-                fhandle.write(json.dumps(invo, indent=4, sort_keys=True))
 
-            tempdict["invocation"] = invofname
-            invos += [invofname]
-            tdicts += [tempdict]
-    return (tdicts, invos)
+def _participantTask(clowdrloc, task, invo, part):
+    invofname = op.join(clowdrloc, "invocation_sub-{}.json".format(part))
+    return (task.replace(dataloc=[op.join(task.dataloc[0],
+                                          "sub-{}".format(part))],
+                         invocation=invofname),
+            dict(invo, participant_label=[part]))
 
 
-def bidsTasks(clowdrloc, taskdict):
+def _sessionTask(clowdrloc, task, invo, part, sesh):
+    invofname = op.join(clowdrloc, "invocation_"
+                        "sub-{}_ses-{}.json".format(part, sesh))
+    return (task.replace(dataloc=[op.join(task.dataloc[0],
+                                          "sub-{}".format(part),
+                                          "ses-{}".format(sesh))],
+                         invocation=invofname),
+            dict(invo, participant_label=[part], session_label=[sesh]))
+
+
+def bidsTasks(clowdrloc, task, **kwargs):
     """bidsTask
     Scans through BIDS app fields for creating more tasks than specified.
+    Participants (or sessions) which aren't specified are found in the
+    dataset (see "bids.scanLayout"), so that each gets its own task.
 
     Parameters
     ----------
     clowdrloc : str
         Path for storing Clowdr intermediate files and outputs
-    taskdict : str
-        Dictionary of the tasks (pre-BIDS-ification)
+    task : manifest.Task
+        Task of the whole dataset (pre-BIDS-ification)
+    **kwargs : dict
+        Arbitrary keyword arguments (i.e. {'verbose': True}), passed on to
+        "bids.scanLayout"
 
-    Returns
-    -------
-    tuple: (list, list)
-        The task dictionary JSONs, and associated Boutiques invocation files.
+    Yields
+    ------
+    tuple: (manifest.Task, dict)
+        Each task, and its invocation (None if unchanged).
     """
 
-    dataloc = taskdict["dataloc"][0]
-    invocation = taskdict["invocation"]
-
-    invo = json.load(open(invocation))
+    dataloc = task.dataloc[0]
+    invo = task.loadInvocation()
     participants = invo.get("participant_label")
     sessions = invo.get("session_label")
 
     # Case 1: User is running BIDS group-level analysis
     if invo.get("analysis_level") == "group":
-        return ([taskdict], [invocation])
+        yield (task, None)
+        return
+
+    # Participants and sessions which weren't specified are found in the
+    # dataset, if it can be indexed: on S3, or where the invocation says
+    # it is for local runs (whose dataloc is only "localhost")
+    layout = None
+    if not participants:
+        bidsdir = dataloc if dataloc.startswith("s3://") \
+            else invo.get("bids_dir", dataloc)
+        layout = bids.scanLayout(bidsdir, **kwargs)
 
     # Case 2: User is running BIDS participant- or session-level analysis
     #       ... and specified neither participant(s) nor session(s)
-    elif not participants and not sessions:
-        return ([taskdict], [invocation])
+    if not participants and not sessions:
+        if not layout:
+            yield (task, None)
+            return
+        for part in sorted(layout):
+            if not layout[part]:
+                yield _participantTask(clowdrloc, task, invo, part)
+            for sesh in layout[part]:
+                yield _sessionTask(clowdrloc, task, invo, part, sesh)
 
     # Case 3: User is running BIDS participant- or session-level analysis
     #       ... and specified participant(s) but not session(s)
     elif participants and not sessions:
-        taskdicts = []
-        invos = []
         for part in participants:
-            partstr = "sub-{}".format(part)
-
-            tempdict = deepcopy(taskdict)
-            tempdict["dataloc"] = [op.join(dataloc, partstr)]
-
-            invo["participant_label"] = [part]
-
-            invofname = op.join(clowdrloc, "invocation_sub-{}.json".format(part))
-            with open(invofname, 'w') as fhandle:
-                fhandle.write(json.dumps(invo, indent=4, sort_keys=True))
-
-            tempdict["invocation"] = invofname
-            invos += [invofname]
-            taskdicts += [tempdict]
-        return (taskdicts, invos)
+            yield _participantTask(clowdrloc, task, invo, part)
 
     # Case 4: User is running BIDS participant- or session-level analysis
     #       ... and specified participants(s) and session(s)
     elif participants and sessions:
-        taskdicts = []
-        invos = []
         for part in participants:
-            partstr = "sub-{}".format(part)
-
             for sesh in sessions:
-                seshstr = "ses-{}".format(sesh)
-
-                tempdict = deepcopy(taskdict)
-                tempdict["dataloc"] = [op.join(dataloc, partstr, seshstr)]
-
-                invo["participant_label"] = [part]
-                invo["session_label"] = [sesh]
-
-                invofname = op.join(clowdrloc, "invocation_"
-                                    "sub-{}_ses-{}.json".format(part, sesh))
-                with open(invofname, 'w') as fhandle:
-                    fhandle.write(json.dumps(invo, indent=4, sort_keys=True))
-
-                tempdict["invocation"] = invofname
-                invos += [invofname]
-                taskdicts += [tempdict]
-        return (taskdicts, invos)
+                yield _sessionTask(clowdrloc, task, invo, part, sesh)
 
     # Case 5: User is running BIDS participant- or session-level analysis
     #       ... and specified sessions(s) but not participant(s)
     elif sessions and not participants:
-        taskdicts = []
-        invos = []
         for sesh in sessions:
-            seshstr = "ses-{}".format(sesh)
-
-            tempdict = deepcopy(taskdict)
-            tempdict["dataloc"] = [op.join(dataloc)]
-
-            invo["session_label"] = [sesh]
-
-            invofname = op.join(clowdrloc, "invocation_ses-{}.json".format(sesh))
-            with open(invofname, 'w') as fhandle:
-                fhandle.write(json.dumps(invo, indent=4, sort_keys=True))
-
-            tempdict["invocation"] = invofname
-            invos += [invofname]
-            taskdicts += [tempdict]
-        return (taskdicts, invos)
+            if not layout:
+                invofname = op.join(clowdrloc,
+                                    "invocation_ses-{}.json".format(sesh))
+                yield (task.replace(invocation=invofname),
+                       dict(invo, session_label=[sesh]))
+                continue
+            for part in sorted(layout):
+                if sesh in layout[part]:
+                    yield _sessionTask(clowdrloc, task, invo, part, sesh)
 
 
 def prepareForRemote(tasks, tmploc, clowdrloc):
@@ -251,22 +401,24 @@ def prepareForRemote(tasks, tmploc, clowdrloc):
         The task dictionary JSONs, and associated Boutiques invocation files.
     """
 
-    # Modify tasks
-    for task in tasks:
-        with open(task) as fhandle:
-            task_dict = json.load(fhandle)
-
-        task_dict["invocation"] = op.join(clowdrloc,
-                                          op.relpath(task_dict["invocation"],
-                                                     tmploc))
-        task_dict["taskloc"] = op.join(clowdrloc,
-                                       op.relpath(task_dict["taskloc"],
-                                                  tmploc))
-        task_dict["tool"] = op.join(clowdrloc, op.relpath(task_dict["tool"],
-                                                          tmploc))
-
-        with open(task, 'w') as fhandle:
-            fhandle.write(json.dumps(task_dict, indent=4, sort_keys=True))
+    def remote(task):
+        return task.replace(
+            invocation=op.join(clowdrloc, op.relpath(task.invocation,
+                                                     tmploc)),
+            taskloc=op.join(clowdrloc, op.relpath(task.taskloc, tmploc)),
+            tool=op.join(clowdrloc, op.relpath(task.tool, tmploc)))
+
+    # Modify tasks, in their files or in their run's manifest
+    rundirs = set()
+    for taskfile in tasks:
+        if not op.isfile(taskfile):
+            rundirs.add(op.dirname(taskfile))
+            continue
+        remote(manifest.loadTask(taskfile)).save(taskfile)
+
+    for rundir in rundirs:
+        if op.isfile(op.join(rundir, manifest.MANIFEST)):
+            manifest.rewrite(rundir, lambda tid, record: remote(
+                manifest.Task.fromDict(record)))
 
     return 0
-
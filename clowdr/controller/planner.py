@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/controller/planner.py
+# Created by Greg Kiar on 2018-06-11.
+# Email: gkiar@mcin.ca
+
+from datetime import timedelta
+import numpy as np
+import heapq
+import json
+
+from clowdr.controller.history import HEADROOM, balanceGroups
+
+
+def taskResources(past=None, descriptor=None, ram=None, cpus=None):
+    """taskResources
+    Predicts the RAM and CPUs a single task of a tool needs: the declared
+    values, else the largest seen in past runs, else those suggested in the
+    descriptor. Unlike "history.taskDemand", all tasks are sized alike, so
+    that large launches can be planned without reading every task file.
+
+    Parameters
+    ----------
+    past : dict
+        Output of "history.loadHistory"
+    descriptor : str
+        Path to the Boutiques descriptor of the tool
+    ram : float
+        Declared RAM, in MB
+    cpus : float
+        Declared number of CPUs
+
+    Returns
+    -------
+    dict
+        Predicted "ram" (in MB, 0 when unknown) and "cpus" (at least 1)
+    """
+    records = list((past or {}).values())
+    if ram is None:
+        seen = [r["ram"] for r in records if r.get("ram") is not None]
+        ram = max(seen) * HEADROOM if seen else None
+    if cpus is None:
+        seen = [r["cpus"] for r in records if r.get("cpus") is not None]
+        cpus = max(seen) if seen else None
+
+    if descriptor and None in [ram, cpus]:
+        with open(descriptor) as fhandle:
+            suggested = json.load(fhandle).get("suggested-resources") or {}
+        if ram is None and suggested.get("ram"):
+            ram = float(suggested["ram"]) * 1024
+        if cpus is None and suggested.get("cpu-cores"):
+            cpus = float(suggested["cpu-cores"])
+
+    return {"ram": ram or 0, "cpus": max(int(np.ceil(cpus or 1)), 1)}
+
+
+def simulate(costs, workers, groupby=1, balance=False, overhead=0):
+    """simulate
+    Simulates the schedule of a launch: tasks are grouped as "clowdr local"
+    would group them, and each group starts, in order, on the first worker
+    to become free (a job slot, a node, or a share of a compute environment).
+
+    Parameters
+    ----------
+    costs : list
+        Predicted duration of each task, in seconds (see "history.taskCosts")
+    workers : int
+        Number of groups which can run at once
+    groupby : int
+        Number of tasks per group
+    balance : bool
+        Groups the tasks by duration, as with "clowdr local --balance"
+    overhead : float
+        Time, in seconds, added to each group (e.g. scheduling, image pull)
+
+    Returns
+    -------
+    dict
+        Predicted "makespan" and total "busy" time of the workers (in
+        seconds), and the "utilization" of the workers, along with the
+        number of "workers" and "groups"
+    """
+    gsize = max(groupby or 1, 1)
+    if balance and gsize > 1:
+        groups = balanceGroups(range(len(costs)), gsize, costs)
+        durations = [sum(costs[idx] for idx in group) for group in groups]
+    else:
+        csum = np.concatenate([[0], np.cumsum(costs, dtype=float)])
+        bounds = list(range(0, len(costs), gsize)) + [len(costs)]
+        durations = list(np.diff(csum[bounds]))
+    durations = [duration + overhead for duration in durations]
+
+    # Each worker is represented by the time at which it next becomes free
+    workers = max(min(int(workers), len(durations)), 1)
+    free = [0.0] * workers
+    for duration in durations:
+        heapq.heapreplace(free, free[0] + duration)
+
+    makespan = max(free)
+    busy = float(sum(durations))
+    return {"workers": workers,
+            "groups": len(durations),
+            "makespan": makespan,
+            "busy": busy,
+            "utilization": busy / (workers * makespan) if makespan else 0.0}
+
+
+def report(plans, cpus=1, price=None):
+    """report
+    Formats simulated schedules (see "simulate") as a table, one row each.
+    The cost is the CPU-hours used by the tasks, each using "cpus" CPUs,
+    times "price" per CPU-hour.
+    """
+    header = ["Workers", "Groups", "Makespan", "Utilization", "CPU-hours"]
+    if price is not None:
+        header += ["Cost"]
+    rows = [header]
+    for plan in plans:
+        cpuhours = plan["busy"] * cpus / 3600
+        row = [str(plan["workers"]),
+               str(plan["groups"]),
+               str(timedelta(seconds=int(round(plan["makespan"])))),
+               "{:.1f}%".format(plan["utilization"] * 100),
+               "{:.1f}".format(cpuhours)]
+        if price is not None:
+            row += ["{:.2f}".format(cpuhours * price)]
+        rows += [row]
+    widths = [max(len(row[col]) for row in rows)
+              for col in range(len(header))]
+    return "\n".join("  ".join(cell.rjust(width)
+                               for cell, width in zip(row, widths))
+                     for row in rows)
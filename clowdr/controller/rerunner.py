@@ -13,6 +13,8 @@ import sys
 import os
 import re
 
+from clowdr.controller.submitter import readCursor, CURSOR
+from clowdr import manifest
 from clowdr import utils
 
 
@@ -21,12 +23,16 @@ def getTasks(provdir, runid, rerun_mode):
 
     files = os.listdir(runpath)
     r_all = re.compile('^.*task-([0-9]+)[.]json$')
-    all_tasks = sorted([op.join(runpath, f)
-                        for f in filter(r_all.match, files)])
+    all_tasks = manifest.listTasks(runpath)
 
     if rerun_mode == "all":
         return all_tasks
 
+    if rerun_mode == "unsubmitted":
+        submitted = readCursor(op.join(runpath, CURSOR))
+        return [task for task in all_tasks
+                if op.basename(task) not in submitted]
+
     all_ids = set([r_all.match(f).group(1)
                    for f in all_tasks
                    if r_all.match(f)])
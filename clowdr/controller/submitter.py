@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/controller/submitter.py
+# Created by Greg Kiar on 2018-06-11.
+# Email: gkiar@mcin.ca
+
+from subprocess import Popen, PIPE
+import os.path as op
+import threading
+import getpass
+import time
+
+
+CURSOR = "clowdr-submitted.txt"
+
+# Default limit on the number of elements of an array job, in SLURM
+MAX_ARRAY_SIZE = 1001
+
+
+def readCursor(cursorfile):
+    """readCursor
+    Reads the tasks already submitted, as recorded by a Submitter.
+
+    Returns
+    -------
+    dict
+        Mapping of the name of each submitted task file to its job ID
+    """
+    submitted = {}
+    if not op.isfile(cursorfile):
+        return submitted
+    with open(cursorfile) as fhandle:
+        for line in fhandle:
+            fields = line.split()
+            for task in fields[1:]:
+                submitted[op.basename(task)] = fields[0]
+    return submitted
+
+
+def pendingJobs(jobname=None, user=None):
+    """pendingJobs
+    Counts the pending jobs of a user in the SLURM queue, through squeue.
+    Array jobs count once per pending element.
+
+    Parameters
+    ----------
+    jobname : str
+        Only count jobs whose name starts with this
+    user : str
+        User whose jobs are counted. Defaults to the current user
+
+    Returns
+    -------
+    int
+        Number of pending jobs
+    """
+    cmd = ["squeue", "-h", "-r", "-t", "PENDING", "-o", "%i %j",
+           "-u", user or getpass.getuser()]
+    proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise OSError("squeue failed: {}".format(stderr.decode("utf-8",
+                                                               "replace")))
+    jobs = [line.split(None, 1) for line in stdout.decode("utf-8").splitlines()
+            if line.strip()]
+    return len([job for job in jobs
+                if not jobname or (len(job) > 1 and
+                                   job[1].startswith(jobname))])
+
+
+def maxArraySize():
+    """maxArraySize
+    Largest number of elements of an array job accepted by the SLURM
+    cluster ("MaxArraySize" in its configuration), read through scontrol.
+    Defaults to SLURM's own default when it can't be read.
+    """
+    try:
+        proc = Popen(["scontrol", "show", "config"], stdout=PIPE,
+                     stderr=PIPE)
+        stdout, _ = proc.communicate()
+    except OSError:
+        return MAX_ARRAY_SIZE
+    for line in stdout.decode("utf-8", "replace").splitlines():
+        fields = line.split("=", 1)
+        if fields[0].strip() == "MaxArraySize" and len(fields) > 1:
+            try:
+                return int(fields[1]) or MAX_ARRAY_SIZE
+            except ValueError:
+                break
+    return MAX_ARRAY_SIZE
+
+
+class Submitter:
+    """Submitter
+    Submits task groups to a scheduler, keeping up to "inflight" submissions
+    running at once, and holding back while the queue has "max_pending" or
+    more pending jobs. Each submission is appended to a cursor file in the
+    run directory, so an interrupted launch can be resumed (see
+    "rerunner.getTasks", in "unsubmitted" mode). Failed submissions are
+    retried with exponential back-off, capped at "max_wait" seconds.
+
+    Parameters
+    ----------
+    submit : function
+        Called with a task group; submits it and returns the job ID
+    cursorfile : str
+        File recording the submitted task groups
+    inflight : int
+        Maximum number of submissions running at once
+    max_pending : int
+        Maximum number of pending jobs in the queue, or None for no limit
+    poll : float
+        Time, in seconds, between checks of the queue while it is full
+    backoff_time : float
+        Time, in seconds, after which a failing submission is abandoned
+    jobname : str
+        Name prefix of the jobs counted as pending
+    """
+    def __init__(self, submit, cursorfile, inflight=4, max_pending=None,
+                 poll=30, backoff_time=36000, max_wait=60, jobname=None,
+                 verbose=False):
+        self.submit = submit
+        self.cursorfile = cursorfile
+        self.inflight = inflight
+        self.max_pending = max_pending
+        self.poll = poll
+        self.backoff_time = backoff_time
+        self.max_wait = max_wait
+        self.jobname = jobname
+        self.verbose = verbose
+        self.submitted = []
+        self.failed = []
+        self._slots = threading.BoundedSemaphore(inflight)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+
+    def pending(self):
+        try:
+            return pendingJobs(self.jobname)
+        except OSError as e:
+            if self.verbose:
+                print("Could not read the queue: {}".format(e), flush=True)
+            return 0
+
+    def throttle(self):
+        # Waits for room in the queue. Jobs submitted since the last check
+        # are counted as pending, so the queue is never overfilled
+        if self.max_pending is None:
+            return
+        while True:
+            with self._lock:
+                if self._queued < self.max_pending:
+                    self._queued += 1
+                    return
+            time.sleep(self.poll)
+            with self._lock:
+                self._queued = self.pending() + self._active
+
+    def work(self, taskgroup):
+        try:
+            waited = 0
+            attempt = 0
+            while True:
+                try:
+                    jobid = self.submit(taskgroup)
+                    break
+                except Exception as e:
+                    wait = min(2 ** attempt, self.max_wait)
+                    if waited + wait > self.backoff_time:
+                        if self.verbose:
+                            print("Failed. Skipping {}: {}"
+                                  "".format(", ".join(taskgroup), e),
+                                  flush=True)
+                        with self._lock:
+                            self.failed += [taskgroup]
+                        return
+                    if self.verbose:
+                        print("Submission failed ({}). Retrying in: {}s"
+                              "".format(type(e).__name__, wait), flush=True)
+                    time.sleep(wait)
+                    waited += wait
+                    attempt += 1
+
+            with self._lock:
+                with open(self.cursorfile, "a") as fhandle:
+                    fhandle.write("{} {}\n".format(jobid, " ".join(taskgroup)))
+                self.submitted += [(taskgroup, jobid)]
+            if self.verbose:
+                print("... Submitted task(s): {} (job {})"
+                      "".format(", ".join(taskgroup), jobid), flush=True)
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._slots.release()
+
+    def run(self, taskgroups):
+        """run
+        Submits all task groups, and waits for the submissions to finish.
+
+        Returns
+        -------
+        list
+            Task groups whose submission failed
+        """
+        if self.max_pending is not None:
+            self._queued = self.pending()
+        threads = []
+        for taskgroup in taskgroups:
+            self.throttle()
+            self._slots.acquire()
+            with self._lock:
+                self._active += 1
+            thread = threading.Thread(target=self.work, args=(taskgroup,))
+            thread.daemon = True
+            thread.start()
+            threads += [thread]
+        for thread in threads:
+            thread.join()
+        return self.failed
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/controller/validator.py
+# Created by Greg Kiar on 2018-06-11.
+# Email: gkiar@mcin.ca
+
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import os.path as op
+import hashlib
+import json
+
+import boutiques as bosh
+from clowdr.cache import fileDigest
+from clowdr import manifest
+from clowdr import utils
+
+
+# Descriptors loaded by each validation process, and their invocation schema
+_schemas = {}
+
+
+def defaultCacheDir():
+    """defaultCacheDir
+    Directory in which validation results are cached by default.
+    """
+    return utils.cacheDir("validation")
+
+
+def invocationKey(invocation):
+    """invocationKey
+    SHA-256 of an invocation, independent of the order of its parameters.
+    """
+    content = json.dumps(invocation, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _message(error):
+    lines = [line.replace("[ ERROR ]", "").strip()
+             for line in str(error).split("\n")]
+    return next((line for line in lines if line), type(error).__name__)
+
+
+def _check(descriptor, invocation):
+    # Validates an invocation (as JSON text) in a worker process, building
+    # the descriptor's schema once per process rather than once per
+    # invocation as "bosh invocation" does
+    try:
+        try:
+            from boutiques.invocationSchemaHandler import \
+                generateInvocationSchema, validateSchema
+            from boutiques.localExec import addDefaultValues
+        except ImportError:
+            bosh.invocation(descriptor, "-i", invocation)
+            return None
+        if descriptor not in _schemas:
+            with open(descriptor) as fhandle:
+                desc = json.load(fhandle, object_pairs_hook=OrderedDict)
+            _schemas[descriptor] = (desc, desc.get("invocation-schema") or
+                                    generateInvocationSchema(desc))
+        desc, schema = _schemas[descriptor]
+        invo = json.loads(invocation, object_pairs_hook=OrderedDict)
+        validateSchema(schema, addDefaultValues(desc, invo))
+    except (Exception, SystemExit) as e:
+        return _message(e)
+    return None
+
+
+def validateTasks(descriptor, tasks, jobs=None, cachedir=None,
+                  verbose=False):
+    """validateTasks
+    Validates the invocation of each task against the descriptor, with
+    Boutiques, in a pool of processes. Results are cached by descriptor
+    and invocation (see "invocationKey"), so that invocations validated
+    by an earlier launch, or shared by several tasks, are only validated
+    once.
+
+    Parameters
+    ----------
+    descriptor : str
+        Path to the Boutiques descriptor of the tasks
+    tasks : list
+        Task files, or tasks stored in a manifest (see "manifest.loadTask")
+    jobs : int
+        Number of processes validating invocations. Defaults to one per CPU
+    cachedir : str
+        Directory of the cached results (see "defaultCacheDir")
+    verbose : bool
+        Toggle verbose output printing
+
+    Returns
+    -------
+    dict
+        Error message of each task whose invocation is invalid
+    """
+    # An invalid descriptor is reported once, rather than for every task
+    try:
+        bosh.validate(descriptor)
+    except (Exception, SystemExit) as e:
+        raise SystemExit("**Error: Descriptor {} is invalid: {}"
+                         "".format(descriptor, _message(e)))
+
+    cachefile = op.join(cachedir if cachedir else defaultCacheDir(),
+                        "{}.json".format(fileDigest(descriptor)))
+    results = utils.loadCache(cachefile)
+
+    keys = {}
+    pending = OrderedDict()
+    for taskfile in tasks:
+        invo = manifest.loadTask(taskfile).loadInvocation()
+        key = invocationKey(invo)
+        keys[taskfile] = key
+        if key not in results:
+            pending[key] = json.dumps(invo)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            checked = executor.map(_check, [descriptor] * len(pending),
+                                   list(pending.values()),
+                                   chunksize=max(len(pending) // 64, 1))
+            results.update(zip(pending, checked))
+        utils.saveCache(cachefile, results)
+    if verbose:
+        print("Validated {} invocation(s): {} distinct, {} of them cached"
+              "".format(len(keys), len(set(keys.values())),
+                        len(set(keys.values())) - len(pending)), flush=True)
+
+    return {taskfile: results[key] for taskfile, key in keys.items()
+            if results[key] is not None}
@@ -8,15 +8,23 @@
 # Email: gkiar@mcin.ca
 
 from argparse import ArgumentParser, RawTextHelpFormatter
+from itertools import chain
 import argparse
 import os.path as op
 import tempfile
+import shutil
 import json
 import sys
 import os
 
-from clowdr.controller import metadata, launcher, rerunner
+from clowdr.controller import metadata, launcher, rerunner, history, memo
+from clowdr.controller import planner
+from clowdr.controller.submitter import Submitter, CURSOR, \
+    maxArraySize
 from clowdr.task import TaskHandler
+from clowdr.pool import TaskPool, Admission, parseJobs
+from clowdr.cache import ImageCache
+from clowdr import manifest
 # from clowdr.server import shareapp, updateIndex
 from clowdr.share import consolidate, portal
 from clowdr import utils
@@ -25,7 +33,11 @@ from clowdr import utils
 def local(descriptor, invocation, provdir, backoff_time=36000, sweep=[],
           verbose=False, workdir=None, simg=None, rerun=None, run_id=None,
           volumes=None, s3=None, cluster=None, jobname=None, clusterargs=None,
-          dev=False, groupby=None, user=False, setup=False, **kwargs):
+          dev=False, groupby=None, user=False, setup=False, jobs=1,
+          history_dirs=None, task_ram=None, task_cpus=None, balance=False,
+          cost_file=None, cost_column="cost", array=False, submit_jobs=4,
+          max_pending=None, memoize=False, speculate=None,
+          speculate_factor=1.5, **kwargs):
     """cluster
     Launches a pipeline locally through the Clowdr wrappers.
 
@@ -55,6 +67,43 @@ def local(descriptor, invocation, provdir, backoff_time=36000, sweep=[],
             Toggle verbose output printing
         - dev : bool
             Toggle dev mode (only runs first execution in the specified set)
+        - array : bool
+            Submits all task groups to the cluster as array jobs, as few as
+            its maximum array size allows
+        - submit_jobs : int
+            Number of submissions to the cluster running at once
+        - max_pending : int
+            Holds back submissions while the cluster's queue has this many
+            pending jobs of the user
+        - jobs : int
+            Number of task groups run in parallel, when not using a cluster
+        - history_dirs : list
+            Directories of past runs, used to predict the RAM and CPUs each
+            task needs when running tasks in parallel
+        - task_ram : float
+            RAM, in MB, needed by each task (overrides the history)
+        - task_cpus : float
+            Number of CPUs needed by each task (overrides the history)
+        - balance : bool
+            Groups tasks so that each group takes about as long to run,
+            based on their durations in past runs (or on cost_file)
+        - cost_file : str
+            CSV file with the cost of each task, used when balancing groups
+        - cost_column : str
+            Column of the cost file holding the costs
+        - memoize : bool
+            Reuses the results of tasks which already succeeded in a past run
+            (in provdir, or history_dirs) with the same descriptor,
+            invocation and input files, instead of running them again
+        - speculate : float
+            Quantile of completed task durations past which a running task
+            group is a straggler, and is started a second time (see
+            "pool.TaskPool")
+        - speculate_factor : float
+            Multiple of the quantile past which a group is a straggler
+        - validate : bool
+            Validates all invocations against the descriptor before
+            launching any task (see "controller.validator.validateTasks")
 
         Additionally, transfers all keyword arguments accepted by both of
         "controller.metadata.consolidateTask" and "task.TaskHandler"
@@ -69,6 +118,10 @@ def local(descriptor, invocation, provdir, backoff_time=36000, sweep=[],
     tool = utils.truepath(descriptor)
     if simg:
         simg = utils.truepath(simg)
+    if history_dirs:
+        history_dirs = [utils.truepath(hdir) for hdir in history_dirs]
+    if cost_file:
+        cost_file = utils.truepath(cost_file)
 
     if verbose:
         print("Consolidating metadata...")
@@ -83,19 +136,53 @@ def local(descriptor, invocation, provdir, backoff_time=36000, sweep=[],
             if verbose:
                 print("No tasks to run.")
             return 0
+        first = tasks[0]
 
-    else:
-        [tasks, invocs] = metadata.consolidateTask(descriptor, invocation,
-                                                   provdir, dataloc,
-                                                   sweep=sweep, **kwargs)
+    elif kwargs.get("validate"):
+        # All invocations are validated before any task is launched
+        tasks = metadata.consolidateTask(descriptor, invocation, provdir,
+                                         dataloc, sweep=sweep,
+                                         verbose=verbose, **kwargs)[0]
+        first = tasks[0] if tasks else None
 
-    taskdir = op.dirname(utils.truepath(tasks[0]))
+    else:
+        # Tasks are created lazily, so the first ones can be launched while
+        # the others are still being created
+        generated = metadata.generateTasks(descriptor, invocation, provdir,
+                                           dataloc, sweep=sweep, **kwargs)
+        first = next(generated, (None, None))[0]
+        tasks = chain([first], (task for task, _ in generated))
+
+    # e.g. an empty sweep, or a BIDS dataset without participants
+    if first is None:
+        raise SystemExit("**Error: No tasks were generated from invocation "
+                         "{}".format(invocation))
+
+    # Only launching tasks one after another, or submitting them to a
+    # cluster, consumes them as they are created
+    if memoize or setup or balance or dev or (not cluster and jobs > 1):
+        tasks = list(tasks)
+
+    taskdir = op.dirname(utils.truepath(first))
     try:
         os.mkdir(taskdir)
     except FileExistsError:
         pass
     os.chdir(taskdir)
 
+    if memoize and not rerun:
+        # Link the results of unchanged tasks from past runs
+        ntasks = len(tasks)
+        tasks = memo.memoize(tasks, history_dirs or
+                             [op.dirname(op.dirname(taskdir))],
+                             basedir=workdir or taskdir, verbose=verbose)
+        if verbose:
+            print("Reused the results of {} task(s)."
+                  "".format(ntasks - len(tasks)))
+        if not len(tasks):
+            print(taskdir)
+            return taskdir
+
     if setup:
         print(taskdir)
         return taskdir
@@ -103,13 +190,23 @@ def local(descriptor, invocation, provdir, backoff_time=36000, sweep=[],
     with open(tool) as fhandle:
         container = json.load(fhandle).get("container-image")
 
-    if container:
+    if container and kwargs.get("image_cache") is not None:
+        # Tasks take the image from the node's cache; fill it once up front
+        if verbose:
+            print("Getting container (image cache)...")
+        if not cluster:
+            cache = ImageCache(kwargs["image_cache"] or None,
+                               max_size=kwargs.get("image_cache_size"),
+                               verbose=verbose)
+            with cache.use(container, simg=simg):
+                pass
+    elif container:
         if verbose:
             print("Getting container...")
-        outp = utils.getContainer(taskdir, container, **kwargs)
+        outp = utils.getContainer(taskdir, container, simg=simg, **kwargs)
 
     if cluster:
-        from slurmpy import Slurm
+        from slurmpy import Slurm, slurmpy
         jobname = jobname if jobname else "clowdr"
         cargs = {}
         if clusterargs:
@@ -125,33 +222,140 @@ def local(descriptor, invocation, provdir, backoff_time=36000, sweep=[],
         if volumes:
             script += " ".join([" -v {}".format(vol)
                                 for vol in volumes])
+        if kwargs.get("sample_interval"):
+            script += " --sample-interval {}".format(kwargs["sample_interval"])
+        if kwargs.get("sample_source"):
+            script += " --sample-source {}".format(kwargs["sample_source"])
+        if kwargs.get("usage_points"):
+            script += " --usage-points {}".format(kwargs["usage_points"])
+        if kwargs.get("usage_full"):
+            script += " --usage-full"
+        if kwargs.get("usage_format"):
+            script += " --usage-format {}".format(kwargs["usage_format"])
+        if kwargs.get("stream_logs"):
+            script += " --stream-logs"
+        if kwargs.get("image_cache") is not None:
+            script += " --image-cache {}".format(kwargs["image_cache"])
+        if kwargs.get("image_cache_size"):
+            script += " --image-cache-size {}".format(
+                kwargs["image_cache_size"])
+        if jobs > 1:
+            script += " --jobs {}".format(jobs)
+            if speculate is not None:
+                script += " --speculate {} --speculate-factor {}".format(
+                    speculate, speculate_factor)
         if verbose:
             script += " -V"
 
     # Groups tasks into collections to be run together (default size = 1)
     gsize = groupby if groupby else 1
-    taskgroups = [tasks[i:i+gsize] for i in range(0, len(tasks), gsize)]
+    if balance and gsize > 1:
+        # Balance the groups using past runs of this tool, or given costs
+        costs = history.loadCosts(cost_file, cost_column) if cost_file \
+            else None
+        past = history.loadHistory(history_dirs or
+                                   [op.dirname(op.dirname(taskdir))],
+                                   descriptor=tool)
+        costs = history.taskCosts(tasks, history=past, costs=costs)
+        taskgroups = history.balanceGroups(tasks, gsize, costs)
+        if verbose:
+            loads = dict(zip(tasks, costs))
+            print("Balanced {} task(s) into {} group(s); longest group: {:.1f}"
+                  "".format(len(tasks), len(taskgroups),
+                            sum(loads[t] for t in taskgroups[0])))
+    else:
+        taskgroups = utils.chunks(tasks, gsize)
 
     if dev:
-        taskgroups = [taskgroups[0]]  # Just launch the first in dev mode
+        taskgroups = [next(iter(taskgroups))]  # Only the first in dev mode
 
     if verbose:
         print("Launching tasks...")
 
+    if not cluster and jobs > 1:
+        # Only start tasks when their predicted RAM and CPUs are available
+        taskgroups = list(taskgroups)
+        past = history.loadHistory(history_dirs or
+                                   [op.dirname(op.dirname(taskdir))],
+                                   descriptor=tool)
+        demands = [history.groupDemand(taskgroup, history=past,
+                                       ram=task_ram, cpus=task_cpus,
+                                       descriptor=tool)
+                   for taskgroup in taskgroups]
+        pool = TaskPool(runtask, jobs=jobs, admission=Admission(),
+                        speculate=speculate, factor=speculate_factor,
+                        rundir=taskdir,
+                        verbose=verbose, provdir=taskdir, local=True,
+                        workdir=workdir, volumes=volumes, user=user, **kwargs)
+        try:
+            pool.run(taskgroups, demands)
+        except KeyboardInterrupt:
+            raise SystemExit("**Error: Interrupted after {} of {} task "
+                             "group(s)".format(len(pool.results),
+                                               len(taskgroups)))
+        taskgroups = []
+
+    if cluster and array:
+        # Submit array jobs; each element runs the task group found on its
+        # line of the index file. Groups are split across as few array jobs
+        # as the cluster's maximum array size allows, each starting from its
+        # own line of the index
+        indexf = op.join(taskdir, "clowdr-array-index.txt")
+        ngroups = 0
+        with open(indexf, "w") as fhandle:
+            for taskgroup in taskgroups:
+                fhandle.write(" ".join(taskgroup) + "\n")
+                ngroups += 1
+        size = maxArraySize()
+        offsets = range(0, ngroups, size)
+        lookup = 'TASKS=$(sed -n "$((SLURM_ARRAY_TASK_ID + {}))p" {})\n'
+        if verbose:
+            print("... Submitting {} task group(s) as {} array job(s)"
+                  "".format(ngroups, len(offsets)))
+        for offset in offsets:
+            count = min(size, ngroups - offset)
+            jargs = dict(cargs, array="0-{}".format(count - 1))
+            job = Slurm(jobname, jargs,
+                        tmpl=slurmpy.TMPL.replace("%J", "%A_%a"))
+            args = [lookup.format(offset + 1, indexf) +
+                    script.format("${TASKS}", taskdir)]
+            name = "array" if len(offsets) == 1 \
+                else "array-{}".format(offset // size)
+            utils.backoff(job.run, args, {"name_addition": name},
+                          backoff_time=backoff_time, **kwargs)
+        taskgroups = []
+
+    if cluster and taskgroups:
+        def submit(taskgroup):
+            if verbose:
+                print("... Processing task(s): {}"
+                      "".format(", ".join(taskgroup)))
+            # Each submission gets its own job, as Slurm.run isn't reentrant
+            jobid = Slurm(jobname, dict(cargs)).run(
+                script.format(" ".join(taskgroup), taskdir))
+            if jobid is None:
+                raise OSError("Submission was not accepted by the scheduler")
+            return jobid
+
+        # Submit several groups at once, while the queue has room. If a
+        # submission fails, it is retried with (capped) exponential back-off
+        submitter = Submitter(submit, op.join(taskdir, CURSOR),
+                              inflight=submit_jobs, max_pending=max_pending,
+                              backoff_time=backoff_time, jobname=jobname,
+                              verbose=verbose)
+        failed = submitter.run(taskgroups)
+        if failed:
+            print("Submission failed for {} task group(s); resume with: "
+                  "--rerun unsubmitted --run_id {}"
+                  "".format(len(failed), op.basename(op.dirname(taskdir))))
+        taskgroups = []
+
     for taskgroup in taskgroups:
         if verbose:
             print("... Processing task(s): {}".format(", ".join(taskgroup)))
 
-        if cluster:
-            tmptaskgroup = " ".join(taskgroup)
-            func = job.run
-            args = [script.format(tmptaskgroup, taskdir)]
-            # Submit. If submission fails, retry with fibonnaci back-off
-            utils.backoff(func, args, {},
-                          backoff_time=backoff_time, **kwargs)
-        else:
-            runtask(taskgroup, provdir=taskdir, local=True, verbose=verbose,
-                    workdir=workdir, volumes=volumes, user=user,  **kwargs)
+        runtask(taskgroup, provdir=taskdir, local=True, verbose=verbose,
+                workdir=workdir, volumes=volumes, user=user,  **kwargs)
 
     if verbose:
         print(taskdir)
@@ -196,25 +400,145 @@ def cloud(descriptor, invocation, provdir, s3, cloud, credentials, **kwargs):
     metadata.prepareForRemote(tasks, tmploc, provdir)
     resource = launcher.configureResource(cloud, credentials, **kwargs)
 
-    tasks_remote = [task for task in utils.post(tmploc, provdir)
-                    if "task-" in task]
+    uploaded = utils.post(tmploc, provdir)
+    tasks_remote = [task for task in uploaded if "task-" in task]
+    if kwargs.get("manifest"):
+        # Tasks are read from the uploaded manifest, by their usual path
+        rundir = [op.dirname(up) for up in uploaded
+                  if op.basename(up) == manifest.MANIFEST][0]
+        tasks_remote = [op.join(rundir, op.basename(task)) for task in tasks]
 
     if kwargs.get("dev"):
         tasks_remote = [tasks_remote[0]]  # Just launch the first in dev mode
 
+    # Options forwarded to "clowdr task" within each job
+    taskargs = ["--upload-jobs", str(kwargs.get("upload_jobs") or 4)]
+    if kwargs.get("stream_logs"):
+        taskargs += ["--stream-logs",
+                     "--log-interval", str(kwargs.get("log_interval") or 60)]
+
     jids = []
     for task in tasks_remote:
-        jids += [resource.launchJob(task)]
+        jids += [resource.launchJob(task, taskargs=taskargs)]
 
     taskdir = op.dirname(utils.truepath(tasks_remote[0]))
     print(taskdir)
     return taskdir, jids
 
 
-def runtask(tasklist, **kwargs):
+def plan(descriptor, invocation, provdir, s3=None, workers=None,
+         max_vcpus=None, groupby=None, balance=False, history_dirs=None,
+         cost_file=None, cost_column="cost", task_ram=None, task_cpus=None,
+         overhead=0, price=None, verbose=False, **kwargs):
+    """plan
+    Predicts how long a launch will take, without running it. The tasks are
+    created as "clowdr local" would create them, their durations are taken
+    from past runs, and their schedule is simulated for each pool of workers.
+
+    Parameters
+    ----------
+    descriptor : str
+        Path to a boutiques descriptor for the tool to be run
+    invocation : str
+        Path to a boutiques invocation for the tool and parameters to be run
+    provdir : str
+        Path where Clowdr stored past runs of the tool
+    s3 : str
+        Path on S3 for accessing input data
+    workers : list
+        Numbers of tasks (or groups) run at once to plan for
+    max_vcpus : list
+        Sizes of compute environments (e.g. "maxvCpus" on AWS Batch) to plan
+        for; each fits as many tasks as the CPUs they need allow
+    **kwargs : dict
+        Arbitrary keyword arguments. Currently supported arguments:
+        - groupby, balance, cost_file, cost_column, task_ram, task_cpus
+            As in "local"
+        - history_dirs : list
+            Directories of past runs. Defaults to provdir
+        - overhead : float
+            Time, in seconds, added to each job
+        - price : float
+            Cost of a CPU-hour
+
+        Additionally, transfers all keyword arguments accepted by
+        "controller.metadata.consolidateTask"
+
+    Returns
+    -------
+    list
+        The simulated schedules (see "controller.planner.simulate")
+    """
+    descriptor = descriptor.name
+    tool = utils.truepath(descriptor)
+    history_dirs = [utils.truepath(hdir)
+                    for hdir in history_dirs or [provdir]]
+
+    if verbose:
+        print("Consolidating metadata...")
+    tmploc = utils.truepath(tempfile.mkdtemp())
+    try:
+        # Only the names of the tasks and their invocations are needed, so
+        # none of them is stored
+        _, created = metadata.createTasks(descriptor, invocation, tmploc,
+                                          s3 or "localhost", **kwargs)
+        keys = [op.basename(task.invocation) for task, _ in created]
+    finally:
+        shutil.rmtree(tmploc, ignore_errors=True)
+    tasks = ["task-{}.json".format(idx) for idx in range(len(keys))]
+    past = history.loadHistory(history_dirs, descriptor=tool)
+    costs = history.loadCosts(utils.truepath(cost_file), cost_column) \
+        if cost_file else None
+    costs = history.taskCosts(tasks, history=past, costs=costs, keys=keys)
+
+    known = len([key for key in keys if key in past])
+    resources = planner.taskResources(past, tool, ram=task_ram,
+                                      cpus=task_cpus)
+    print("{} task(s), {} with past durations; {} CPU(s) and {:.0f} MB of "
+          "RAM per task".format(len(tasks), known, resources["cpus"],
+                                resources["ram"]))
+
+    pools = list(workers or [])
+    pools += [int(vcpus // resources["cpus"]) for vcpus in max_vcpus or []]
+    if not pools:
+        pools = [parseJobs("auto")]
+    plans = [planner.simulate(costs, pool, groupby=groupby, balance=balance,
+                              overhead=overhead) for pool in pools]
+    print(planner.report(plans, cpus=resources["cpus"], price=price))
+    return plans
+
+
+def runtask(tasklist, jobs=1, speculate=None, speculate_factor=1.5,
+            verbose=False, report=None, **kwargs):
     print(kwargs)
+    if jobs > 1 and len(tasklist) > 1:
+        # Runs the tasks side by side, e.g. within a single allocation; the
+        # pool passes "verbose" on to each task
+        pool = TaskPool(runtask, jobs=jobs, speculate=speculate,
+                        factor=speculate_factor,
+                        rundir=kwargs.get("provdir"), verbose=verbose,
+                        **kwargs)
+        results = pool.run([[task] for task in tasklist])
+        return [task for result in results if result["exitcode"]
+                for task in result["tasks"]]
+
+    failed = []
+    handlers = []
     for task in tasklist:
-        handler = TaskHandler(task, **kwargs)
+        handler = TaskHandler(task, verbose=verbose, **kwargs)
+        handlers += [handler]
+        if handler.output.exit_code:
+            failed += [task]
+
+    # Reprozip traces are packed while the next tasks of the group run, and
+    # only waited for once all of them are done. The group's outcome is
+    # reported first, so that a pool running it can use its slot meanwhile;
+    # processes with a single group to run (e.g. on AWS Batch) still wait
+    if report is not None:
+        report(failed)
+    for handler in handlers:
+        handler.joinPack(verbose=verbose)
+    return failed
 
 
 def share(provdir, **kwargs):
@@ -290,6 +614,8 @@ on clusters, and in the cloud. For more information, go to our website:
             analyses on your local system, and deploy them on clusters.
   - cloud:  This mode allows you to deploy your Clowdr exectuion on a cloud
             resource. Currently, this only supports Amazon Web Services.
+  - plan:   This mode predicts how long a launch will take, and what it
+            will cost, for several numbers of workers, from past runs.
   - share:  This mode launches a lightweight webserver for you to explore your
             executions, monitor job progress, and share your results.
   - task:   This mode is generally only for super-users. It is used by Clowdr
@@ -340,6 +666,31 @@ on clusters, and in the cloud. For more information, go to our website:
                                  "the number of tasks to group here. For "
                                  "imperfect multiples, the last group will be "
                                  "the remainder.")
+    parser_loc.add_argument("--balance", action="store_true",
+                            help="Pairs with --groupby. Rather than grouping "
+                                 "tasks in order, groups them so that each "
+                                 "group takes about as long to run, based on "
+                                 "the duration of each task in past runs of "
+                                 "the tool (see --history; defaults to the "
+                                 "runs in the provenance directory), or on "
+                                 "--cost-file.")
+    parser_loc.add_argument("--cost-file", action="store", dest="cost_file",
+                            help="Pairs with --balance. CSV or TSV file with "
+                                 "a header, giving the cost (e.g. expected "
+                                 "duration) of each task. The first column "
+                                 "holds the invocation file name or task ID.")
+    parser_loc.add_argument("--cost-column", action="store", default="cost",
+                            dest="cost_column",
+                            help="Column of --cost-file with the costs. "
+                                 "Defaults to 'cost'.")
+    parser_loc.add_argument("--memoize", action="store_true",
+                            help="Skips tasks whose descriptor, invocation "
+                                 "and input files (by size and modification "
+                                 "time, or S3 ETag) are unchanged since a "
+                                 "successful past run (see --history; "
+                                 "defaults to the runs in the provenance "
+                                 "directory), linking the past results into "
+                                 "the new run instead.")
     parser_loc.add_argument("--sweep", type=str, action="append",
                             help="If you wish to perform a parameter sweep with"
                                  " Clowdr, you can use this flag and provide "
@@ -350,7 +701,12 @@ on clusters, and in the cloud. For more information, go to our website:
                                  "be used (if it is ordinarily a list, this "
                                  "means it must be a list of lists here). This"
                                  " option does not work with directories of "
-                                 "invocations, but only single files.")
+                                 "invocations, but only single files. Each "
+                                 "use of the flag adds a dimension to the "
+                                 "sweep, and all combinations are launched; "
+                                 "parameters joined by commas (e.g. \"seed,"
+                                 "init\") are zipped, taking their values "
+                                 "in pairs.")
     parser_loc.add_argument("--setup", action="store_true",
                             help="If you wish to generate metadata but not "
                                  "launch tasks then you can use this mode.")
@@ -358,6 +714,28 @@ on clusters, and in the cloud. For more information, go to our website:
                             help="If you wish to submit your local tasks to a "
                                  "scheduler, you must specify it here. "
                                  "Currently this only supports SLURM clusters.")
+    parser_loc.add_argument("--array", action="store_true",
+                            help="Pairs with --cluster. Submits all task "
+                                 "groups as array jobs, whose elements look "
+                                 "up their tasks in an index file "
+                                 "(clowdr-array-index.txt), rather than as "
+                                 "one job per group. Groups are split into "
+                                 "as few array jobs as the cluster's maximum"
+                                 " array size (MaxArraySize) allows.")
+    parser_loc.add_argument("--submit-jobs", type=int, default=4,
+                            dest="submit_jobs",
+                            help="Pairs with --cluster. Number of task groups"
+                                 " submitted to the cluster at once. "
+                                 "Defaults to 4.")
+    parser_loc.add_argument("--max-pending", type=int, dest="max_pending",
+                            help="Pairs with --cluster. Holds back new "
+                                 "submissions while the cluster's queue (read"
+                                 " through squeue) has this many pending jobs"
+                                 " with the same job name, and submits more "
+                                 "as they start. Submitted tasks are recorded"
+                                 " in the run directory, so an interrupted "
+                                 "launch can be resumed with --rerun "
+                                 "unsubmitted.")
     parser_loc.add_argument("--clusterargs", "-a", action="store",
                             help="This allows users to supply arguments to the "
                                  "cluster, such as specifying RAM or requesting"
@@ -380,7 +758,8 @@ on clusters, and in the cloud. For more information, go to our website:
                                  "tool wrapped in Docker, toggles propagating "
                                  "the current user within the container.")
     parser_loc.add_argument("--rerun", "-R",
-                            choices=["all", "failed", "incomplete"],
+                            choices=["all", "failed", "incomplete",
+                                     "unsubmitted"],
                             help="Allows user to re-run jobs in a previous "
                                  "execution that either failed or didn't "
                                  "finish, etc. This requires the --run_id "
@@ -395,7 +774,11 @@ on clusters, and in the cloud. For more information, go to our website:
                                  "be set to different values, if they were the "
                                  "source or errors. Pairing the incomplete mode"
                                  " with the --dev flag allows you to walk "
-                                 "through your dataset one group at a time.")
+                                 "through your dataset one group at a time."
+                                 " The 'unsubmitted' mode resumes an "
+                                 "interrupted submission to a cluster, "
+                                 "submitting only the tasks it had not yet "
+                                 "submitted.")
     parser_loc.add_argument("--run_id", action="store",
                             help="Pairs with --rerun. This ID is the directory"
                                  " within the supplied provdir which contains "
@@ -410,6 +793,127 @@ on clusters, and in the cloud. For more information, go to our website:
                                  "BIDS app. BIDS is a data organization format"
                                  " in neuroimaging. For more information about"
                                  " this, go to https://bids.neuroimaging.io.")
+    parser_loc.add_argument("--bids-cache", action="store",
+                            dest="bids_cache",
+                            help="Directory in which the index of the BIDS "
+                                 "dataset is cached. Participants and "
+                                 "sessions not given in the invocation are "
+                                 "found in the dataset, each getting its own "
+                                 "task, and the index is reused by later "
+                                 "launches until the dataset changes. "
+                                 "Defaults to a directory in /tmp.")
+    parser_loc.add_argument("--manifest", action="store_true",
+                            help="Stores all tasks of the run, and the "
+                                 "invocations created for them, in a single "
+                                 "indexed manifest (clowdr-tasks.jsonl) "
+                                 "rather than as a task-N.json and invocation"
+                                 " file each. Tasks are still referred to as "
+                                 "<run>/task-N.json.")
+    parser_loc.add_argument("--validate", action="store_true",
+                            help="Validates the invocation of every task "
+                                 "against the descriptor with Boutiques, in "
+                                 "parallel, and reports invalid ones before "
+                                 "any task is launched. Results are cached, "
+                                 "so unchanged invocations are not validated"
+                                 " again.")
+    parser_loc.add_argument("--validation-cache", action="store",
+                            dest="validation_cache",
+                            help="Directory in which validation results are "
+                                 "cached. Defaults to a directory in /tmp.")
+    parser_loc.add_argument("--sample-interval", type=float, default=1,
+                            dest="sample_interval",
+                            help="Time, in seconds, between consecutive "
+                                 "samples of the CPU and RAM usage of each "
+                                 "task. Defaults to 1 second.")
+    parser_loc.add_argument("--sample-source", dest="sample_source",
+                            choices=["auto", "proc", "cgroup"],
+                            default="auto",
+                            help="Where CPU and RAM usage is read from. The "
+                                 "'proc' mode reads /proc for the task's "
+                                 "process tree, 'cgroup' reads the counters of"
+                                 " the task's control group, and 'auto' uses "
+                                 "the cgroup only if the task has its own. "
+                                 "Tasks share the cgroup of clowdr unless "
+                                 "placed in their own (e.g. by the "
+                                 "scheduler), in which case both modes "
+                                 "read /proc.")
+    parser_loc.add_argument("--usage-points", type=int, dest="usage_points",
+                            help="Caps the number of CPU and RAM samples kept "
+                                 "for each task, which keeps memory flat for "
+                                 "very long tasks. Samples are downsampled as "
+                                 "they are recorded, keeping peak usage.")
+    parser_loc.add_argument("--usage-full", action="store_true",
+                            dest="usage_full",
+                            help="Pairs with --usage-points. Also streams the "
+                                 "full resolution usage trace to disk, as "
+                                 "task-N-usage-full.csv.")
+    parser_loc.add_argument("--usage-format", dest="usage_format",
+                            choices=["csv", "bin", "both"], default="csv",
+                            help="File format for the CPU and RAM usage of "
+                                 "each task. The 'bin' format is a compact "
+                                 "binary file (task-N-usage.bin) which is "
+                                 "read without parsing when summarizing runs;"
+                                 " 'both' also exports the usual CSV.")
+    parser_loc.add_argument("--stream-logs", action="store_true",
+                            dest="stream_logs",
+                            help="Writes the tool's stdout and stderr to the "
+                                 "task's log files as they are produced, "
+                                 "rather than holding them in memory until "
+                                 "the tool exits. Boutiques merges the tool's"
+                                 " stderr into stdout in this mode, so both "
+                                 "go to the task's stdout log.")
+
+    parser_loc.add_argument("--jobs", "-j", type=parseJobs, default=1,
+                            help="Number of task groups run in parallel when "
+                                 "not submitting to a cluster, or 'auto' for "
+                                 "one per available CPU. Each group is run in"
+                                 " its own process, and reported as it "
+                                 "completes. With --cluster, the number of "
+                                 "tasks of each group run in parallel within "
+                                 "its job. Defaults to 1.")
+    parser_loc.add_argument("--speculate", type=float,
+                            help="Pairs with --jobs. Starts a second copy of "
+                                 "task groups running for longer than "
+                                 "--speculate-factor times this quantile "
+                                 "(e.g. 0.75) of the durations of the run's "
+                                 "completed tasks, once slots are free. The "
+                                 "first copy to succeed is kept and the other"
+                                 " is cancelled. Tasks must be safe to run "
+                                 "twice at once.")
+    parser_loc.add_argument("--speculate-factor", type=float, default=1.5,
+                            dest="speculate_factor",
+                            help="Pairs with --speculate. Multiple of the "
+                                 "quantile past which a task group is a "
+                                 "straggler. Defaults to 1.5.")
+
+    parser_loc.add_argument("--image-cache", nargs="?", const="",
+                            dest="image_cache",
+                            help="Keeps container images in a cache shared "
+                                 "by all tasks and runs on a node, in the "
+                                 "given directory (or, if none is given, in a"
+                                 " temporary directory of the node). Each "
+                                 "image is pulled only once, even by "
+                                 "concurrent tasks.")
+    parser_loc.add_argument("--image-cache-size", type=float,
+                            dest="image_cache_size",
+                            help="Pairs with --image-cache. Size limit of the"
+                                 " cache, in GB. The least recently used "
+                                 "images are evicted beyond it.")
+    parser_loc.add_argument("--history", action="append",
+                            dest="history_dirs",
+                            help="Directory of a past run (or of the Clowdr "
+                                 "provenance directory holding several). With"
+                                 " --jobs, the peak RAM and CPU usage recorded"
+                                 " for each task is used to only start tasks "
+                                 "when they fit on the host. Can be repeated.")
+    parser_loc.add_argument("--task-ram", type=float, dest="task_ram",
+                            help="RAM, in MB, needed by each task. With "
+                                 "--jobs, overrides the history and the "
+                                 "descriptor's suggested resources.")
+    parser_loc.add_argument("--task-cpus", type=float, dest="task_cpus",
+                            help="Number of CPUs needed by each task. With "
+                                 "--jobs, overrides the history and the "
+                                 "descriptor's suggested resources.")
 
     parser_loc.set_defaults(func=local)
 
@@ -460,15 +964,139 @@ on clusters, and in the cloud. For more information, go to our website:
                                  "be used (if it is ordinarily a list, this "
                                  "means it must be a list of lists here). This"
                                  " option does not work with directories of "
-                                 "invocations, but only single files.")
+                                 "invocations, but only single files. Each "
+                                 "use of the flag adds a dimension to the "
+                                 "sweep, and all combinations are launched; "
+                                 "parameters joined by commas (e.g. \"seed,"
+                                 "init\") are zipped, taking their values "
+                                 "in pairs.")
     parser_cld.add_argument("--bids", "-b", action="store_true",
                             help="Indicates that the tool being launched is a "
                                  "BIDS app. BIDS is a data organization format"
                                  " in neuroimaging. For more information about"
                                  " this, go to https://bids.neuroimaging.io.")
+    parser_cld.add_argument("--bids-cache", action="store",
+                            dest="bids_cache",
+                            help="Directory in which the index of the BIDS "
+                                 "dataset is cached. Participants and "
+                                 "sessions not given in the invocation are "
+                                 "found in the dataset, each getting its own "
+                                 "task, and the index is reused by later "
+                                 "launches until the dataset changes. "
+                                 "Defaults to a directory in /tmp.")
+    parser_cld.add_argument("--manifest", action="store_true",
+                            help="Stores all tasks of the run, and the "
+                                 "invocations created for them, in a single "
+                                 "indexed manifest (clowdr-tasks.jsonl) "
+                                 "rather than as a task-N.json and invocation"
+                                 " file each. Tasks are still referred to as "
+                                 "<run>/task-N.json.")
+    parser_cld.add_argument("--validate", action="store_true",
+                            help="Validates the invocation of every task "
+                                 "against the descriptor with Boutiques, in "
+                                 "parallel, and reports invalid ones before "
+                                 "any task is launched. Results are cached, "
+                                 "so unchanged invocations are not validated"
+                                 " again.")
+    parser_cld.add_argument("--validation-cache", action="store",
+                            dest="validation_cache",
+                            help="Directory in which validation results are "
+                                 "cached. Defaults to a directory in /tmp.")
+    parser_cld.add_argument("--upload-jobs", type=int, default=4,
+                            dest="upload_jobs",
+                            help="Number of outputs and provenance files each"
+                                 " task uploads to S3 concurrently once it has"
+                                 " finished. Defaults to 4.")
+    parser_cld.add_argument("--stream-logs", action="store_true",
+                            dest="stream_logs",
+                            help="Writes the tool's stdout and stderr to disk "
+                                 "as they are produced, and uploads them to S3"
+                                 " in segments while each task runs, so that "
+                                 "logs can be read before it completes. The "
+                                 "tool's stderr is merged into its stdout "
+                                 "log.")
+    parser_cld.add_argument("--log-interval", type=float, default=60,
+                            dest="log_interval",
+                            help="Pairs with --stream-logs. Time, in seconds,"
+                                 " between uploads of log segments to S3.")
 
     parser_cld.set_defaults(func=cloud)
 
+    # Create the subparser for planning launches
+    desc = ("Predicts the duration, utilization and cost of a launch before "
+            "running it, by simulating the schedule of its tasks with their "
+            "durations in past runs of the tool.")
+    parser_pln = subparsers.add_parser("plan", description=desc)
+    parser_pln.add_argument("descriptor", type=argparse.FileType('r'),
+                            help="Local path to Boutiques descriptor for the "
+                                 "tool you wish to run.")
+    parser_pln.add_argument("invocation",
+                            help="Local path to Boutiques invocation (or "
+                                 "directory containing multiple invocations) "
+                                 "for the analysis you wish to run.")
+    parser_pln.add_argument("provdir",
+                            help="Local directory where Clowdr stored past "
+                                 "runs of the tool. Their durations, RAM and "
+                                 "CPU usage are used for the predictions.")
+    parser_pln.add_argument("--workers", type=int, nargs="+",
+                            help="Numbers of tasks (or groups, with "
+                                 "--groupby) running at once to plan for, "
+                                 "e.g. job slots on a cluster or --jobs "
+                                 "locally. Defaults to one per local CPU.")
+    parser_pln.add_argument("--max-vcpus", type=int, nargs="+",
+                            dest="max_vcpus",
+                            help="Sizes of compute environments (e.g. the "
+                                 "maxvCpus of an AWS Batch compute "
+                                 "environment) to plan for. Each fits as many "
+                                 "tasks as the CPUs they need allow.")
+    parser_pln.add_argument("--groupby", "-g", type=int,
+                            help="Number of tasks run one after another in "
+                                 "each job, as in clowdr local.")
+    parser_pln.add_argument("--balance", action="store_true",
+                            help="Pairs with --groupby. Groups tasks by "
+                                 "duration, as in clowdr local.")
+    parser_pln.add_argument("--history", action="append", dest="history_dirs",
+                            help="Directory of past runs, or provenance "
+                                 "directory containing several runs. Can be "
+                                 "given more than once. Defaults to provdir.")
+    parser_pln.add_argument("--cost-file", action="store", dest="cost_file",
+                            help="CSV or TSV file with the expected duration "
+                                 "of each task, in seconds, overriding the "
+                                 "history. See the same option in clowdr "
+                                 "local.")
+    parser_pln.add_argument("--cost-column", action="store", default="cost",
+                            dest="cost_column",
+                            help="Column of --cost-file with the durations. "
+                                 "Defaults to 'cost'.")
+    parser_pln.add_argument("--task-ram", type=float, dest="task_ram",
+                            help="RAM, in MB, needed by each task. Defaults "
+                                 "to the largest seen in past runs.")
+    parser_pln.add_argument("--task-cpus", type=float, dest="task_cpus",
+                            help="Number of CPUs needed by each task. "
+                                 "Defaults to the most used in past runs.")
+    parser_pln.add_argument("--overhead", type=float, default=0,
+                            help="Time, in seconds, added to each job for "
+                                 "scheduling and setup.")
+    parser_pln.add_argument("--price", type=float,
+                            help="Cost of a CPU-hour, to predict the cost of "
+                                 "the launch.")
+    parser_pln.add_argument("--sweep", type=str, action="append",
+                            help="Parameter swept over, as in clowdr local.")
+    parser_pln.add_argument("--bids", "-b", action="store_true",
+                            help="Indicates that the tool being launched is a "
+                                 "BIDS app, as in clowdr local.")
+    parser_pln.add_argument("--bids-cache", action="store",
+                            dest="bids_cache",
+                            help="Directory in which the index of the BIDS "
+                                 "dataset is cached, as in clowdr local.")
+    parser_pln.add_argument("--s3", action="store",
+                            help="Amazon S3 bucket and path for remote data, "
+                                 "as in clowdr local.")
+    parser_pln.add_argument("--verbose", "-V", action="store_true",
+                            help="Toggles verbose output statements.")
+
+    parser_pln.set_defaults(func=plan)
+
     # Create the subparser for sharing outputs
     desc = ("Launches light-weight web service for exploring, managing, and "
             "sharing the outputs and provenance recorded from Clowdr "
@@ -520,6 +1148,69 @@ on clusters, and in the cloud. For more information, go to our website:
                                   "container. This is usually related to the "
                                   "path of any data files as specified in your "
                                   "invocation(s).")
+    parser_task.add_argument("--sample-interval", type=float, default=1,
+                             dest="sample_interval",
+                             help="Time, in seconds, between consecutive "
+                                  "samples of the CPU and RAM usage of each "
+                                  "task. Defaults to 1 second.")
+    parser_task.add_argument("--sample-source", dest="sample_source",
+                             choices=["auto", "proc", "cgroup"],
+                             default="auto",
+                             help="Where CPU and RAM usage is read from. See "
+                                  "the same option in clowdr local.")
+    parser_task.add_argument("--usage-points", type=int, dest="usage_points",
+                             help="Caps the number of CPU and RAM samples kept"
+                                  " for each task. See the same option in "
+                                  "clowdr local.")
+    parser_task.add_argument("--usage-full", action="store_true",
+                             dest="usage_full",
+                             help="Pairs with --usage-points. Also streams the"
+                                  " full resolution usage trace to disk.")
+    parser_task.add_argument("--usage-format", dest="usage_format",
+                             choices=["csv", "bin", "both"], default="csv",
+                             help="File format for the CPU and RAM usage of "
+                                  "each task. See the same option in clowdr "
+                                  "local.")
+    parser_task.add_argument("--upload-jobs", type=int, default=4,
+                             dest="upload_jobs",
+                             help="Number of outputs and provenance files "
+                                  "uploaded concurrently once a task has "
+                                  "finished. Defaults to 4.")
+    parser_task.add_argument("--stream-logs", action="store_true",
+                             dest="stream_logs",
+                             help="Writes the tool's stdout and stderr to the "
+                                  "task's log files as they are produced. If "
+                                  "the task's provenance is stored on S3, the "
+                                  "logs are also uploaded in segments while "
+                                  "the task runs. The tool's stderr is merged"
+                                  " into its stdout log.")
+    parser_task.add_argument("--log-interval", type=float, default=60,
+                             dest="log_interval",
+                             help="Pairs with --stream-logs. Time, in seconds,"
+                                  " between uploads of log segments to S3.")
+
+    parser_task.add_argument("--image-cache", nargs="?", const="",
+                             dest="image_cache",
+                             help="Takes container images from a cache shared"
+                                  " by all tasks on the node. See the same "
+                                  "option in clowdr local.")
+    parser_task.add_argument("--image-cache-size", type=float,
+                             dest="image_cache_size",
+                             help="Pairs with --image-cache. Size limit of "
+                                  "the cache, in GB.")
+    parser_task.add_argument("--jobs", "-j", type=parseJobs, default=1,
+                             help="Number of tasks run in parallel, or 'auto'"
+                                  " for one per available CPU (e.g. those of "
+                                  "the job's allocation). Each task keeps its "
+                                  "own provenance. Defaults to 1.")
+    parser_task.add_argument("--speculate", type=float,
+                             help="Pairs with --jobs. Starts a second copy of "
+                                  "straggling tasks. See the same option in "
+                                  "clowdr local.")
+    parser_task.add_argument("--speculate-factor", type=float, default=1.5,
+                             dest="speculate_factor",
+                             help="Pairs with --speculate. Multiple of the "
+                                  "quantile past which a task is a straggler.")
 
     parser_task.set_defaults(func=runtask)
     return parser
@@ -211,13 +211,13 @@ class AWS(Endpoint):
             print("Job Definition ARN: {}".format(job["jobDefinitionArn"]),
                   flush=True)
 
-    def launchJob(self, taskloc):
+    def launchJob(self, taskloc, taskargs=None):
         # TODO: document
         orides = {"environment":[{"name": "AWS_ACCESS_KEY_ID",
                                   "value": self.access_key},
                                  {"name": "AWS_SECRET_ACCESS_KEY",
                                   "value": self.secret_access}],
-                  "command":["task", taskloc, "-V"]}
+                  "command":["task", taskloc, "-V"] + (taskargs or [])}
         # p1, p2 = re.match('.+/.+-([0-9a-zA-Z_]+)/clowdr/task-([A-Za-z0-9]+).json', taskloc).group(1, 2)
         p1, p2 = re.match('.+\/.+-(\w+)\/clowdr\/task-([A-Za-z0-9]+).json',
                           taskloc).group(1, 2)
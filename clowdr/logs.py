@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/logs.py
+# Created by Greg Kiar on 2018-02-28.
+# Email: gkiar@mcin.ca
+
+import os.path as op
+import threading
+import os
+
+from clowdr import utils
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamedOutput:
+    """StreamedOutput
+    Stand-in for the Boutiques execution output when the tool's logs were
+    streamed to disk: only the exit code is carried across processes. With
+    "merged", the tool's stderr was written to the stdout log along with its
+    stdout, as Boutiques does when streaming.
+    """
+    def __init__(self, exit_code, stdout_file=None, stderr_file=None,
+                 stdout=None, stderr=None, timings=None, merged=False):
+        self.exit_code = exit_code
+        self.merged = merged
+        self.timings = timings
+        self.stdout_file = stdout_file
+        self.stderr_file = stderr_file
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __str__(self):
+        return ("Exit code\n{}\nStd out\n{}\nError message\n{}"
+                "".format(self.exit_code,
+                          self.stdout_file if self.stdout is None
+                          else self.stdout,
+                          self.stderr_file if self.stderr is None
+                          else self.stderr))
+
+
+class LogTee(threading.Thread):
+    """LogTee
+    Copies a stream into a log file in bounded chunks as data arrives, so
+    that a tool's output never needs to be held in memory.
+
+    Parameters
+    ----------
+    stream : file object
+        Readable, binary stream (e.g. the stdout pipe of a subprocess)
+    path : str
+        Log file to be written
+    echo : file object
+        Optional text stream the output is also copied to
+    """
+    def __init__(self, stream, path, echo=None, chunk_size=CHUNK_SIZE):
+        super(LogTee, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.path = path
+        self.echo = echo
+        self.chunk_size = chunk_size
+        self.nbytes = 0
+
+    def run(self):
+        fd = self.stream.fileno()
+        with open(self.path, "wb") as fhandle:
+            while True:
+                chunk = os.read(fd, self.chunk_size)
+                if not chunk:
+                    break
+                fhandle.write(chunk)
+                fhandle.flush()
+                self.nbytes += len(chunk)
+                if self.echo is not None:
+                    self.echo.write(chunk.decode("utf-8", "replace"))
+                    self.echo.flush()
+
+
+class LogUploader(threading.Thread):
+    """LogUploader
+    Periodically uploads whatever has been appended to a set of log files as
+    rolling segments, so logs can be read remotely while a task is running
+    and are not lost if the node dies. Segment K of "task-N-stdout.txt" is
+    uploaded as "<prefix>/task-N-stdout.txt.K" under the remote directory.
+
+    Parameters
+    ----------
+    paths : list
+        Log files to be followed
+    remote : str
+        Remote directory where the segments are uploaded
+    interval : float
+        Time, in seconds, between uploads
+    prefix : str
+        Name of the directory holding the segments
+    """
+    def __init__(self, paths, remote, interval=60, prefix="logs", **kwargs):
+        super(LogUploader, self).__init__()
+        self.daemon = True
+        self.paths = paths
+        self.remote = op.join(remote, prefix)
+        self.interval = interval
+        self.prefix = prefix
+        self.kwargs = kwargs
+        self.offsets = {path: 0 for path in paths}
+        self.segments = {path: 0 for path in paths}
+        self.uploaded = []
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def upload(self):
+        if not self.remote.startswith("s3://"):
+            os.makedirs(self.remote, exist_ok=True)
+
+        for path in self.paths:
+            if not op.isfile(path) or op.getsize(path) <= self.offsets[path]:
+                continue
+
+            segdir = op.join(op.dirname(path), self.prefix)
+            os.makedirs(segdir, exist_ok=True)
+            segment = op.join(segdir, "{}.{}".format(op.basename(path),
+                                                     self.segments[path]))
+            nbytes = 0
+            with open(path, "rb") as fin, open(segment, "wb") as fout:
+                fin.seek(self.offsets[path])
+                while True:
+                    chunk = fin.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    fout.write(chunk)
+                    nbytes += len(chunk)
+
+            try:
+                self.uploaded += utils.post(segment, self.remote)
+                self.offsets[path] += nbytes
+                self.segments[path] += 1
+            except Exception as e:
+                # The same bytes are retried as part of the next segment
+                if self.kwargs.get("verbose"):
+                    print("Log upload failed: {}".format(e), flush=True)
+            finally:
+                utils.remove(segment)
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            self.upload()
+        self.upload()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/manifest.py
+# Created by Greg Kiar on 2018-02-28.
+# Email: gkiar@mcin.ca
+
+import os.path as op
+import struct
+import json
+import sys
+import os
+import re
+
+from clowdr import utils
+
+
+# Tasks of a run may be stored together, rather than as one task-N.json file
+# (and invocation) each: one JSON record per line of the manifest, and the
+# offset and length of each record in the index
+MANIFEST = "clowdr-tasks.jsonl"
+INDEX = "clowdr-tasks.idx"
+RECORD = struct.Struct("<QQ")
+
+r_task = re.compile(r'^task-([0-9]+)[.]json$')
+
+
+class Task:
+    """Task
+    Record of a task: its descriptor ("tool"), invocation, output location
+    ("taskloc") and input data ("dataloc"), and optionally its memoization
+    key ("memo") and the content of its invocation ("invocation_data"). The
+    paths shared by all tasks of a run are interned, so that tasks loaded or
+    created together hold a single copy of them, and the invocation is only
+    read when asked for (see "loadInvocation").
+
+    Tasks are stored as JSON objects with the same fields, which "toDict"
+    and "fromDict" convert from and to.
+    """
+    __slots__ = ("tool", "invocation", "taskloc", "dataloc", "memo",
+                 "invocation_data")
+
+    def __init__(self, tool, invocation, taskloc=None, dataloc=(),
+                 memo=None, invocation_data=None):
+        self.tool = sys.intern(tool)
+        self.invocation = invocation
+        self.taskloc = sys.intern(taskloc) if taskloc is not None else None
+        self.dataloc = tuple(sys.intern(dl) for dl in dataloc)
+        self.memo = memo
+        self.invocation_data = invocation_data
+
+    def replace(self, **fields):
+        """replace
+        Copy of the task, with some of its fields changed.
+        """
+        task = Task.__new__(Task)
+        for field in Task.__slots__:
+            setattr(task, field, getattr(self, field))
+        for field, value in fields.items():
+            if field == "dataloc":
+                value = tuple(sys.intern(dl) for dl in value)
+            elif field in ("tool", "taskloc") and value is not None:
+                value = sys.intern(value)
+            setattr(task, field, value)
+        return task
+
+    def toDict(self):
+        record = {"tool": self.tool,
+                  "invocation": self.invocation,
+                  "dataloc": list(self.dataloc)}
+        if self.taskloc is not None:
+            record["taskloc"] = self.taskloc
+        if self.memo is not None:
+            record["memo"] = self.memo
+        if self.invocation_data is not None:
+            record["invocation_data"] = self.invocation_data
+        return record
+
+    @classmethod
+    def fromDict(cls, record):
+        return cls(**record)
+
+    def toJSON(self, indent=None):
+        return json.dumps(self.toDict(), indent=indent, sort_keys=True)
+
+    @classmethod
+    def fromJSON(cls, text):
+        return cls(**json.loads(text))
+
+    def save(self, taskfile):
+        with open(taskfile, "w") as fhandle:
+            fhandle.write(self.toJSON(indent=4))
+
+    def loadInvocation(self, rundir=None):
+        """loadInvocation
+        Reads the invocation of the task, from its manifest record or its
+        file. With "rundir", the file is taken from the run directory rather
+        than from where the task first pointed.
+        """
+        if self.invocation_data is not None:
+            return self.invocation_data
+        invocation = self.invocation
+        if rundir is not None:
+            invocation = op.join(rundir, op.basename(invocation))
+        with open(invocation) as fhandle:
+            return json.load(fhandle)
+
+
+class ManifestWriter:
+    """ManifestWriter
+    Appends tasks to the manifest of a run. Tasks remain addressed by their
+    usual path, "<rundir>/task-N.json", although that file isn't created.
+
+    Parameters
+    ----------
+    rundir : str
+        Run directory
+    """
+    def __init__(self, rundir):
+        self.rundir = rundir
+        self.manifest = open(op.join(rundir, MANIFEST), "ab")
+        self.index = open(op.join(rundir, INDEX), "ab")
+        self.count = self.index.tell() // RECORD.size
+
+    def append(self, task, invocation=None):
+        """append
+        Adds a task (a Task, or its record), and optionally the content of
+        its invocation (stored in the record, rather than as a file).
+
+        Returns
+        -------
+        str
+            Path of the task
+        """
+        if invocation is not None:
+            task = task.replace(invocation_data=invocation)
+        line = task.toJSON() if isinstance(task, Task) \
+            else json.dumps(task, sort_keys=True)
+        line = (line + "\n").encode("utf-8")
+        # The record is written before its index entry, so that tasks can be
+        # read (e.g. launched) while others are still being appended
+        offset = self.manifest.tell()
+        self.manifest.write(line)
+        self.manifest.flush()
+        self.index.write(RECORD.pack(offset, len(line)))
+        self.index.flush()
+        self.count += 1
+        return op.join(self.rundir, "task-{}.json".format(self.count - 1))
+
+    def close(self):
+        self.manifest.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read(path, start=0, length=None):
+    if path.startswith("s3://"):
+        import boto3
+        bucket, key = utils.splitS3Path(path)
+        args = {"Bucket": bucket, "Key": key}
+        if length is not None:
+            args["Range"] = "bytes={}-{}".format(start, start + length - 1)
+        return boto3.client("s3").get_object(**args)["Body"].read()
+    with open(path, "rb") as fhandle:
+        fhandle.seek(start)
+        return fhandle.read(-1 if length is None else length)
+
+
+def _size(path):
+    if path.startswith("s3://"):
+        import boto3
+        from botocore.exceptions import ClientError
+        bucket, key = utils.splitS3Path(path)
+        try:
+            return boto3.client("s3").head_object(Bucket=bucket,
+                                                  Key=key)["ContentLength"]
+        except ClientError:
+            return None
+    return op.getsize(path) if op.isfile(path) else None
+
+
+def taskCount(rundir):
+    """taskCount
+    Number of tasks in the manifest of a run, or None if it has none.
+    """
+    size = _size(op.join(rundir, INDEX))
+    return size // RECORD.size if size is not None else None
+
+
+def readRecord(rundir, task_id):
+    """readRecord
+    Reads a task from the manifest of a run, without reading the others.
+
+    Parameters
+    ----------
+    rundir : str
+        Local or S3 run directory
+    task_id : int
+        ID of the task
+
+    Returns
+    -------
+    dict
+        The task, with the content of its invocation as "invocation_data"
+        if it was stored in the manifest
+    """
+    entry = _read(op.join(rundir, INDEX), int(task_id) * RECORD.size,
+                  RECORD.size)
+    if len(entry) != RECORD.size:
+        raise KeyError("Task {} not found in {}".format(task_id, rundir))
+    offset, length = RECORD.unpack(entry)
+    return json.loads(_read(op.join(rundir, MANIFEST), offset,
+                            length).decode("utf-8"))
+
+
+def loadTask(taskfile):
+    """loadTask
+    Reads a Task, from its task-N.json file or from the manifest of its run.
+    """
+    if not taskfile.startswith("s3://") and op.isfile(taskfile):
+        with open(taskfile) as fhandle:
+            return Task.fromJSON(fhandle.read())
+    rundir, fname = op.split(taskfile)
+    if r_task.match(fname) and taskCount(rundir) is not None:
+        return Task.fromDict(readRecord(rundir,
+                                        r_task.match(fname).group(1)))
+    return Task.fromJSON(_read(taskfile).decode("utf-8"))
+
+
+def listTasks(rundir):
+    """listTasks
+    Lists the tasks of a local run, whether stored as files or in a manifest.
+
+    Returns
+    -------
+    list
+        Sorted paths of the tasks
+    """
+    tasks = set(op.join(rundir, f) for f in os.listdir(rundir)
+                if r_task.match(f))
+    count = taskCount(rundir)
+    if count:
+        tasks |= set(op.join(rundir, "task-{}.json".format(tid))
+                     for tid in range(count))
+    return sorted(tasks)
+
+
+def rewrite(rundir, function):
+    """rewrite
+    Rewrites all records of the manifest of a local run, through
+    function(task_id, record), which returns the new record (or Task).
+    """
+    tmpdir = op.join(rundir, ".rewrite")
+    os.makedirs(tmpdir, exist_ok=True)
+    # Records are stored in order of task ID
+    with ManifestWriter(tmpdir) as writer, \
+            open(op.join(rundir, MANIFEST)) as fhandle:
+        for tid, line in enumerate(fhandle):
+            writer.append(function(tid, json.loads(line)))
+    for fname in [MANIFEST, INDEX]:
+        os.replace(op.join(tmpdir, fname), op.join(rundir, fname))
+    os.rmdir(tmpdir)
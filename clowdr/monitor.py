@@ -0,0 +1,799 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/monitor.py
+# Created by Greg Kiar on 2018-02-28.
+# Email: gkiar@mcin.ca
+
+from subprocess import PIPE
+from array import array
+import http.client
+import os.path as op
+import threading
+import socket
+import numpy as np
+import psutil
+import struct
+import time
+import json
+import os
+import re
+
+
+RAM_LUT = {'B': 1/1024/1024,
+           'KiB': 1/1024,
+           'MiB': 1,
+           'GiB': 1024}
+
+# Binary usage files: magic, version, dtype code, flags, number of columns,
+# and number of rows, followed by each column in turn (little-endian).
+USAGE_MAGIC = b"CLWU"
+USAGE_HEADER = struct.Struct("<4sBcBBQ")
+USAGE_DELTA = 1
+USAGE_DTYPES = {b"f": "<f4", b"d": "<f8"}
+
+
+def _threadTime():
+    # time.thread_time only exists from Python 3.7 onwards
+    if hasattr(time, "thread_time"):
+        return time.thread_time()
+    return time.process_time()
+
+
+class ProcTree:
+    """ProcTree
+    Reads the accumulated CPU time and resident memory of a process and all
+    of its descendants. On Linux, this is done directly from /proc/<pid>/stat
+    and /proc/<pid>/statm, which avoids the per-process overhead of psutil.
+    Descendants are found by walking /proc/<pid>/task/<tid>/children from
+    the process, so only the tree itself is read; kernels without these
+    files have all of /proc scanned instead. Elsewhere, psutil is used as a
+    fallback.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.procfs = op.isdir("/proc/{}".format(pid))
+        self.ticks = os.sysconf("SC_CLK_TCK") if self.procfs else 1
+        self.pagesize = os.sysconf("SC_PAGE_SIZE") if self.procfs else 1
+        self.walk = op.isfile("/proc/{0}/task/{0}/children".format(pid))
+
+    def _stat(self, pid):
+        with open("/proc/{}/stat".format(pid), "rb") as fhandle:
+            stat = fhandle.read().decode("utf-8", "replace")
+        # The command name is wrapped in brackets and may contain spaces
+        lpar, rpar = stat.index("("), stat.rindex(")")
+        fields = stat[rpar + 2:].split()
+        # fields[0] is the state (field 3 in proc(5)), so field N is N-3 here
+        return {"comm": stat[lpar + 1:rpar],
+                "state": fields[0],
+                "ppid": int(fields[1]),
+                "ticks": sum(int(f) for f in fields[11:15])}
+
+    def _rss(self, pid):
+        with open("/proc/{}/statm".format(pid), "rb") as fhandle:
+            return int(fhandle.read().split()[1]) * self.pagesize
+
+    def _children(self, pid):
+        # Children of each of the threads of a process
+        children = []
+        for tid in os.listdir("/proc/{}/task".format(pid)):
+            path = "/proc/{}/task/{}/children".format(pid, tid)
+            try:
+                with open(path, "rb") as fhandle:
+                    children += [int(c) for c in fhandle.read().split()]
+            except OSError:
+                continue  # The thread exited while we were looking at it
+        return children
+
+    def _descendants(self):
+        if not self.walk:
+            return self._scan()
+
+        # Walk down the process tree, from the process itself
+        tree = []
+        queue = [self.pid]
+        while queue:
+            pid = queue.pop()
+            try:
+                pstat = self._stat(pid)
+                children = self._children(pid)
+            except (OSError, ValueError):
+                continue  # The process exited while we were looking at it
+            # Zombies have already released their memory
+            if pstat["state"] != "Z":
+                tree += [(pid, pstat)]
+            queue += children
+        return tree
+
+    def _scan(self):
+        # Build the process tree from a single scan of /proc
+        children = {}
+        stats = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                pstat = self._stat(entry)
+            except (OSError, ValueError):
+                continue  # The process exited while we were looking at it
+            stats[int(entry)] = pstat
+            children.setdefault(pstat["ppid"], []).append(int(entry))
+
+        tree = []
+        queue = [self.pid]
+        while queue:
+            pid = queue.pop()
+            # Zombies have already released their memory
+            if pid in stats and stats[pid]["state"] != "Z":
+                tree += [(pid, stats[pid])]
+            queue += children.get(pid, [])
+        return tree
+
+    def cmdline(self, pid):
+        if not self.procfs:
+            return psutil.Process(pid).cmdline()
+        with open("/proc/{}/cmdline".format(pid), "rb") as fhandle:
+            cmdline = fhandle.read().decode("utf-8", "replace")
+        return [c for c in cmdline.split("\x00") if c]
+
+    def sample(self):
+        """sample
+        Collects a single sample for the whole process tree.
+
+        Returns
+        -------
+        tuple: (float, float, list)
+            Accumulated CPU seconds, resident memory in bytes, and the list of
+            (pid, name) pairs for the processes in the tree.
+        """
+        if not self.procfs:
+            return self._psutilSample()
+
+        cpu = 0
+        ram = 0
+        procs = []
+        for pid, pstat in self._descendants():
+            try:
+                ram += self._rss(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            cpu += pstat["ticks"]
+            procs += [(pid, pstat["comm"])]
+        if not procs:
+            raise OSError("Process {} has exited".format(self.pid))
+        return cpu / self.ticks, ram, procs
+
+    def _psutilSample(self):
+        root = psutil.Process(self.pid)
+        cpu = 0
+        ram = 0
+        procs = []
+        for proc in [root] + root.children(recursive=True):
+            try:
+                with proc.oneshot():
+                    times = proc.cpu_times()
+                    ram += proc.memory_info()[0]
+                    procs += [(proc.pid, proc.name())]
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            cpu += (times.user + times.system +
+                    times.children_user + times.children_system)
+        return cpu, ram, procs
+
+
+class CGroup:
+    """CGroup
+    Reads the accumulated CPU time and memory usage of the control group a
+    process belongs to. Both cgroup v2 (cpu.stat and memory.current) and v1
+    (cpuacct.usage and memory.usage_in_bytes) hierarchies are supported.
+    """
+    root = "/sys/fs/cgroup"
+
+    def __init__(self, pid):
+        self.cpufile, self.memfile = self.locate(pid)
+
+    @classmethod
+    def membership(cls, pid):
+        groups = {}
+        with open("/proc/{}/cgroup".format(pid)) as fhandle:
+            for line in fhandle:
+                _, controllers, path = line.strip().split(":", 2)
+                for controller in controllers.split(","):
+                    groups[controller] = path
+        return groups
+
+    @classmethod
+    def locate(cls, pid):
+        groups = cls.membership(pid)
+
+        # cgroup v2: one unified hierarchy, listed with an empty controller
+        if "" in groups:
+            for base in [cls.root, op.join(cls.root, "unified")]:
+                cgdir = op.join(base, groups[""].lstrip("/"))
+                cpuf = op.join(cgdir, "cpu.stat")
+                memf = op.join(cgdir, "memory.current")
+                if op.isfile(cpuf) and op.isfile(memf):
+                    return cpuf, memf
+
+        # cgroup v1: one hierarchy per controller
+        if "cpuacct" in groups and "memory" in groups:
+            for cpubase in ["cpuacct", "cpu,cpuacct", "cpuacct,cpu"]:
+                cpuf = op.join(cls.root, cpubase,
+                               groups["cpuacct"].lstrip("/"), "cpuacct.usage")
+                memf = op.join(cls.root, "memory",
+                               groups["memory"].lstrip("/"),
+                               "memory.usage_in_bytes")
+                if op.isfile(cpuf) and op.isfile(memf):
+                    return cpuf, memf
+
+        raise OSError("No readable cgroup found for process {}".format(pid))
+
+    @classmethod
+    def isolated(cls, pid):
+        """isolated
+        Returns True when the process lives in a cgroup which differs from that
+        of the monitor itself; only then do cgroup counters describe the task.
+        """
+        try:
+            theirs = cls.membership(pid)
+            ours = cls.membership(os.getpid())
+            cls.locate(pid)
+        except (OSError, ValueError):
+            return False
+        keys = ["", "cpuacct", "memory"]
+        return any(theirs.get(k) != ours.get(k) for k in keys if k in theirs)
+
+    def sample(self):
+        with open(self.cpufile) as fhandle:
+            if self.cpufile.endswith("cpu.stat"):
+                usage = dict(line.split() for line in fhandle)
+                cpu = int(usage["usage_usec"]) / 1e6
+            else:
+                cpu = int(fhandle.read()) / 1e9
+        with open(self.memfile) as fhandle:
+            ram = int(fhandle.read())
+        return cpu, ram, []
+
+
+class UsageBuffer:
+    """UsageBuffer
+    Columnar, append-only record of usage samples. Each column is stored in a
+    growable array of doubles so that appending a sample is O(1), and the
+    whole record is converted to a table in a single vectorized step.
+    """
+    columns = ("time", "cpu", "ram")
+
+    def __init__(self):
+        self.time = array('d')
+        self.cpu = array('d')
+        self.ram = array('d')
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, tim, cpu, ram):
+        self.time.append(tim)
+        self.cpu.append(cpu)
+        self.ram.append(ram)
+
+    def toArray(self, relative=True):
+        """toArray
+        Returns the samples as an (N, 3) array of time, CPU and RAM. If
+        relative, times are given in seconds since the first sample.
+        """
+        if not len(self):
+            return np.empty((0, len(self.columns)))
+        table = np.column_stack([np.frombuffer(getattr(self, col))
+                                 for col in self.columns])
+        if relative:
+            table[:, 0] -= table[0, 0]
+        return table
+
+    def toCSV(self, path):
+        np.savetxt(path, self.toArray(), delimiter=",", fmt="%.12g",
+                   header=",".join(self.columns), comments="")
+
+    def toBinary(self, path, dtype="float32", delta=True):
+        writeUsage(path, self.toArray(), dtype=dtype, delta=delta)
+
+    def toDataFrame(self):
+        import pandas as pd
+        return pd.DataFrame(self.toArray(), columns=self.columns)
+
+
+class DownsampledBuffer(UsageBuffer):
+    """DownsampledBuffer
+    Usage buffer which retains at most (about) "max_points" samples however
+    long the task runs. Samples are grouped into buckets of "stride"
+    consecutive samples, and only the peak-RAM and peak-CPU samples of each
+    bucket are kept. Whenever there are too many buckets, neighbouring pairs
+    are merged and the stride doubles, so the peaks of both series (and the
+    first and last samples) are always preserved.
+
+    Parameters
+    ----------
+    max_points : int
+        Upper bound on the number of retained samples
+    spill : str
+        Optional path of a CSV file to which every sample is streamed at full
+        resolution as it is recorded
+    """
+    def __init__(self, max_points=1000, spill=None):
+        super(DownsampledBuffer, self).__init__()
+        self.max_points = max(int(max_points), 4)
+        self.stride = 1
+        self.count = 0
+        self.bucket = array('l')
+        self.first = None
+        self.last = None
+        self._peak_ram = None
+        self._peak_cpu = None
+
+        self.spill = spill
+        self._spill = None
+        if spill:
+            self._spill = open(spill, "w")
+            self._spill.write(",".join(self.columns) + "\n")
+
+    def __len__(self):
+        return len(self.toArray(relative=False))
+
+    def append(self, tim, cpu, ram):
+        sample = (tim, cpu, ram)
+        if self.first is None:
+            self.first = sample
+        self.last = sample
+        if self._spill:
+            self._spill.write("{:.12g},{:.12g},{:.12g}\n".format(
+                              tim - self.first[0], cpu, ram))
+
+        if self._peak_ram is None or ram > self._peak_ram[2]:
+            self._peak_ram = sample
+        if self._peak_cpu is None or cpu > self._peak_cpu[1]:
+            self._peak_cpu = sample
+
+        self.count += 1
+        if self.count % self.stride == 0:
+            self._flush(self.count // self.stride - 1)
+            if self.count // self.stride > self.max_points // 2:
+                self._compact()
+
+    def _pending(self):
+        peaks = [p for p in [self._peak_ram, self._peak_cpu] if p is not None]
+        return sorted(set(peaks))
+
+    def _flush(self, bucket):
+        for tim, cpu, ram in self._pending():
+            super(DownsampledBuffer, self).append(tim, cpu, ram)
+            self.bucket.append(bucket)
+        self._peak_ram = self._peak_cpu = None
+
+    def _compact(self):
+        old = (self.time, self.cpu, self.ram, self.bucket)
+        self.time, self.cpu, self.ram = array('d'), array('d'), array('d')
+        self.bucket = array('l')
+        self.stride *= 2
+
+        start = 0
+        while start < len(old[0]):
+            # Retained samples are in time order, so buckets are contiguous
+            bid = old[3][start] // 2
+            stop = start
+            while stop < len(old[0]) and old[3][stop] // 2 == bid:
+                stop += 1
+            group = [(old[0][i], old[1][i], old[2][i])
+                     for i in range(start, stop)]
+            self._peak_ram = max(group, key=lambda x: x[2])
+            self._peak_cpu = max(group, key=lambda x: x[1])
+            if bid < self.count // self.stride:
+                self._flush(bid)
+            # ... otherwise this bucket is still filling, so stays pending
+            start = stop
+
+    def toArray(self, relative=True):
+        if self.first is None:
+            return np.empty((0, len(self.columns)))
+        retained = list(zip(self.time, self.cpu, self.ram))
+        samples = sorted(set([self.first, self.last] + retained +
+                             self._pending()))
+        table = np.array(samples, dtype=float)
+        if relative:
+            table[:, 0] -= self.first[0]
+        return table
+
+    def close(self):
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+
+def writeUsage(path, table, dtype="float32", delta=True):
+    """writeUsage
+    Writes an (N, 3) table of time, CPU and RAM to the compact binary usage
+    format. The time column is delta-encoded if requested, which keeps it
+    precise when stored as float32.
+
+    Parameters
+    ----------
+    path : str
+        File to be written
+    table : numpy.ndarray
+        Usage table, as returned by UsageBuffer.toArray
+    dtype : str
+        One of "float32" or "float64"
+    delta : bool
+        Toggles delta encoding of the time column
+    """
+    code = b"f" if np.dtype(dtype) == np.float32 else b"d"
+    table = np.asarray(table, dtype=float)
+    table = table.reshape(-1, len(UsageBuffer.columns))
+    columns = np.array(table.T, dtype=USAGE_DTYPES[code])
+    if delta and columns.shape[1]:
+        columns[0, 1:] = np.diff(table[:, 0])
+    with open(path, "wb") as fhandle:
+        fhandle.write(USAGE_HEADER.pack(USAGE_MAGIC, 1, code,
+                                        USAGE_DELTA if delta else 0,
+                                        columns.shape[0], columns.shape[1]))
+        fhandle.write(columns.tobytes())
+
+
+def readUsage(path):
+    """readUsage
+    Reads a usage file, either binary or CSV. Binary files are memory-mapped
+    rather than parsed.
+
+    Returns
+    -------
+    dict
+        Mapping of each column name ("time", "cpu", "ram") to a numpy array.
+    """
+    with open(path, "rb") as fhandle:
+        header = fhandle.read(USAGE_HEADER.size)
+
+    if header[:len(USAGE_MAGIC)] != USAGE_MAGIC:
+        table = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        table = table.reshape(-1, len(UsageBuffer.columns))
+        return {col: table[:, idx]
+                for idx, col in enumerate(UsageBuffer.columns)}
+
+    _, version, code, flags, ncols, nrows = USAGE_HEADER.unpack(header)
+    if not nrows:
+        return {col: np.empty(0) for col in UsageBuffer.columns}
+    columns = np.memmap(path, dtype=USAGE_DTYPES[code], mode="r",
+                        offset=USAGE_HEADER.size, shape=(ncols, nrows))
+    usage = {col: columns[idx] for idx, col in enumerate(UsageBuffer.columns)}
+    if flags & USAGE_DELTA:
+        usage["time"] = np.cumsum(usage["time"], dtype=float)
+    return usage
+
+
+def exportUsage(path, csvfile):
+    """exportUsage
+    Exports a (binary) usage file to CSV.
+    """
+    usage = readUsage(path)
+    table = np.column_stack([usage[col] for col in UsageBuffer.columns])
+    np.savetxt(csvfile, table, delimiter=",", fmt="%.12g",
+               header=",".join(UsageBuffer.columns), comments="")
+
+
+def dockerUsage(call):
+    """dockerUsage
+    Polls the Docker CLI for the usage of the container running "call".
+
+    Returns
+    -------
+    tuple: (float, float)
+        CPU percentage and RAM (in MB) used by the matching container(s).
+    """
+    cpu = 0
+    ram = 0
+    tcmd = psutil.Popen(["docker", "ps", "-q"], stdout=PIPE)
+    running = tcmd.communicate()[0].decode('utf-8')
+    running = running.split('\n')
+    tcmd = psutil.Popen(["docker", "inspect"] + running,
+                        stdout=PIPE, stderr=PIPE)
+    tinf = json.loads(tcmd.communicate()[0].decode('utf-8'))
+    for tcon in tinf:
+        if (tcon.get("Config") and
+           tcon.get("Config").get("Cmd") and
+           call in tcon['Config']['Cmd']):
+            tid = tcon['Id']
+            tcmd = psutil.Popen(["docker", "stats", tid, "--no-stream",
+                                 "--format",
+                                 "'{{.MemUsage}} {{.CPUPerc}}'"],
+                                stdout=PIPE)
+            tout = tcmd.communicate()[0].decode('utf-8')
+            tout = tout.strip('\n').replace("'", "")
+
+            _ram, _, _, _cpu = tout.split(' ')
+            _ram, ending = re.match('([0-9.]+)([MGK]?i?B)', _ram).groups()
+            ram += float(_ram) * RAM_LUT[ending]
+            cpu += float(_cpu.strip('%'))
+    return cpu, ram
+
+
+def dockerSocket():
+    """dockerSocket
+    Returns the path of the Docker Engine unix socket, or None if the daemon
+    is not reachable through one (e.g. DOCKER_HOST points at a TCP address).
+    """
+    host = os.environ.get("DOCKER_HOST", "unix:///var/run/docker.sock")
+    if not host.startswith("unix://"):
+        return None
+    path = host[len("unix://"):]
+    return path if op.exists(path) else None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=10):
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def parseDockerStats(stats):
+    """parseDockerStats
+    Converts a raw Docker Engine API stats object into usage values, using
+    the same arithmetic as "docker stats".
+
+    Returns
+    -------
+    tuple: (float, float)
+        CPU percentage and RAM (in MB) used by the container.
+    """
+    cpu_now = stats.get("cpu_stats", {})
+    cpu_pre = stats.get("precpu_stats", {})
+    cpu_delta = (cpu_now.get("cpu_usage", {}).get("total_usage", 0) -
+                 cpu_pre.get("cpu_usage", {}).get("total_usage", 0))
+    sys_delta = (cpu_now.get("system_cpu_usage", 0) -
+                 cpu_pre.get("system_cpu_usage", 0))
+    ncpus = (cpu_now.get("online_cpus") or
+             len(cpu_now.get("cpu_usage", {}).get("percpu_usage") or []) or 1)
+    cpu = 0.0
+    if cpu_delta > 0 and sys_delta > 0:
+        cpu = cpu_delta / sys_delta * ncpus * 100
+
+    mem = stats.get("memory_stats", {})
+    mstats = mem.get("stats", {})
+    # Page cache is reclaimable, so it is not counted as used memory
+    cache = mstats.get("inactive_file",
+                       mstats.get("total_inactive_file",
+                                  mstats.get("cache", 0)))
+    ram = max(mem.get("usage", 0) - cache, 0) * RAM_LUT['B']
+    return cpu, ram
+
+
+def _dockerName(cmdline):
+    # Name given to the container by "docker run --name", if any
+    for idx, arg in enumerate(cmdline):
+        if arg == "--name" and idx + 1 < len(cmdline):
+            return cmdline[idx + 1]
+        if arg.startswith("--name="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+class DockerStats:
+    """DockerStats
+    Follows the usage of the container running a given command through a
+    single, persistent stats stream from the Docker Engine API. The container
+    is looked up once, and the stream is read by a background thread so that
+    sampling it is free.
+
+    Parameters
+    ----------
+    call : str
+        Argument of the container's command (e.g. the launch script from
+        Boutiques) which identifies it among those of the host
+    sockpath : str
+        Path to the Docker Engine unix socket
+    name : str
+        Name of the container, if it was given one; it then identifies the
+        container rather than its command
+    """
+    def __init__(self, call, sockpath, timeout=10, name=None):
+        self.call = call
+        self.sockpath = sockpath
+        self.timeout = timeout
+        self.name = name
+        self.container = None
+        self.cpu = 0.0
+        self.ram = 0.0
+        self._sock = None
+        self._thread = None
+        # Until the container appears, it's looked up less and less often
+        self._retry = 0.0
+        self._delay = 0.5
+
+    def _get(self, path):
+        conn = UnixHTTPConnection(self.sockpath, timeout=self.timeout)
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise OSError("Docker API returned {} for {}".format(
+                              resp.status, path))
+            return json.loads(resp.read().decode("utf-8"))
+        finally:
+            conn.close()
+
+    def find(self):
+        # Containers are matched exactly, by name or by an argument of their
+        # command; the listing's flattened command only narrows them down
+        for tcon in self._get("/containers/json"):
+            if self.name is not None:
+                if "/" + self.name in tcon.get("Names", []):
+                    self.container = tcon["Id"]
+                    return self.container
+            elif self.call in tcon.get("Command", ""):
+                config = self._get("/containers/{}/json"
+                                   "".format(tcon["Id"])).get("Config", {})
+                if self.call in (config.get("Cmd") or []):
+                    self.container = tcon["Id"]
+                    return self.container
+        return None
+
+    def _stream(self):
+        # The stream has no inactivity timeout: samples arrive every second
+        conn = UnixHTTPConnection(self.sockpath, timeout=None)
+        try:
+            conn.request("GET", "/containers/{}/stats".format(self.container))
+            self._sock = conn.sock
+            resp = conn.getresponse()
+            while resp.status == 200:
+                line = resp.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if line:
+                    self.cpu, self.ram = parseDockerStats(
+                        json.loads(line.decode("utf-8")))
+        except (OSError, ValueError, http.client.HTTPException):
+            pass  # The container exited, or the stream was closed by us
+        finally:
+            conn.close()
+            # Once the container is gone, it no longer uses any resources
+            self.cpu, self.ram = 0.0, 0.0
+
+    def usage(self):
+        """usage
+        Returns the latest (CPU %, RAM MB) reported for the container.
+        """
+        if self._thread is None and time.time() >= self._retry:
+            if not self.find():
+                self._retry = time.time() + self._delay
+                self._delay = min(self._delay * 2, 8)
+                return self.cpu, self.ram
+            self._thread = threading.Thread(target=self._stream)
+            self._thread.daemon = True
+            self._thread.start()
+        return self.cpu, self.ram
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                # Unblocks the reader thread, unlike a plain close()
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(self.timeout)
+
+
+class Sampler(threading.Thread):
+    """Sampler
+    Background thread which records the CPU (%) and RAM (MB) usage of a
+    process tree at a fixed rate. Since the counters are read rather than
+    measured over an interval, the sampling period does not depend on the
+    number of processes being watched.
+
+    Parameters
+    ----------
+    pid : int
+        Process ID at the root of the tree to be monitored
+    interval : float
+        Time, in seconds, between consecutive samples
+    source : str
+        One of "auto", "proc", or "cgroup". Cgroup counters are only read if
+        the process has a cgroup of its own, and /proc otherwise: as the task
+        worker inherits the cgroup of the monitor, this takes the tool being
+        placed in its own cgroup (e.g. by the scheduler, or systemd-run).
+        Tools in containers are measured through Docker either way.
+    usage : UsageBuffer
+        Buffer the samples are recorded into (default: keep every sample)
+    verbose : bool
+        Toggle printing of each sample
+    """
+    def __init__(self, pid, interval=1.0, source="auto", usage=None,
+                 verbose=False):
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.interval = float(interval)
+        self.verbose = verbose
+
+        # Counters of a cgroup shared with the monitor would include its own
+        # usage, so they're only read for a cgroup of the task's own
+        if source != "proc" and not CGroup.isolated(pid):
+            if source == "cgroup":
+                print("Warning: process {} has no cgroup of its own; "
+                      "sampling /proc instead".format(pid), flush=True)
+            source = "proc"
+        elif source == "auto":
+            source = "cgroup"
+        self.source = source
+        self.reader = CGroup(pid) if source == "cgroup" else ProcTree(pid)
+
+        self.docker = {}
+        self.sockpath = dockerSocket()
+
+        self.usage = usage if usage is not None else UsageBuffer()
+        self.cpu_time = 0
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def _docker(self, pid):
+        if pid not in self.docker:
+            cmdline = self.reader.cmdline(pid)
+            call = cmdline[-1]
+            self.docker[pid] = (DockerStats(call, self.sockpath,
+                                            name=_dockerName(cmdline))
+                                if self.sockpath else call)
+        if isinstance(self.docker[pid], DockerStats):
+            return self.docker[pid].usage()
+        # Without access to the Engine API, fall back on the Docker CLI
+        return dockerUsage(self.docker[pid])
+
+    def run(self):
+        start = _threadTime()
+        last_time, last_cpu = None, None
+        next_tick = time.time()
+        while not self._halt.is_set():
+            try:
+                tim = time.time()
+                cpu_s, ram_b, procs = self.reader.sample()
+                if last_time is None or tim <= last_time:
+                    cpu = 0.0
+                else:
+                    cpu = max(cpu_s - last_cpu, 0) / (tim - last_time) * 100
+                last_time, last_cpu = tim, cpu_s
+                ram = ram_b * RAM_LUT['B']
+
+                for pid, name in procs:
+                    if name == "docker":
+                        _cpu, _ram = self._docker(pid)
+                        cpu += _cpu
+                        ram += _ram
+
+                if self.verbose:
+                    print(cpu, ram)
+
+                self.usage.append(tim, cpu, ram)
+
+            except (OSError, psutil.Error, TypeError, ValueError,
+                    AttributeError, IndexError, KeyError) as e:
+                if self.verbose:
+                    print("Logging failed: {0}".format(e))
+
+            next_tick += self.interval
+            self._halt.wait(max(next_tick - time.time(), 0))
+
+        for stream in self.docker.values():
+            if isinstance(stream, DockerStats):
+                stream.close()
+        self.cpu_time = _threadTime() - start
+
+    def summary(self):
+        return {"interval": self.interval,
+                "source": self.source,
+                "samples": len(self.usage),
+                "cpu_time": self.cpu_time}
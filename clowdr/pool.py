@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+#
+# This software is distributed with the MIT license:
+# https://github.com/gkiar/clowdr/blob/master/LICENSE
+#
+# clowdr/pool.py
+# Created by Greg Kiar on 2018-02-28.
+# Email: gkiar@mcin.ca
+
+from multiprocessing.connection import wait
+from itertools import chain
+import multiprocessing as mp
+import os.path as op
+import numpy as np
+import psutil
+import signal
+import time
+import sys
+import os
+
+from clowdr.controller.history import taskDurations
+from clowdr.task import attemptDir, promoteAttempt, discardAttempt, \
+    speculable
+
+
+def _cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parseJobs(value):
+    """parseJobs
+    Parses the value of a --jobs option: a number of workers, or "auto" for
+    one worker per CPU available to this process.
+
+    Parameters
+    ----------
+    value : str
+        Number of workers, or "auto"
+
+    Returns
+    -------
+    int
+        Number of workers
+    """
+    if value == "auto":
+        return _cpus()
+    jobs = int(value)
+    if jobs < 1:
+        raise ValueError("The number of jobs must be at least 1")
+    return jobs
+
+
+class Admission:
+    """Admission
+    Decides whether a task group can be started, given the RAM and CPUs it is
+    predicted to need (see "controller.history.groupDemand"). A group is only
+    started if, added to the groups already running, it fits within the
+    host's capacity, and if its RAM is currently free on the host.
+
+    Parameters
+    ----------
+    ram : float
+        RAM, in MB, which tasks may use. Defaults to what is available when
+        the pool is created, read through psutil
+    cpus : float
+        Number of CPUs which tasks may use. Defaults to those available to
+        this process
+    """
+    def __init__(self, ram=None, cpus=None):
+        self.ram = ram if ram else psutil.virtual_memory().available / 1024**2
+        self.cpus = cpus if cpus else _cpus()
+
+    def fits(self, demand, running=[]):
+        ram = sum(other["ram"] for other in running) + demand["ram"]
+        cpus = sum(other["cpus"] for other in running) + demand["cpus"]
+        if ram > self.ram or cpus > self.cpus:
+            return False
+        # Running tasks may not have reached their peak yet: their share is
+        # reserved above, and the host must have the new task's RAM free
+        available = psutil.virtual_memory().available / 1024**2
+        return demand["ram"] <= available
+
+
+def _work(target, args, kwargs, sender):
+    # Own process group, so the whole tree (Boutiques, containers, ...) can
+    # be signalled together, and terminal interrupts are left to the parent.
+    # Targets may report their outcome before they return (e.g. while
+    # "driver.runtask" waits for reprozip packs), handing their slot back
+    os.setpgrp()
+
+    def report(failed):
+        sender.send(bool(failed))
+    sys.exit(1 if target(*args, report=report, **kwargs) else 0)
+
+
+class TaskPool:
+    """TaskPool
+    Runs groups of tasks in parallel, each in its own process, and reports
+    each group as it completes. Each process runs the given target (e.g.
+    "driver.runtask") with a group, and fails if the target returns a truthy
+    value. On an interrupt, all running groups are terminated.
+
+    Optionally, stragglers are re-executed speculatively: once slots are
+    free, a group running for longer than "factor" times the "speculate"
+    quantile of the durations of completed tasks (scaled by its number of
+    tasks) is started a second time. Whichever copy succeeds first is kept,
+    and the other is cancelled. Each copy writes its outputs and provenance
+    to its own directory, and only those of the copy which is kept are
+    moved into place (see "task.promoteAttempt"). The durations are read
+    from the summaries in "rundir", which also holds tasks completed
+    elsewhere (e.g. in other jobs of a cluster run), or otherwise from the
+    groups completed here.
+
+    Parameters
+    ----------
+    target : function
+        Function called as target(taskgroup, **kwargs) in each process
+    jobs : int
+        Maximum number of groups run at once
+    admission : Admission
+        Optional admission control, using the predicted needs of each group
+    grace : float
+        Time, in seconds, given to terminated groups before they are killed
+    poll : float
+        Time, in seconds, between admission checks while groups are waiting
+        for resources
+    speculate : float
+        Quantile (between 0 and 1) of task durations past which a running
+        group is a straggler, or None to disable speculative execution
+    factor : float
+        Multiple of the quantile past which a group is a straggler
+    min_samples : int
+        Number of completed tasks needed before speculating
+    rundir : str
+        Run directory, whose summaries give the durations of completed tasks
+    verbose : bool
+        Toggle verbose output printing
+    """
+    def __init__(self, target, jobs=1, admission=None, grace=10, poll=5,
+                 speculate=None, factor=1.5, min_samples=3, rundir=None,
+                 verbose=False, **kwargs):
+        self.target = target
+        self.jobs = jobs
+        self.admission = admission
+        self.grace = grace
+        self.poll = poll
+        self.speculate = speculate
+        self.factor = factor
+        self.min_samples = min_samples
+        self.rundir = rundir
+        self.verbose = verbose
+        # Targets (e.g. "driver.runtask") are as verbose as the pool
+        self.kwargs = dict(kwargs, verbose=verbose)
+        self.running = {}
+        # Groups which reported their outcome, but haven't exited yet
+        self.draining = {}
+        self.results = []
+        self._durations = {}
+
+    def start(self, taskgroup, demand=None, attempt=0):
+        # When groups may be copied, each copy keeps its outputs and
+        # provenance apart until it is promoted (see "task.attemptDir")
+        kwargs = dict(self.kwargs, attempt=attempt) \
+            if self.speculate is not None else self.kwargs
+        receiver, sender = mp.Pipe(False)
+        proc = mp.Process(target=_work,
+                          args=(self.target, (taskgroup,), kwargs, sender))
+        proc.start()
+        # Only the worker writes; this lets recv() see EOF if it dies early
+        sender.close()
+        self.running[proc.sentinel] = {"proc": proc,
+                                       "report": receiver,
+                                       "tasks": taskgroup,
+                                       "start": time.time(),
+                                       "demand": demand,
+                                       "attempt": attempt,
+                                       "twin": None,
+                                       "speculated": False}
+        if self.verbose:
+            print("... Started task(s): {}".format(", ".join(taskgroup)),
+                  flush=True)
+        return proc.sentinel
+
+    def admit(self, pending):
+        # Starts waiting groups in order, skipping over those which don't fit
+        # yet so that smaller groups can keep the remaining capacity busy
+        for taskgroup, demand in list(pending):
+            if len(self.running) >= self.jobs:
+                break
+            fits = True
+            if self.admission is not None and demand is not None:
+                running = [entry["demand"] for entry in self.running.values()
+                           if entry["demand"] is not None]
+                fits = self.admission.fits(demand, running)
+                if not fits and not self.running:
+                    print("Task(s) {} may not fit on this host; running them"
+                          " alone".format(", ".join(taskgroup)), flush=True)
+                    fits = True
+            if fits:
+                pending.remove((taskgroup, demand))
+                self.start(taskgroup, demand)
+
+    def durations(self):
+        # Per-task durations of the tasks completed so far
+        if self.rundir is not None:
+            return list(taskDurations(self.rundir, self._durations).values())
+        return [result["duration"] / len(result["tasks"])
+                for result in self.results if not result["exitcode"]]
+
+    def threshold(self):
+        # Time per task after which a group is a straggler
+        durations = self.durations()
+        if len(durations) < self.min_samples:
+            return None
+        return self.factor * float(np.percentile(durations,
+                                                 self.speculate * 100))
+
+    def duplicate(self):
+        # Starts a second copy of the groups running for the longest, if
+        # they are stragglers and there are free slots
+        if len(self.running) >= self.jobs:
+            return
+        threshold = self.threshold()
+        if threshold is None:
+            return
+        now = time.time()
+        for sentinel, entry in sorted(self.running.items(),
+                                      key=lambda item: item[1]["start"]):
+            if len(self.running) >= self.jobs:
+                break
+            if entry["attempt"] or entry["speculated"]:
+                continue
+            limit = threshold * len(entry["tasks"])
+            if now - entry["start"] < limit:
+                continue
+            if not all(speculable(task) for task in entry["tasks"]):
+                # Both copies would write its outputs (see "task.speculable")
+                entry["speculated"] = True
+                continue
+            if self.admission is not None and entry["demand"] is not None:
+                running = [other["demand"] for other in self.running.values()
+                           if other["demand"] is not None]
+                if not self.admission.fits(entry["demand"], running):
+                    continue
+            print("... Task(s) {} running for {:.0f}s (straggler past "
+                  "{:.0f}s); starting a speculative copy"
+                  "".format(", ".join(entry["tasks"]), now - entry["start"],
+                            limit), flush=True)
+            twin = self.start(entry["tasks"], entry["demand"], attempt=1)
+            entry["speculated"] = True
+            entry["twin"] = twin
+            self.running[twin]["twin"] = sentinel
+
+    def collect(self, timeout=None):
+        reports = {entry["report"]: sentinel
+                   for sentinel, entry in self.running.items()
+                   if entry["report"] is not None}
+        ready = wait(list(reports) + list(self.running) +
+                     list(self.draining), timeout=timeout)
+        # Reports come first, as a group may also have exited since
+        for obj in sorted(ready, key=lambda obj: obj not in reports):
+            if obj in reports:
+                self.report(reports[obj], obj)
+            elif obj in self.draining:
+                entry = self.draining.pop(obj)
+                entry["proc"].join()
+                self.promote(entry)
+            elif obj in self.running:
+                entry = self.running.pop(obj)
+                entry["proc"].join()
+                self.complete(entry, entry["proc"].exitcode)
+                self.promote(entry)
+
+    def report(self, sentinel, receiver):
+        # A group reported its outcome: it no longer takes a slot, while it
+        # finishes up (e.g. packs traces), unless its copy should be promoted
+        entry = self.running.get(sentinel)
+        if entry is None:
+            return  # A copy cancelled since
+        entry["report"] = None
+        try:
+            failed = receiver.recv()
+        except EOFError:
+            return  # Exited without reporting; its exit code is used instead
+        finally:
+            receiver.close()
+        self.running.pop(sentinel)
+        self.draining[sentinel] = entry
+        self.complete(entry, int(failed))
+
+    def complete(self, entry, exitcode):
+        # Records the outcome of a group, unless its other copy may still
+        # succeed
+        twin = self.running.get(entry["twin"])
+        if twin is not None:
+            twin["twin"] = None
+            if exitcode:
+                # The other copy may still succeed
+                print("... A copy of task(s) {} failed (exit code {}); "
+                      "waiting for the other"
+                      "".format(", ".join(entry["tasks"]), exitcode),
+                      flush=True)
+                return
+            self.running.pop(entry["twin"])
+            self.stop([twin["proc"]])
+            print("... Cancelled the slower copy of task(s): {}"
+                  "".format(", ".join(entry["tasks"])), flush=True)
+        entry["kept"] = True
+        result = {"tasks": entry["tasks"],
+                  "exitcode": exitcode,
+                  "duration": time.time() - entry["start"],
+                  "speculative": bool(entry["attempt"])}
+        self.results += [result]
+        print("... Completed task(s): {} (exit code {}, {:.1f}s)"
+              "".format(", ".join(result["tasks"]), result["exitcode"],
+                        result["duration"]), flush=True)
+
+    def promote(self, entry):
+        # Only the files of the copy which is kept are moved into place, once
+        # it's done writing them and the other can't write anymore
+        if self.speculate is None or not entry.get("kept"):
+            return
+        # A copy which failed first may still be finishing up
+        for sentinel, other in list(self.draining.items()):
+            if other["tasks"] == entry["tasks"]:
+                self.stop([self.draining.pop(sentinel)["proc"]])
+        for task in entry["tasks"]:
+            discardAttempt(task, 1 - entry["attempt"],
+                           provdir=self.kwargs.get("provdir"))
+            promoteAttempt(task, entry["attempt"])
+
+    def stop(self, procs):
+        for proc in procs:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + self.grace
+        for proc in procs:
+            proc.join(max(deadline - time.time(), 0))
+            if proc.is_alive():
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                proc.join()
+
+    def terminate(self):
+        self.stop([entry["proc"]
+                   for entry in chain(self.running.values(),
+                                      self.draining.values())])
+        self.running = {}
+        self.draining = {}
+
+    def run(self, taskgroups, demands=None):
+        """run
+        Runs all task groups, at most "jobs" at a time.
+
+        Parameters
+        ----------
+        taskgroups : list
+            Lists of task files, each run in its own process
+        demands : list
+            Predicted needs of each group, used for admission control
+
+        Returns
+        -------
+        list
+            For each completed group: its tasks, exit code, duration, and
+            whether the speculative copy was kept
+        """
+        if demands is None:
+            demands = [None] * len(taskgroups)
+        pending = list(zip(taskgroups, demands))
+        try:
+            while pending or self.running or self.draining:
+                self.admit(pending)
+                if self.speculate is not None:
+                    self.duplicate()
+                # While groups wait for resources, or may become stragglers,
+                # recheck them periodically
+                blocked = pending and len(self.running) < self.jobs
+                watch = self.speculate is not None and \
+                    len(self.running) < self.jobs
+                self.collect(timeout=self.poll if blocked or watch else None)
+        except KeyboardInterrupt:
+            print("Interrupted; stopping {} running task group(s)..."
+                  "".format(len(self.running)), flush=True)
+            self.terminate()
+            raise
+
+        if self.speculate is not None:
+            for attemptsdir in set(op.dirname(attemptDir(task, 0))
+                                   for result in self.results
+                                   for task in result["tasks"]):
+                try:
+                    os.rmdir(attemptsdir)
+                except OSError:
+                    pass  # Missing, or holding attempts of other runs
+        return self.results
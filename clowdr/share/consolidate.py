@@ -1,18 +1,17 @@
 #!/usr/bin/env python
 
 import os.path as op
-import pandas as pd
 import numpy as np
 import json
-import os
 import re
 
+from clowdr.monitor import readUsage
+from clowdr import manifest
+
 
 def summary(indir, outfile):
     # Get list of tasks
-    tasks = [op.join(indir, f)
-             for f in os.listdir(indir)
-             if re.match(r'task-[0-9]+.json', f)]
+    tasks = manifest.listTasks(indir)
     experiment = []
 
     # For each task...
@@ -20,12 +19,10 @@ def summary(indir, outfile):
         task_id = re.findall(r'.+task-([0-9]+).json', task_file)[0]
         task_dict = {}
 
-        # Load task file...
-        with open(task_file) as task_fhandle:
-            # ... and extract the descriptor and invocation
-            tmp_task = json.load(task_fhandle)
-            descriptor_file = op.join(indir, op.basename(tmp_task['tool']))
-            invocat_file = op.join(indir, op.basename(tmp_task['invocation']))
+        # Load task (from its file or the run's manifest)...
+        tmp_task = manifest.loadTask(task_file)
+        # ... and extract the descriptor
+        descriptor_file = op.join(indir, op.basename(tmp_task.tool))
 
         # Load descriptor file...
         with open(descriptor_file) as descriptor_fhandle:
@@ -34,15 +31,14 @@ def summary(indir, outfile):
             tmp_name = tmp_desc['name']
             tmp_inps = {inp['id']: inp['name'] for inp in tmp_desc['inputs']}
 
-        # Load the invocation file...
-        with open(invocat_file) as invocation_fhandle:
-            # ... and extract the invocation parameters used
-            tmp_invo = json.load(invocation_fhandle)
-            tmp_invo_dict = {}
-            for inp in tmp_inps:
-                key = 'Param: {}'.format(tmp_inps[inp])
-                if tmp_invo.get(inp):
-                    tmp_invo_dict[key] = tmp_invo[inp]
+        # Load the invocation...
+        tmp_invo = tmp_task.loadInvocation(indir)
+        # ... and extract the invocation parameters used
+        tmp_invo_dict = {}
+        for inp in tmp_inps:
+            key = 'Param: {}'.format(tmp_inps[inp])
+            if tmp_invo.get(inp):
+                tmp_invo_dict[key] = tmp_invo[inp]
 
         # Load the summary file...
         summary_file = op.join(indir, 'task-' + task_id + '-summary.json')
@@ -77,16 +73,18 @@ def summary(indir, outfile):
         else:
             tmp_serr = None
 
-        # Load the usage file...
-        usage_file = op.join(indir, 'task-' + task_id + '-usage.csv')
+        # Load the usage file (binary, if present, otherwise CSV)...
+        usage_file = op.join(indir, 'task-' + task_id + '-usage.bin')
+        if not op.isfile(usage_file):
+            usage_file = op.join(indir, 'task-' + task_id + '-usage.csv')
         if op.isfile(usage_file):
-            tmp_df = pd.read_csv(usage_file)
+            tmp_usage = readUsage(usage_file)
             # ... and extract the RAM time series and summary of it
-            tmp_tim = [w for v in tmp_df[['time']].values.tolist() for w in v]
-            tmp_ram = [w for v in tmp_df[['ram']].values.tolist() for w in v]
-            tmp_cpu = [w for v in tmp_df[['cpu']].values.tolist() for w in v]
-            tmp_max_ram = np.max(tmp_ram)
-            tmp_max_cpu = np.max(tmp_cpu)
+            tmp_tim = tmp_usage['time'].tolist()
+            tmp_ram = tmp_usage['ram'].tolist()
+            tmp_cpu = tmp_usage['cpu'].tolist()
+            tmp_max_ram = float(np.max(tmp_ram)) if tmp_ram else None
+            tmp_max_cpu = float(np.max(tmp_cpu)) if tmp_cpu else None
         else:
             tmp_tim = None
             tmp_ram = None
@@ -10,73 +10,214 @@
 from argparse import ArgumentParser
 from datetime import datetime
 from time import mktime, localtime
-from subprocess import PIPE
+from subprocess import PIPE, STDOUT
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 import multiprocessing as mp
 import numpy as np
 import os.path as op
 import subprocess
-import psutil
 import time
 import json
 import csv
+import sys
 import os
-import re
-import warnings
-
-
-warnings.filterwarnings("ignore", message="numpy.dtype size changed")
-
-import pandas as pd
 
 import boutiques as bosh
+from clowdr.monitor import Sampler, UsageBuffer, DownsampledBuffer
+from clowdr.logs import LogTee, LogUploader, StreamedOutput
+from clowdr.cache import ImageCache
+from clowdr import manifest
 from clowdr import utils
 
 
+# Files to move into place when an attempt is promoted, in its directory
+PROMOTE = "clowdr-promote.json"
+
+
+def attemptDir(taskfile, attempt):
+    """attemptDir
+    Directory in which an attempt of a task that may run alongside another
+    (see "pool.TaskPool") works, and keeps its outputs and provenance, until
+    it is promoted (see "promoteAttempt").
+    """
+    task_id = op.basename(taskfile).split('.')[0].split('-')[-1]
+    return op.join(op.dirname(taskfile), "clowdr-attempts",
+                   "task-{}-attempt-{}".format(task_id, attempt))
+
+
+def workDir(taskfile, provdir=None, attempt=None):
+    """workDir
+    Directory in which a task keeps its provenance while it runs: under
+    "provdir", or "/clowtask/" when none is given. Speculative copies of a
+    task work alongside the original.
+    """
+    task_id = op.basename(taskfile).split('.')[0].split('-')[-1]
+    workdir = op.join(provdir or "/clowtask/", "clowtask_" + task_id)
+    if attempt:
+        workdir += "-attempt-{}".format(attempt)
+    return workdir
+
+
+def speculable(taskfile):
+    """speculable
+    Whether a task may run alongside a speculative copy. Each copy writes
+    its outputs to its own directory, so that outputs with absolute paths
+    would be written by both: such tasks are not copied. Tasks which can't
+    be read aren't checked, as their copy would fail just as they do.
+    """
+    try:
+        task = manifest.loadTask(taskfile)
+        invocation = json.dumps(task.loadInvocation())
+    except (OSError, ValueError):
+        return True
+    outputs = bosh.evaluate(task.tool, invocation, 'output-files/')
+    return not any(op.isabs(str(outfile)) for outfile in outputs.values()
+                   if outfile)
+
+
+def _replace(src, dst):
+    # Files are replaced atomically; directories are swapped, so that the
+    # destination is never missing a part of either
+    if op.isdir(dst) and not op.islink(dst):
+        aside = "{}.{}".format(dst, utils.randstring(8))
+        os.replace(dst, aside)
+        os.replace(src, dst)
+        utils.remove(aside)
+    else:
+        os.makedirs(op.dirname(dst) or ".", exist_ok=True)
+        os.replace(src, dst)
+
+
+def promoteAttempt(taskfile, attempt):
+    """promoteAttempt
+    Moves the outputs and provenance of an attempt of a task into place,
+    then removes its directory. The summary is moved last, so that the task
+    only appears complete once all of its files are in place.
+    """
+    stagedir = attemptDir(taskfile, attempt)
+    try:
+        with open(op.join(stagedir, PROMOTE)) as fhandle:
+            moves = json.load(fhandle)
+    except (IOError, ValueError):
+        moves = []  # The attempt didn't get to report its files
+    for src, dst in moves:
+        if op.lexists(src):
+            _replace(src, dst)
+    utils.remove(stagedir)
+
+
+def discardAttempt(taskfile, attempt, provdir=None):
+    """discardAttempt
+    Removes the outputs and provenance of an attempt of a task, as well as
+    the directory it worked in (see "workDir").
+    """
+    utils.remove(attemptDir(taskfile, attempt))
+    utils.remove(workDir(taskfile, provdir, attempt))
+
+
+def stageInputs(descriptor, invocation, cwd):
+    """stageInputs
+    Prepares an invocation to run from another directory than "cwd": its
+    relative input files are made absolute, in place. Returns the volumes
+    through which a container still finds them there.
+    """
+    with open(descriptor) as fhandle:
+        desc = json.load(fhandle)
+    with open(invocation) as fhandle:
+        invo = json.load(fhandle)
+
+    def absolute(value):
+        if isinstance(value, list):
+            return [absolute(val) for val in value]
+        if isinstance(value, str) and not value.startswith("s3://"):
+            return op.join(cwd, value)
+        return value
+
+    for inp in desc.get("inputs", []):
+        if inp.get("type") == "File" and inp["id"] in invo:
+            invo[inp["id"]] = absolute(invo[inp["id"]])
+    with open(invocation, "w") as fhandle:
+        json.dump(invo, fhandle, indent=4, sort_keys=True)
+    if not desc.get("container-image"):
+        return []
+    return ["{0}:{0}".format(cwd)]
+
+
 class TaskHandler:
+    # Directory of the attempt, if the task may run alongside another
+    stagedir = None
+
     def __init__(self, taskfile, **kwargs):
         self.manageTask(taskfile, **kwargs)
 
     def manageTask(self, taskfile, provdir=None, verbose=False, **kwargs):
-        # Get metadata
-        if provdir is None:
-            self.localtaskdir = "/clowtask/"
-        else:
-            self.localtaskdir = provdir
-
         # The below grabs an ID from the form: /some/path/to/fname-#.ext
         self.task_id = taskfile.split('.')[0].split('-')[-1]
 
-        self.localtaskdir = op.join(self.localtaskdir, "clowtask_"+self.task_id)
+        # Get metadata
+        self.localtaskdir = workDir(taskfile, provdir, kwargs.get("attempt"))
         if not op.exists(self.localtaskdir):
             os.makedirs(self.localtaskdir)
 
         if(verbose):
             print("Fetching metadata...", flush=True)
         remotetaskdir = op.dirname(taskfile)
-        taskfile = utils.get(taskfile, self.localtaskdir)[0]
-
-        # Parse metadata
-        taskinfo = json.load(open(taskfile))
-        descriptor = taskinfo['tool']
-        invocation = taskinfo['invocation']
-        input_data = taskinfo['dataloc']
-        output_loc = utils.truepath(taskinfo['taskloc'])
+        self.remotetaskdir = remotetaskdir
+
+        # Attempts of a task which may run alongside a speculative copy
+        # (see "pool.TaskPool") work and keep their provenance apart, until
+        # the copy which is kept gets promoted
+        if kwargs.get("attempt") is not None and kwargs.get("local"):
+            self.stagedir = attemptDir(taskfile, kwargs["attempt"])
+            os.makedirs(op.join(self.stagedir, "work"), exist_ok=True)
+        postdir = self.stagedir or remotetaskdir
+
+        # Parse metadata, from the task's file or from its run's manifest
+        taskinfo = manifest.loadTask(taskfile)
+        descriptor = taskinfo.tool
+        invocation = taskinfo.invocation
+        input_data = taskinfo.dataloc
+        output_loc = utils.truepath(taskinfo.taskloc)
 
         if(verbose):
             print("Fetching descriptor and invocation...", flush=True)
         # Get descriptor and invocation
         desc_local = utils.get(descriptor, self.localtaskdir)[0]
-        invo_local = utils.get(invocation, self.localtaskdir)[0]
+        if taskinfo.invocation_data is not None:
+            # Invocations stored in the manifest are only written out here
+            invo_local = op.join(self.localtaskdir, op.basename(invocation))
+            with open(invo_local, "w") as fhandle:
+                json.dump(taskinfo.invocation_data, fhandle, indent=4,
+                          sort_keys=True)
+        else:
+            invo_local = utils.get(invocation, self.localtaskdir)[0]
 
         # Get input data, if running remotely
+        self.prefetch_summary = {"container": None, "data": None}
+        self.image = None
+        self.images = ExitStack()
         if not kwargs.get("local") and \
            any([dl.startswith("s3://") for dl in input_data]):
             if(verbose):
                 print("Fetching input data...", flush=True)
             localdatadir = op.join("/data")
+            if not op.exists(localdatadir):
+                os.makedirs(localdatadir)
+
+            # Pull the container image while the input data is downloaded;
+            # Boutiques then finds it already present when executing
+            pool = ThreadPoolExecutor(max_workers=1)
+            pull = pool.submit(self.prefetch, desc_local, localdatadir,
+                               verbose=verbose, **kwargs)
+            pool.shutdown(wait=False)
+
+            fetch_start = time.time()
             local_input_data = []
             for dataloc in input_data:
                 local_input_data += utils.get(dataloc, localdatadir)
+            self.prefetch_summary["data"] = time.time() - fetch_start
+            pull.result()
             # Move to correct location
             os.chdir(localdatadir)
         else:
@@ -84,22 +225,49 @@ class TaskHandler:
                 print("Skipping data fetch (local execution)...", flush=True)
             if kwargs.get("workdir") and op.exists(kwargs.get("workdir")):
                 os.chdir(kwargs["workdir"])
+            if kwargs.get("image_cache") is not None:
+                self.prefetch(desc_local, os.getcwd(), verbose=verbose,
+                              **kwargs)
+
+        # Attempts write their outputs in their own working directory; the
+        # inputs are found where they were, from there
+        volumes = list(kwargs.get("volumes") or [])
+        if self.stagedir is not None:
+            taskcwd = os.getcwd()
+            volumes += stageInputs(desc_local, invo_local, taskcwd)
+            os.chdir(op.join(self.stagedir, "work"))
 
         if(verbose):
             print("Beginning execution...", flush=True)
         # Launch task
         copts = ['launch', desc_local, invo_local]
-        if kwargs.get("volumes"):
-            copts += ['-v'] + kwargs.get("volumes")
+        if volumes:
+            copts += ['-v'] + volumes
         if kwargs.get("user"):
             copts += ['-u']
+        if self.image is not None:
+            # Use the image from the node's cache
+            if self.image["type"] == "singularity":
+                copts += ['--imagepath', self.image["path"]]
+            else:
+                copts += ['--no-pull']
 
         start_time = time.time()
         self.provLaunch(copts, verbose=verbose, **kwargs)
+        self.images.close()
         if(verbose):
             print(self.output, flush=True)
         duration = time.time() - start_time
 
+        # Pack the reprozip trace in the background, so that the task can
+        # report its completion first
+        trace = getattr(self.output, "timings", None)
+        packing = None
+        if trace and op.isdir(self.tracedir()):
+            pool = ThreadPoolExecutor(max_workers=1)
+            packing = pool.submit(self.packTrace, verbose=verbose)
+            pool.shutdown(wait=False)
+
         # Get list of bosh exec outputs
         with open(desc_local) as fhandle:
             outputs_all = json.load(fhandle)["output-files"]
@@ -109,179 +277,324 @@ class TaskHandler:
         for outfile in outputs_all.values():
             outputs_present += [outfile] if op.exists(outfile) else []
 
-        # Write memory/cpu stats to file
-        usagef = "task-{}-usage.csv".format(self.task_id)
-        self.cpu_ram_usage.to_csv(op.join(self.localtaskdir, usagef),
-                                  sep=',', index=False)
-        utils.post(op.join(self.localtaskdir, usagef), remotetaskdir)
+        # Outputs of an attempt are moved to where the task would have
+        # written them when it is promoted
+        self.promotions = []
+        if self.stagedir is not None:
+            for outfile in outputs_present:
+                if not op.isabs(outfile):
+                    self.promotions += [(op.join(os.getcwd(), outfile),
+                                         op.join(taskcwd, outfile))]
+            os.chdir(taskcwd)
 
-        # Write stdout to file
+        # Write memory/cpu stats to file
+        usage_format = kwargs.get("usage_format") or "csv"
+        usagefs = []
+        if usage_format in ["bin", "both"]:
+            usagefs += ["task-{}-usage.bin".format(self.task_id)]
+            self.cpu_ram_usage.toBinary(op.join(self.localtaskdir,
+                                                usagefs[-1]))
+        if usage_format in ["csv", "both"]:
+            usagefs += ["task-{}-usage.csv".format(self.task_id)]
+            self.cpu_ram_usage.toCSV(op.join(self.localtaskdir, usagefs[-1]))
+        provfs = list(usagefs)
+        usagef = usagefs[0]
+        usagefullf = None
+        if getattr(self.cpu_ram_usage, "spill", None):
+            usagefullf = op.basename(self.cpu_ram_usage.spill)
+            provfs += [usagefullf]
+
+        # Write stdout to file (unless it was streamed there already)
         stdoutf = "task-{}-stdout.txt".format(self.task_id)
-        with open(op.join(self.localtaskdir, stdoutf), "w") as fhandle:
-            fhandle.write(self.output.stdout)
-        utils.post(op.join(self.localtaskdir, stdoutf), remotetaskdir)
+        if self.output.stdout is not None:
+            with open(op.join(self.localtaskdir, stdoutf), "w") as fhandle:
+                fhandle.write(self.output.stdout)
+        provfs += [stdoutf]
 
-        # Write sterr to file
+        # Write sterr to file (unless it was streamed there already, or
+        # merged into stdout)
         stderrf = "task-{}-stderr.txt".format(self.task_id)
-        with open(op.join(self.localtaskdir, stderrf), "w") as fhandle:
-            fhandle.write(self.output.stderr)
-        utils.post(op.join(self.localtaskdir, stderrf), remotetaskdir)
-
-        start_time = datetime.fromtimestamp(mktime(localtime(start_time)))
-        summary = {"duration": duration,
-                   "launchtime": str(start_time),
-                   "exitcode": self.output.exit_code,
-                   "outputs": [],
-                   "usage": op.join(remotetaskdir, usagef),
-                   "stdout": op.join(remotetaskdir, stdoutf),
-                   "stderr": op.join(remotetaskdir, stderrf)}
-
+        merged = getattr(self.output, "merged", False)
+        if self.output.stderr is not None:
+            with open(op.join(self.localtaskdir, stderrf), "w") as fhandle:
+                fhandle.write(self.output.stderr)
+        if not merged:
+            provfs += [stderrf]
+
+        # Upload provenance files and outputs concurrently
+        transfers = [(op.join(self.localtaskdir, provf), postdir)
+                     for provf in provfs]
         if not kwargs.get("local"):
             if(verbose):
                 print("Uploading outputs...", flush=True)
-            # Push outputs
             for local_output in outputs_present:
                 if(verbose):
                     print("{} --> {}".format(local_output, output_loc),
                           flush=True)
-                tmpouts = utils.post(local_output, output_loc)
-                print(tmpouts)
-                summary["outputs"] += tmpouts
+                transfers += [(local_output, output_loc)]
         else:
             if(verbose):
                 print("Skipping uploading outputs (local execution)...",
                       flush=True)
+        uploads = utils.postMany(transfers,
+                                 jobs=kwargs.get("upload_jobs") or 4,
+                                 verbose=verbose)
+
+        start_time = datetime.fromtimestamp(mktime(localtime(start_time)))
+        summary = {"duration": duration,
+                   "launchtime": str(start_time),
+                   "exitcode": self.output.exit_code,
+                   "outputs": [],
+                   "usage": op.join(remotetaskdir, usagef),
+                   "stdout": op.join(remotetaskdir, stdoutf),
+                   "stderr": None if merged
+                   else op.join(remotetaskdir, stderrf),
+                   "stderr_merged": merged,
+                   "sampler": self.sampler_summary,
+                   "prefetch": self.prefetch_summary,
+                   "uploads": uploads}
+        if kwargs.get("attempt"):
+            summary["attempt"] = kwargs["attempt"]
+        if taskinfo.memo:
+            summary["memo"] = taskinfo.memo
+        if usagefullf:
+            summary["usage_full"] = op.join(remotetaskdir, usagefullf)
+        if trace:
+            # The pack's timings are written apart (see "joinPack"), so that
+            # the summary is final once the task completes
+            packf = "task-{}-reprozip.json".format(self.task_id)
+            summary["reprozip"] = dict(trace, pack=None)
+            if packing is not None:
+                summary["reprozip"]["pack"] = op.join(remotetaskdir, packf)
+
+        if not kwargs.get("local"):
+            for upload in uploads[len(provfs):]:
+                summary["outputs"] += upload["remote"]
+        else:
             summary["outputs"] = outputs_present
 
         summarf = "task-{}-summary.json".format(self.task_id)
         with open(op.join(self.localtaskdir, summarf), "w") as fhandle:
             fhandle.write(json.dumps(summary, indent=4, sort_keys=True) + "\n")
-        utils.post(op.join(self.localtaskdir, summarf), remotetaskdir)
+        utils.post(op.join(self.localtaskdir, summarf), postdir)
 
-        # If not local, delete all: inputs, outputs, and summaries
+        # If not local, delete inputs and outputs, so they can't be mistaken
+        # for those of the next task
         if not kwargs.get("local"):
             for local_output in outputs_present:
                 utils.remove(local_output)
-            utils.remove(self.localtaskdir)
             for local_input in local_input_data:
                 utils.remove(local_input)
 
+        # The trace may still be packing: its timings are posted, and the
+        # task's directory removed, once the pack is joined (see "joinPack"),
+        # so that the next task doesn't wait for it
+        self.packing = packing
+        self.cleanup = [] if kwargs.get("local") else [self.localtaskdir]
+        if packing is None:
+            self.joinPack(verbose=verbose)
+
+    def joinPack(self, verbose=False):
+        # Once the trace is packed and uploaded, post the pack's timings
+        # next to the summary, which points to them
+        if self.packing is not None:
+            if(verbose):
+                print("Waiting for the reprozip pack...", flush=True)
+            packf = op.join(self.localtaskdir,
+                            "task-{}-reprozip.json".format(self.task_id))
+            with open(packf, "w") as fhandle:
+                fhandle.write(json.dumps(self.packing.result(), indent=4,
+                                         sort_keys=True) + "\n")
+            self.packing = None
+            utils.post(packf, self.stagedir or self.remotetaskdir)
+
+        # Once all of its files are there, the attempt can be promoted
+        if self.stagedir is not None:
+            provfs = sorted((f for f in os.listdir(self.stagedir)
+                             if f.startswith("task-")),
+                            key=lambda f: f.endswith("-summary.json"))
+            moves = self.promotions + [(op.join(self.stagedir, f),
+                                        op.join(self.remotetaskdir, f))
+                                       for f in provfs]
+            with open(op.join(self.stagedir, PROMOTE), "w") as fhandle:
+                json.dump(moves, fhandle, indent=4)
+
+        # If not local, delete the summaries and trace
+        for path in self.cleanup:
+            utils.remove(path)
+        self.cleanup = []
+
+    def prefetch(self, descriptor, savedir, **kwargs):
+        with open(descriptor) as fhandle:
+            container = json.load(fhandle).get("container-image")
+        if not container:
+            return
+
+        if kwargs.get("verbose"):
+            print("Fetching container image...", flush=True)
+        pull_start = time.time()
+        try:
+            if kwargs.get("image_cache") is not None:
+                # The image stays locked in the cache until the task is done
+                cache = ImageCache(kwargs["image_cache"] or None,
+                                   max_size=kwargs.get("image_cache_size"),
+                                   verbose=kwargs.get("verbose"))
+                self.image = self.images.enter_context(
+                    cache.use(container, simg=kwargs.get("simg")))
+                self.prefetch_summary["image"] = self.image.get("digest")
+            else:
+                utils.getContainer(savedir, container, **kwargs)
+        except Exception as e:
+            # Not fatal: Boutiques will attempt the pull again itself
+            if kwargs.get("verbose"):
+                print("Container prefetch failed: {}".format(e), flush=True)
+        self.prefetch_summary["container"] = time.time() - pull_start
+
     def execWrapper(self, sender):
         # if reprozip: use it
-        if not subprocess.Popen("type reprozip 2>/dev/null", shell=True).wait():
+        if self.reprozip:
             if self.runner_kwargs.get("verbose"):
                 print("Reprozip found; will use to record provenance!",
                       flush=True)
+            setup_start = time.time()
             cmd = 'reprozip usage_report --disable'
             p = subprocess.Popen(cmd, shell=True).wait()
 
-            cmd = 'reprozip trace -w --dir={}/task-{}-reprozip/ bosh exec {}'
-            p = subprocess.Popen(cmd.format(self.localtaskdir,
-                                            self.task_id,
-                                            " ".join(self.runner_args)),
-                                 shell=True).wait()
-
-            cmd = ('reprozip pack --dir={0}/task-{1}-reprozip/ '
-                   '{0}/task-{1}-reprozip'.format(self.localtaskdir,
-                                                  self.task_id))
-            p = subprocess.Popen(cmd, shell=True).wait()
+            # The trace is packed later, off the critical path (packTrace)
+            trace_start = time.time()
+            prefix = ["reprozip", "trace", "-w",
+                      "--dir={}".format(self.tracedir())]
+            if self.runner_kwargs.get("stream_logs"):
+                output = self.streamExec(prefix)
+            else:
+                cmd = prefix + ["bosh", "exec"] + self.runner_args
+                proc = subprocess.Popen(cmd, stdout=PIPE, stderr=PIPE)
+                stdout, stderr = proc.communicate()
+                output = StreamedOutput(proc.returncode,
+                                        stdout=stdout.decode("utf-8",
+                                                             "replace"),
+                                        stderr=stderr.decode("utf-8",
+                                                             "replace"))
+            output.timings = {"setup": trace_start - setup_start,
+                              "trace": time.time() - trace_start}
+            sender.send(output)
         else:
             if self.runner_kwargs.get("verbose"):
                 print("Reprozip not found; install to record more provenance!",
                       flush=True)
-            sender.send(bosh.execute(*self.runner_args))
+            if self.runner_kwargs.get("stream_logs"):
+                sender.send(self.streamExec())
+            else:
+                sender.send(bosh.execute(*self.runner_args))
+
+    def tracedir(self):
+        return op.join(self.localtaskdir,
+                       "task-{}-reprozip".format(self.task_id))
+
+    def packTrace(self, **kwargs):
+        # Packs the reprozip trace and uploads it; runs once the task has
+        # already reported its summary
+        packf = op.join(self.localtaskdir,
+                        "task-{}-reprozip.rpz".format(self.task_id))
+        pack_start = time.time()
+        cmd = ["reprozip", "pack", "--dir={}".format(self.tracedir()), packf]
+        proc = subprocess.Popen(cmd, stdout=PIPE, stderr=PIPE)
+        proc.communicate()
+        timings = {"pack": time.time() - pack_start,
+                   "upload": None,
+                   "file": None}
+        if proc.returncode or not op.isfile(packf):
+            if kwargs.get("verbose"):
+                print("Reprozip pack failed!", flush=True)
+            return timings
+
+        postdir = self.stagedir or self.remotetaskdir
+        upload = utils.postMany([(packf, postdir)],
+                                jobs=1, verbose=kwargs.get("verbose"))[0]
+        timings["upload"] = upload["seconds"]
+        timings["file"] = op.join(self.remotetaskdir, op.basename(packf))
+        return timings
+
+    def logfile(self, stream):
+        return op.join(self.localtaskdir,
+                       "task-{}-{}.txt".format(self.task_id, stream))
+
+    def streamExec(self, prefix=[]):
+        # Runs Boutiques in its own process, so that the tool's output goes
+        # straight to the log files rather than being captured in memory.
+        # Boutiques merges the tool's stderr into its stdout when streaming,
+        # so its own messages are kept in order alongside them, in one log
+        cmd = prefix + ["bosh", "exec"] + self.runner_args + ["--stream"]
+        proc = subprocess.Popen(cmd, stdout=PIPE, stderr=STDOUT)
+        echo = sys.stdout if self.runner_kwargs.get("verbose") else None
+        tee = LogTee(proc.stdout, self.logfile("stdout"), echo=echo)
+        tee.start()
+        exit_code = proc.wait()
+        tee.join()
+        return StreamedOutput(exit_code, tee.path, merged=True)
 
     def provLaunch(self, options, **kwargs):
         self.runner_args = options
         self.runner_kwargs = kwargs
-        timing, cpu, ram = self.monitor(self.execWrapper, **kwargs)
-
-        basetime = timing[0]
-
-        total_df = pd.DataFrame(columns=['time', 'cpu', 'ram'])
-        for ttime, tcpu, tram in zip(timing, cpu, ram):
-            total_df.loc[len(total_df)] = (ttime-basetime, tcpu, tram)
-
-        self.cpu_ram_usage = total_df
+        # Looked up here so that the worker inherits the cached result
+        self.reprozip = utils.findTool("reprozip")
+        self.cpu_ram_usage = self.monitor(self.execWrapper, **kwargs)
 
     def monitor(self, target, **kwargs):
-        ram_lut = {'B': 1/1024/1024,
-                   'KiB': 1/1024,
-                   'MiB': 1,
-                   'GiB': 1024}
-        self.output, sender = mp.Pipe(False)
+        receiver, sender = mp.Pipe(False)
         worker_process = mp.Process(target=target, args=(sender,))
         worker_process.start()
-        p = psutil.Process(worker_process.pid)
-
-        log_time = []
-        log_cpu = []
-        log_mem = []
-        while worker_process.is_alive():
-            try:
-                cpu = p.cpu_percent()
-                ram = p.memory_info()[0]*ram_lut['B']
-
-                for subproc in p.children(recursive=True):
-                    if not subproc.is_running():
-                        continue
-
-                    subproc_dict = subproc.as_dict(attrs=['pid',
-                                                          'name',
-                                                          'cmdline',
-                                                          'memory_info'])
-                    if subproc_dict['name'] == 'docker':
-                        call = subproc_dict['cmdline'][-1]
-                        tcmd = psutil.Popen(["docker", "ps", "-q"], stdout=PIPE)
-                        running = tcmd.communicate()[0].decode('utf-8')
-                        running = running.split('\n')
-                        tcmd = psutil.Popen(["docker", "inspect"] + running,
-                                            stdout=PIPE, stderr=PIPE)
-                        tinf = json.loads(tcmd.communicate()[0].decode('utf-8'))
-                        for tcon in tinf:
-                            if (tcon.get("Config") and
-                               tcon.get("Config").get("Cmd") and
-                               call in tcon['Config']['Cmd']):
-                                tid = tcon['Id']
-                                tcmd = psutil.Popen([
-                                                     "docker",
-                                                     "stats",
-                                                     tid,
-                                                     "--no-stream",
-                                                     "--format",
-                                                     "'{{.MemUsage}} " +
-                                                     "{{.CPUPerc}}'"
-                                                    ],
-                                                    stdout=PIPE)
-                                tout = tcmd.communicate()[0].decode('utf-8')
-                                tout = tout.strip('\n').replace("'", "")
-
-                                _ram, _, _, _cpu = tout.split(' ')
-                                _ram, ending = re.match('([0-9.]+)([MGK]?i?B)',
-                                                        _ram).groups()
-                                ram += float(_ram) * ram_lut[ending]
-                                cpu += float(_cpu.strip('%'))
-
-                    else:
-                        cpu += subproc.cpu_percent(interval=1)
-                        ram += subproc_dict['memory_info'][0] * ram_lut['B']
-
-                if kwargs.get('verbose'):
-                    print(cpu, ram)
-
-                tim = time.time()
-                log_time.append(tim)
-                log_cpu.append(cpu)
-                log_mem.append(ram)
-                time.sleep(1)
-
-            except (psutil._exceptions.AccessDenied,
-                    psutil._exceptions.NoSuchProcess,
-                    TypeError, ValueError, AttributeError) as e:
-                if kwargs.get('verbose'):
-                    print("Logging failed: {0}".format(e))
-                continue
-
+        # Only the worker writes; this lets recv() see EOF if it dies early
+        sender.close()
+
+        # Keep a bounded number of samples in memory for very long tasks
+        if kwargs.get("usage_points"):
+            spill = None
+            if kwargs.get("usage_full"):
+                spill = op.join(self.localtaskdir, "task-{}-usage-full.csv"
+                                "".format(self.task_id))
+            usage = DownsampledBuffer(kwargs["usage_points"], spill=spill)
+        else:
+            usage = UsageBuffer()
+
+        sampler = Sampler(worker_process.pid,
+                          interval=kwargs.get("sample_interval") or 1,
+                          source=kwargs.get("sample_source") or "auto",
+                          usage=usage,
+                          verbose=kwargs.get("verbose"))
+        sampler.start()
+
+        # Rolling upload of the logs as they are written, if they're remote
+        uploader = None
+        if kwargs.get("stream_logs") and \
+           self.remotetaskdir.startswith("s3://"):
+            uploader = LogUploader([self.logfile("stdout")],
+                                   self.remotetaskdir,
+                                   interval=kwargs.get("log_interval") or 60,
+                                   prefix="task-{}-logs".format(self.task_id),
+                                   verbose=kwargs.get("verbose"))
+            uploader.start()
+
+        # Receive before joining, so that a large result can't block the worker
+        try:
+            self.output = receiver.recv()
+        except EOFError:
+            self.output = None
         worker_process.join()
-        self.output = self.output.recv()
-        return log_time, log_cpu, log_mem
+        if self.output is None:
+            msg = "Task worker exited with code {} before reporting a result"
+            self.output = StreamedOutput(worker_process.exitcode or 1,
+                                         stdout="",
+                                         stderr=msg.format(
+                                                worker_process.exitcode))
+
+        if uploader is not None:
+            uploader.stop()
+            uploader.join()
+        sampler.stop()
+        sampler.join()
+        self.sampler_summary = sampler.summary()
+        if isinstance(usage, DownsampledBuffer):
+            usage.close()
+
+        return sampler.usage
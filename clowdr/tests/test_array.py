@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+from contextlib import redirect_stdout
+import os.path as op
+import subprocess
+import tempfile
+import shutil
+import json
+import io
+import os
+
+from clowdr import driver
+
+
+class TestArray(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bindir = op.join(self.tmpdir, "bin")
+        os.mkdir(self.bindir)
+        # Fake scheduler and task runner, recording how they're called
+        self.fake("sbatch", 'echo "$@" >> {0}/sbatch.calls\n'
+                            'cp "${{@: -1}}" {0}/submitted.sh\n'
+                            'echo "Submitted batch job 42"\n')
+        self.fake("clowdr", 'echo "$@" > {0}/clowdr.args\n')
+
+        self.descriptor = op.join(self.tmpdir, "descriptor.json")
+        with open(self.descriptor, "w") as fhandle:
+            json.dump({"name": "tool", "tool-version": "1",
+                       "description": "test", "schema-version": "0.5",
+                       "command-line": "echo [X]",
+                       "inputs": [{"id": "x", "name": "X", "type": "String",
+                                   "value-key": "[X]"}]}, fhandle)
+        self.invocation = op.join(self.tmpdir, "invocation.json")
+        with open(self.invocation, "w") as fhandle:
+            json.dump({"x": ["a", "b", "c", "d", "e"]}, fhandle)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def fake(self, name, body):
+        path = op.join(self.bindir, name)
+        with open(path, "w") as fhandle:
+            fhandle.write("#!/bin/bash\n" + body.format(self.tmpdir))
+        os.chmod(path, 0o755)
+
+    def test_array_submission(self):
+        cwd = os.getcwd()
+        env = {"PATH": self.bindir + os.pathsep + os.environ["PATH"]}
+        with mock.patch.dict(os.environ, env), \
+                redirect_stdout(io.StringIO()):
+            taskdir = driver.local(open(self.descriptor), self.invocation,
+                                   op.join(self.tmpdir, "prov"),
+                                   sweep=["x"], cluster="slurm", array=True,
+                                   groupby=2, clusterargs="time:1:00")
+        os.chdir(cwd)
+
+        # Five tasks in three groups, submitted with a single call
+        with open(op.join(self.tmpdir, "sbatch.calls")) as fhandle:
+            self.assertEqual(len(fhandle.readlines()), 1)
+        with open(op.join(self.tmpdir, "submitted.sh")) as fhandle:
+            script = fhandle.read()
+        self.assertIn("#SBATCH --array=0-2", script)
+        self.assertIn("%A_%a", script)
+        with open(op.join(taskdir, "clowdr-array-index.txt")) as fhandle:
+            groups = [line.split() for line in fhandle]
+        self.assertEqual([len(group) for group in groups], [2, 2, 1])
+
+        # Each element of the array runs its own group
+        env["SLURM_ARRAY_TASK_ID"] = "1"
+        with mock.patch.dict(os.environ, env):
+            subprocess.check_call(["bash", op.join(self.tmpdir,
+                                                   "submitted.sh")])
+        with open(op.join(self.tmpdir, "clowdr.args")) as fhandle:
+            args = fhandle.read().split()
+        self.assertEqual(args[:3], ["task"] + groups[1])
+
+    def test_array_split(self):
+        # Groups beyond the cluster's maximum array size go to other arrays
+        self.fake("scontrol", 'echo "MaxArraySize            = 2"\n')
+        self.fake("sbatch", 'echo "$@" >> {0}/sbatch.calls\n'
+                            'cat "${{@: -1}}" >> {0}/submitted.sh\n'
+                            'echo "Submitted batch job 42"\n')
+        cwd = os.getcwd()
+        env = {"PATH": self.bindir + os.pathsep + os.environ["PATH"]}
+        with mock.patch.dict(os.environ, env), \
+                redirect_stdout(io.StringIO()):
+            driver.local(open(self.descriptor), self.invocation,
+                         op.join(self.tmpdir, "prov"), sweep=["x"],
+                         cluster="slurm", array=True,
+                         clusterargs="time:1:00")
+        os.chdir(cwd)
+
+        with open(op.join(self.tmpdir, "sbatch.calls")) as fhandle:
+            self.assertEqual(len(fhandle.readlines()), 3)
+        with open(op.join(self.tmpdir, "submitted.sh")) as fhandle:
+            script = fhandle.read()
+        self.assertEqual(script.count("#SBATCH --array=0-1"), 2)
+        self.assertEqual(script.count("#SBATCH --array=0-0"), 1)
+        for line in [1, 3, 5]:
+            self.assertIn("SLURM_ARRAY_TASK_ID + {}))p".format(line), script)
+
+    def test_no_tasks(self):
+        with open(self.invocation, "w") as fhandle:
+            json.dump({"x": []}, fhandle)
+        cwd = os.getcwd()
+        with self.assertRaises(SystemExit) as error:
+            driver.local(open(self.descriptor), self.invocation,
+                         op.join(self.tmpdir, "prov"), sweep=["x"])
+        os.chdir(cwd)
+        self.assertIn("No tasks were generated", str(error.exception))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+from contextlib import redirect_stdout
+import os.path as op
+import tempfile
+import shutil
+import json
+import io
+import os
+
+from clowdr import __file__ as cfile
+from clowdr.controller import bids, metadata
+from clowdr import driver
+
+
+class TestBids(TestCase):
+
+    cdir = op.abspath(op.join(op.dirname(cfile), op.pardir))
+    descriptor = op.join(cdir, "examples/bids-example/descriptor_d.json")
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bidsdir = op.join(self.tmpdir, "ds")
+        self.cachedir = op.join(self.tmpdir, "cache")
+        for path in ["sub-01/ses-a/anat", "sub-01/ses-b", "sub-02/anat",
+                     "derivatives"]:
+            os.makedirs(op.join(self.bidsdir, path))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def scan(self):
+        with mock.patch.object(bids, "_localSessions",
+                               wraps=bids._localSessions) as listing:
+            layout = bids.scanLayout(self.bidsdir, cachedir=self.cachedir)
+        return layout, listing.call_count
+
+    def test_scan_local(self):
+        layout, listed = self.scan()
+        self.assertEqual(layout, {"01": ["a", "b"], "02": []})
+        self.assertEqual(listed, 2)
+
+        # Unchanged participants aren't listed again
+        self.assertEqual(self.scan(), (layout, 0))
+        os.makedirs(op.join(self.bidsdir, "sub-02", "ses-a"))
+        os.makedirs(op.join(self.bidsdir, "sub-03"))
+        layout, listed = self.scan()
+        self.assertEqual(layout, {"01": ["a", "b"], "02": ["a"], "03": []})
+        self.assertEqual(listed, 2)
+
+        self.assertIsNone(bids.scanLayout(op.join(self.tmpdir, "missing"),
+                                          cachedir=self.cachedir))
+
+    def test_scan_s3(self):
+        keys = {"ds/": (["sub-01/", "sub-02/"], ["ds/participants.tsv"]),
+                "ds/sub-01/": (["ses-a/", "anat/"], []),
+                "ds/sub-02/": ([], [])}
+
+        def paginate(Bucket, Prefix, Delimiter):
+            prefixes, objects = keys[Prefix]
+            return [{"CommonPrefixes": [{"Prefix": Prefix + p}
+                                        for p in prefixes],
+                     "Contents": [{"Key": k, "ETag": etag[0]}
+                                  for k in objects]}]
+
+        etag = ["1"]
+        client = mock.Mock()
+        client.get_paginator.return_value.paginate.side_effect = paginate
+
+        def scan():
+            return bids.scanLayout("s3://bucket/ds", cachedir=self.cachedir)
+
+        with mock.patch("boto3.client", return_value=client):
+            self.assertEqual(scan(), {"01": ["a"], "02": []})
+            self.assertEqual(scan(), {"01": ["a"], "02": []})
+            self.assertEqual(client.get_paginator.call_count, 4)
+
+            # Changed top-level files invalidate the index
+            etag[0] = "2"
+            keys["ds/sub-02/"] = (["ses-a/"], [])
+            self.assertEqual(scan(), {"01": ["a"], "02": ["a"]})
+
+    def test_bids_tasks(self):
+        invocation = op.join(self.tmpdir, "invocation.json")
+        with open(invocation, "w") as fhandle:
+            json.dump({"bids_dir": self.bidsdir, "analysis_level":
+                       "participant", "output_dir_name": "out"}, fhandle)
+        provdir = op.join(self.tmpdir, "prov")
+        [tasks, invocs] = metadata.consolidateTask(self.descriptor,
+                                                   invocation, provdir,
+                                                   self.bidsdir, bids=True,
+                                                   bids_cache=self.cachedir)
+        self.assertEqual([op.basename(invo) for invo in invocs],
+                         ["invocation_sub-01_ses-a.json",
+                          "invocation_sub-01_ses-b.json",
+                          "invocation_sub-02.json"])
+        with open(tasks[2]) as fhandle:
+            self.assertEqual(json.load(fhandle)["dataloc"],
+                             [op.join(op.realpath(self.bidsdir), "sub-02")])
+        with open(invocs[1]) as fhandle:
+            invo = json.load(fhandle)
+        self.assertEqual((invo["participant_label"], invo["session_label"]),
+                         (["01"], ["b"]))
+
+        # Given sessions only fan out to the participants which have them
+        with open(invocation, "w") as fhandle:
+            json.dump({"bids_dir": self.bidsdir, "analysis_level":
+                       "participant", "session_label": ["b"]}, fhandle)
+        [tasks, invocs] = metadata.consolidateTask(self.descriptor,
+                                                   invocation, provdir,
+                                                   self.bidsdir, bids=True,
+                                                   bids_cache=self.cachedir)
+        self.assertEqual([op.basename(invo) for invo in invocs],
+                         ["invocation_sub-01_ses-b.json"])
+
+    def test_local(self):
+        # Local runs have no dataloc to scan, so the dataset is found from
+        # the invocation's "bids_dir"
+        invocation = op.join(self.tmpdir, "invocation.json")
+        with open(invocation, "w") as fhandle:
+            json.dump({"bids_dir": self.bidsdir, "analysis_level":
+                       "participant", "output_dir_name": "out"}, fhandle)
+        cwd = os.getcwd()
+        with redirect_stdout(io.StringIO()):
+            taskdir = driver.local(open(self.descriptor), invocation,
+                                   op.join(self.tmpdir, "prov"), bids=True,
+                                   bids_cache=self.cachedir, setup=True)
+        os.chdir(cwd)
+        invocs = []
+        for idx in range(3):
+            with open(op.join(taskdir, "task-{}.json".format(idx))) as fhdl:
+                invocs += [op.basename(json.load(fhdl)["invocation"])]
+        self.assertEqual(invocs, ["invocation_sub-01_ses-a.json",
+                                  "invocation_sub-01_ses-b.json",
+                                  "invocation_sub-02.json"])
+        self.assertFalse(op.exists(op.join(taskdir, "task-3.json")))
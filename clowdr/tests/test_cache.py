@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+import multiprocessing as mp
+import os.path as op
+import tempfile
+import shutil
+import time
+import os
+
+from clowdr.cache import ImageCache, imageKey
+
+
+def slowPull(savedir, container, **kwargs):
+    # Stand-in for a pull: copies the local image, slowly, and logs the pull
+    with open(op.join(op.dirname(op.dirname(savedir)), "pulls"), "a") as fh:
+        fh.write(container["image"] + "\n")
+    time.sleep(0.3)
+    name = container["image"].replace("/", "-").replace(":", "-") + ".simg"
+    shutil.copy(kwargs["simg"], op.join(savedir, name))
+
+
+def useImage(root, container, simg):
+    with ImageCache(root).use(container, simg=simg) as entry:
+        time.sleep(0.1)
+
+
+class TestCache(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = op.join(self.tmpdir, "cache")
+        self.simg = op.join(self.tmpdir, "image.simg")
+        with open(self.simg, "wb") as fhandle:
+            fhandle.write(b"x" * 4096)
+        self.container = {"type": "singularity", "image": "bids/example:1"}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def pulls(self):
+        with open(op.join(self.root, "pulls")) as fhandle:
+            return fhandle.read().split()
+
+    def test_concurrent_single_pull(self):
+        with mock.patch("clowdr.cache.utils.getContainer", slowPull):
+            procs = [mp.Process(target=useImage,
+                                args=(self.root, self.container, self.simg))
+                     for _ in range(4)]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+            self.assertEqual([proc.exitcode for proc in procs], [0] * 4)
+            self.assertEqual(self.pulls(), ["bids/example:1"])
+
+            # Same content under another name is stored only once
+            other = {"type": "singularity", "image": "bids/example:latest"}
+            with ImageCache(self.root).use(other, simg=self.simg) as entry:
+                self.assertEqual(len(os.listdir(op.join(self.root,
+                                                        "blobs"))), 1)
+                self.assertTrue(op.isfile(entry["path"]))
+
+    def test_lru_eviction(self):
+        images = []
+        for idx in range(3):
+            images += [op.join(self.tmpdir, "image-{}.simg".format(idx))]
+            with open(images[-1], "wb") as fhandle:
+                fhandle.write(str(idx).encode() * 4096)
+        containers = [{"type": "singularity", "image": "tool:{}".format(idx)}
+                      for idx in range(3)]
+
+        # Room for two images: the least recently used one is evicted,
+        # unless a task is using it
+        cache = ImageCache(self.root, max_size=9000 / 1024**3)
+        with mock.patch("clowdr.cache.utils.getContainer", slowPull):
+            with cache.use(containers[0], simg=images[0]):
+                with cache.use(containers[1], simg=images[1]):
+                    pass
+                with cache.use(containers[2], simg=images[2]):
+                    pass
+            index = cache.index()
+            self.assertEqual(sorted(index),
+                             sorted(imageKey(c) for c in containers[::2]))
+            with cache.use(containers[1], simg=images[1]):
+                pass
+            self.assertEqual(sorted(cache.index()),
+                             sorted(imageKey(c) for c in containers[1:]))
+        self.assertEqual(len(os.listdir(op.join(self.root, "blobs"))), 2)
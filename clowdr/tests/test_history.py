@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+import os.path as op
+import tempfile
+import shutil
+import json
+import os
+
+from clowdr.controller import history
+from clowdr.monitor import UsageBuffer
+
+
+class TestHistory(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rundir = op.join(self.tmpdir, "2018-01-01_00-00-00-ABCD",
+                              "clowdr")
+        os.makedirs(self.rundir)
+        self.descriptor = op.join(self.tmpdir, "descriptor.json")
+        with open(self.descriptor, "w") as fhandle:
+            json.dump({"name": "tool",
+                       "suggested-resources": {"ram": 2, "cpu-cores": 4}},
+                      fhandle)
+        shutil.copy(self.descriptor, self.rundir)
+
+        for task_id in range(2):
+            self.task(self.rundir, task_id)
+        # Task 0 completed, with usage recorded; task 1 never did
+        with open(op.join(self.rundir, "task-0-summary.json"), "w") as fhdl:
+            json.dump({"duration": 12.5, "exitcode": 0}, fhdl)
+        usage = UsageBuffer()
+        for tim, cpu, ram in [(0, 50, 100), (1, 200, 400), (2, 150, 300)]:
+            usage.append(tim, cpu, ram)
+        usage.toCSV(op.join(self.rundir, "task-0-usage.csv"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def task(self, rundir, task_id):
+        taskf = op.join(rundir, "task-{}.json".format(task_id))
+        with open(taskf, "w") as fhandle:
+            json.dump({"invocation": "/x/invo-{}.json".format(task_id),
+                       "tool": self.descriptor}, fhandle)
+        return taskf
+
+    def test_load_history(self):
+        past = history.loadHistory([self.tmpdir])
+        self.assertEqual(list(past), ["invo-0.json"])
+        self.assertEqual(past["invo-0.json"]["ram"], 400)
+        self.assertEqual(past["invo-0.json"]["duration"], 12.5)
+        self.assertGreater(past["invo-0.json"]["cpus"], 1.5)
+
+    def test_task_demand(self):
+        past = history.loadHistory([self.rundir])
+        newdir = op.join(self.tmpdir, "new")
+        os.mkdir(newdir)
+        seen, unseen = self.task(newdir, 0), self.task(newdir, 1)
+
+        demand = history.taskDemand(seen, history=past)
+        self.assertAlmostEqual(demand["ram"], 400 * history.HEADROOM)
+        demand = history.taskDemand(seen, history=past, ram=50, cpus=1)
+        self.assertEqual(demand, {"ram": 50, "cpus": 1})
+        demand = history.taskDemand(unseen, history=past,
+                                    descriptor=self.descriptor)
+        self.assertEqual(demand, {"ram": 2048, "cpus": 4})
+        self.assertEqual(history.taskDemand(unseen), {"ram": 0, "cpus": 0})
+
+        demand = history.groupDemand([seen, unseen], history=past,
+                                     descriptor=self.descriptor)
+        self.assertEqual(demand, {"ram": 2048, "cpus": 4})
+
+    def test_balance_groups(self):
+        tasks = ["task-{}.json".format(idx) for idx in range(6)]
+        costs = [8, 7, 6, 5, 4, 3]
+        groups = history.balanceGroups(tasks, 2, costs)
+        loads = [sum(costs[tasks.index(t)] for t in grp) for grp in groups]
+        self.assertEqual(sorted(t for grp in groups for t in grp), tasks)
+        self.assertEqual(len(groups), 3)
+        # In order, the groups would take 15, 11 and 7
+        self.assertEqual(max(loads), 11)
+
+    def test_task_costs(self):
+        past = history.loadHistory([self.tmpdir], descriptor=self.descriptor)
+        other = op.join(self.tmpdir, "other.json")
+        with open(other, "w") as fhandle:
+            json.dump({"name": "other"}, fhandle)
+        self.assertEqual(history.loadHistory([self.tmpdir], descriptor=other),
+                         {})
+        newdir = op.join(self.tmpdir, "new")
+        os.mkdir(newdir)
+        tasks = [self.task(newdir, idx) for idx in range(3)]
+        costf = op.join(self.tmpdir, "costs.tsv")
+        with open(costf, "w") as fhandle:
+            fhandle.write("invocation\tvolumes\ninvo-2\t40\n")
+
+        costs = history.loadCosts(costf, "volumes")
+        self.assertEqual(history.taskCosts(tasks, history=past, costs=costs),
+                         [12.5, 26.25, 40])
+        self.assertEqual(history.taskCosts(tasks), [1, 1, 1])
+
+        # Known keys are used as they are, without reading any task file
+        keys = ["invo-0.json", "invo-2.json"]
+        self.assertEqual(history.taskCosts(["task-0.json", "task-2.json"],
+                                           history=past, costs=costs,
+                                           keys=keys), [12.5, 40])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from subprocess import PIPE
+import os.path as op
+import subprocess
+import tempfile
+import shutil
+import sys
+import os
+
+from clowdr.logs import LogTee, LogUploader
+
+
+class TestLogs(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_tee_large_output(self):
+        cmd = [sys.executable, "-c",
+               "import sys\nfor i in range(200000): print(i)\n"
+               "sys.stderr.write('done')"]
+        proc = subprocess.Popen(cmd, stdout=PIPE, stderr=PIPE)
+        tees = [LogTee(proc.stdout, op.join(self.tmpdir, "out.txt"),
+                       chunk_size=4096),
+                LogTee(proc.stderr, op.join(self.tmpdir, "err.txt"))]
+        for tee in tees:
+            tee.start()
+        self.assertEqual(proc.wait(), 0)
+        for tee in tees:
+            tee.join()
+
+        with open(op.join(self.tmpdir, "out.txt")) as fhandle:
+            lines = fhandle.read().splitlines()
+        self.assertEqual(lines, [str(i) for i in range(200000)])
+        self.assertEqual(tees[0].nbytes, op.getsize(tees[0].path))
+        with open(op.join(self.tmpdir, "err.txt")) as fhandle:
+            self.assertEqual(fhandle.read(), "done")
+
+    def test_rolling_segments(self):
+        log = op.join(self.tmpdir, "task-3-stdout.txt")
+        remote = op.join(self.tmpdir, "remote")
+        uploader = LogUploader([log], remote, prefix="task-3-logs")
+
+        uploader.upload()  # Nothing written yet: nothing to upload
+        for text in ["first\n", "second\n", "", "third\n"]:
+            with open(log, "a") as fhandle:
+                fhandle.write(text)
+            uploader.upload()
+
+        segdir = op.join(remote, "task-3-logs")
+        segments = sorted(os.listdir(segdir))
+        self.assertEqual(segments, ["task-3-stdout.txt.{}".format(i)
+                                    for i in range(3)])
+        content = ""
+        for segment in segments:
+            with open(op.join(segdir, segment)) as fhandle:
+                content += fhandle.read()
+        self.assertEqual(content, "first\nsecond\nthird\n")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+import os.path as op
+import tempfile
+import shutil
+import json
+import os
+
+from clowdr import __file__ as cfile
+from clowdr.controller import metadata, rerunner
+from clowdr import manifest
+
+
+class TestManifest(TestCase):
+
+    cdir = op.abspath(op.join(op.dirname(cfile), op.pardir))
+    descriptor = op.join(cdir, "examples/bids-example/descriptor_d.json")
+    invocation = op.join(cdir, "examples/bids-example/invocation_sweep.json")
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def task(self, idx):
+        return manifest.Task(tool="/prov/run/clowdr/tool.json",
+                             invocation="invocation-{}.json".format(idx),
+                             taskloc="/prov/run/tool", dataloc=["/data"])
+
+    def test_writer(self):
+        with manifest.ManifestWriter(self.tmpdir) as writer:
+            for idx in range(20):
+                taskf = writer.append(self.task(idx), {"param": "x" * idx})
+        self.assertEqual(taskf, op.join(self.tmpdir, "task-19.json"))
+        self.assertEqual(manifest.taskCount(self.tmpdir), 20)
+        self.assertEqual(manifest.listTasks(self.tmpdir)[0],
+                         op.join(self.tmpdir, "task-0.json"))
+
+        task = manifest.loadTask(op.join(self.tmpdir, "task-7.json"))
+        self.assertEqual(task.invocation, "invocation-7.json")
+        self.assertEqual(task.loadInvocation(), {"param": "x" * 7})
+        with self.assertRaises(KeyError):
+            manifest.readRecord(self.tmpdir, 20)
+
+        # Appending to an existing manifest carries on from the last task
+        with manifest.ManifestWriter(self.tmpdir) as writer:
+            self.assertEqual(writer.append({"idx": 20}),
+                             op.join(self.tmpdir, "task-20.json"))
+
+        manifest.rewrite(self.tmpdir, lambda tid, task: dict(task, tid=tid))
+        task = manifest.readRecord(self.tmpdir, 20)
+        self.assertEqual((task["idx"], task["tid"]), (20, 20))
+        task = manifest.readRecord(self.tmpdir, 3)
+        self.assertEqual(task["invocation_data"], {"param": "xxx"})
+
+    def test_task(self):
+        task = self.task(1).replace(memo="abc")
+        self.assertEqual(manifest.Task.fromJSON(task.toJSON()).toDict(),
+                         task.toDict())
+        self.assertEqual(task.toDict()["dataloc"], ["/data"])
+        self.assertNotIn("invocation_data", task.toDict())
+        with self.assertRaises(AttributeError):
+            task.other = None
+
+        # Paths shared by tasks are stored once, however they were created
+        other = manifest.Task.fromJSON(self.task(2).toJSON())
+        self.assertIs(other.tool, task.tool)
+        self.assertIs(other.dataloc[0], task.dataloc[0])
+
+    def test_consolidate(self):
+        sweep = ["participant_label", "analysis_level"]
+        [tasks, invocs] = metadata.consolidateTask(self.descriptor,
+                                                   self.invocation,
+                                                   self.tmpdir, "localhost",
+                                                   sweep=sweep, manifest=True)
+        rundir = op.dirname(tasks[0])
+        with open(self.invocation) as fhandle:
+            dat = json.load(fhandle)
+        total = len(dat["participant_label"]) * len(dat["analysis_level"])
+
+        # Neither task nor sweep invocation files are written
+        self.assertEqual(len(tasks), total)
+        self.assertFalse(any(op.exists(f) for f in tasks + invocs))
+        self.assertEqual(sorted(os.listdir(rundir)),
+                         sorted([manifest.INDEX, manifest.MANIFEST,
+                                 op.basename(self.descriptor),
+                                 op.basename(self.invocation)]))
+
+        task = manifest.loadTask(tasks[-1])
+        self.assertEqual(task.invocation, invocs[-1])
+        invo = task.loadInvocation()
+        self.assertEqual(invo["analysis_level"], dat["analysis_level"][-1])
+
+        runid = op.basename(op.dirname(rundir))
+        self.assertEqual(rerunner.getTasks(self.tmpdir, runid, "all"),
+                         sorted(tasks))
+
+        metadata.prepareForRemote(tasks, self.tmpdir, "s3://bucket/prov")
+        self.assertEqual(manifest.loadTask(tasks[0]).tool,
+                         op.join("s3://bucket/prov", runid, "clowdr",
+                                 op.basename(self.descriptor)))
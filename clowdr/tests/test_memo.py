@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from unittest import TestCase
+from datetime import datetime, timedelta
+import os.path as op
+import tempfile
+import shutil
+import json
+import os
+
+from clowdr.controller import memo
+
+
+class TestMemo(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.descriptor = op.join(self.tmpdir, "descriptor.json")
+        with open(self.descriptor, "w") as fhandle:
+            json.dump({"name": "tool",
+                       "inputs": [{"id": "infile", "type": "File"},
+                                  {"id": "level", "type": "Number"}]},
+                      fhandle)
+        self.datadir = op.join(self.tmpdir, "data")
+        os.mkdir(self.datadir)
+        for subject in ["01", "02"]:
+            with open(op.join(self.datadir, subject + ".txt"), "w") as fhdl:
+                fhdl.write(subject)
+
+        # A past run, where task 0 succeeded and task 1 failed
+        self.pastdir = self.makeRun("2018-01-01_00-00-00-ABCD")
+        for task_id, code in enumerate([0, 1]):
+            taskf = op.join(self.pastdir, "task-{}.json".format(task_id))
+            with open(op.join(self.pastdir, "task-{}-summary.json"
+                                            "".format(task_id)), "w") as fhdl:
+                json.dump({"exitcode": code,
+                           "memo": memo.taskHash(taskf, self.datadir)}, fhdl)
+            with open(op.join(self.pastdir, "task-{}-stdout.txt"
+                                            "".format(task_id)), "w") as fhdl:
+                fhdl.write("done")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def makeRun(self, run_id, level=1):
+        rundir = op.join(self.tmpdir, "prov", run_id, "clowdr")
+        os.makedirs(rundir)
+        for task_id, subject in enumerate(["01", "02"]):
+            invof = op.join(rundir, "invocation-{}.json".format(task_id))
+            with open(invof, "w") as fhandle:
+                json.dump({"infile": subject + ".txt", "level": level},
+                          fhandle)
+            with open(op.join(rundir, "task-{}.json".format(task_id)),
+                      "w") as fhandle:
+                json.dump({"invocation": invof, "tool": self.descriptor,
+                           "dataloc": ["localhost"]}, fhandle)
+        return rundir
+
+    def tasks(self, rundir):
+        return [op.join(rundir, "task-{}.json".format(task_id))
+                for task_id in range(2)]
+
+    def test_task_hash(self):
+        first, second = self.tasks(self.pastdir)
+        digest = memo.taskHash(first, self.datadir)
+        self.assertEqual(digest, memo.taskHash(first, self.datadir))
+        self.assertNotEqual(digest, memo.taskHash(second, self.datadir))
+
+        # Changed parameters and changed inputs change the hash
+        newdir = self.makeRun("2018-01-02_00-00-00-ABCD", level=2)
+        self.assertNotEqual(digest,
+                            memo.taskHash(self.tasks(newdir)[0], self.datadir))
+        with open(op.join(self.datadir, "01.txt"), "a") as fhandle:
+            fhandle.write("more")
+        self.assertNotEqual(digest, memo.taskHash(first, self.datadir))
+
+    def test_memoize(self):
+        index = memo.memoIndex([op.join(self.tmpdir, "prov")])
+        self.assertEqual(list(index.values()),
+                         [op.join(self.pastdir, "task-0-summary.json")])
+
+        newdir = self.makeRun("2018-01-02_00-00-00-ABCD")
+        remaining = memo.memoize(self.tasks(newdir),
+                                 [op.join(self.tmpdir, "prov")],
+                                 basedir=self.datadir)
+        # Only the failed task is left to run, and it is stamped for later
+        self.assertEqual(remaining, [self.tasks(newdir)[1]])
+        with open(remaining[0]) as fhandle:
+            self.assertIn("memo", json.load(fhandle))
+
+        with open(op.join(newdir, "task-0-summary.json")) as fhandle:
+            summary = json.load(fhandle)
+        self.assertEqual(summary["memoized"],
+                         op.join(self.pastdir, "task-0-summary.json"))
+        self.assertEqual(os.readlink(op.join(newdir, "task-0-stdout.txt")),
+                         op.join(self.pastdir, "task-0-stdout.txt"))
+
+    def test_memoize_unstamped(self):
+        # Runs launched without memoization are hashed from their tasks, as
+        # long as their inputs are older than them
+        pastdir = self.makeRun("2018-01-03_00-00-00-ABCD", level=3)
+        launch = datetime.now() + timedelta(seconds=5)
+        with open(op.join(pastdir, "task-0-summary.json"), "w") as fhandle:
+            json.dump({"exitcode": 0,
+                       "launchtime": str(launch.replace(microsecond=0))},
+                      fhandle)
+        newdir = self.makeRun("2018-01-04_00-00-00-ABCD", level=3)
+        remaining = memo.memoize(self.tasks(newdir), [pastdir],
+                                 basedir=self.datadir)
+        self.assertEqual(remaining, [self.tasks(newdir)[1]])
+
+        # Inputs changed since the past run can't be trusted
+        with open(op.join(pastdir, "task-0-summary.json"), "w") as fhandle:
+            json.dump({"exitcode": 0, "launchtime": "2018-01-03 00:00:00"},
+                      fhandle)
+        self.assertEqual(memo.memoIndex([pastdir], basedir=self.datadir), {})
@@ -89,6 +89,48 @@ class TestMetadataGen(TestCase):
             total = len(dat["participant_label"]) * len(dat["analysis_level"])
         self.assertTrue(len(tasks) == len(invocs) == total)
 
+    def test_metadata_lazy(self):
+        tasks = metadata.generateTasks(self.descriptor, self.invocation5,
+                                       self.provdir, self.dataloc1,
+                                       sweep=["participant_label",
+                                              "analysis_level"])
+        taskf, invof = next(tasks)
+        # Only the first task exists so far, and only its final invocation
+        taskdir = op.dirname(taskf)
+        self.assertEqual(sorted(f for f in os.listdir(taskdir)
+                                if f.startswith("task-")), ["task-0.json"])
+        with open(taskf) as fhandle:
+            self.assertEqual(json.load(fhandle)["invocation"], invof)
+        self.assertEqual(len([f for f in os.listdir(taskdir)
+                              if "_sweep-" in f]), 1)
+
+        with open(self.invocation5) as fhandle:
+            dat = json.load(fhandle)
+            total = len(dat["participant_label"]) * len(dat["analysis_level"])
+        self.assertEqual(len(list(tasks)), total - 1)
+
+    def test_metadata_sweep_index(self):
+        invo = {"a": [1, 2, 3], "b": ["x", "y"], "c": [4, 5, 6], "d": 0}
+        sweep = metadata.ParameterSweep(invo, ["a,c", "b"])
+        self.assertEqual(len(sweep), 6)
+        # The first dimension varies slowest, and zipped parameters together
+        self.assertEqual(sweep[3], [("a", 2), ("c", 5), ("b", "y")])
+        self.assertEqual([dict(comb)["b"] for comb in sweep],
+                         ["x", "y"] * 3)
+        with self.assertRaises(IndexError):
+            sweep[6]
+        with self.assertRaises(SystemExit):
+            metadata.ParameterSweep(dict(invo, c=[4, 5]), ["a,c"])
+        with self.assertRaises(SystemExit):
+            metadata.ParameterSweep(invo, ["d"])
+
+        # A huge sweep only builds the combinations which are asked for
+        invo = dict(("p{}".format(idx), list(range(10))) for idx in range(12))
+        sweep = metadata.ParameterSweep(invo, sorted(invo))
+        self.assertEqual(len(sweep), 10 ** 12)
+        self.assertEqual([val for _, val in sweep[123456789012]],
+                         [1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 1, 2])
+
     def test_metadata_to_remote(self):
         [tasks, invocs] = metadata.consolidateTask(self.descriptor,
                                                    self.invocation1,
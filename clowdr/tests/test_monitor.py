@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+from http.server import BaseHTTPRequestHandler
+from contextlib import redirect_stdout
+import socketserver
+import subprocess
+import threading
+import tempfile
+import shutil
+import json
+import time
+import io
+import sys
+import os
+
+from clowdr.monitor import (Sampler, ProcTree, UsageBuffer, DownsampledBuffer,
+                            DockerStats, parseDockerStats, readUsage,
+                            exportUsage, _dockerName)
+import numpy as np
+import psutil
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stats = {"cpu_stats": {"cpu_usage": {"total_usage": 300},
+                           "system_cpu_usage": 2000,
+                           "online_cpus": 4},
+             "precpu_stats": {"cpu_usage": {"total_usage": 100},
+                              "system_cpu_usage": 1000},
+             "memory_stats": {"usage": 300 * 1024 * 1024,
+                              "stats": {"inactive_file": 100 * 1024 * 1024}}}
+
+    def _chunk(self, data):
+        self.wfile.write("{:x}\r\n".format(len(data)).encode())
+        self.wfile.write(data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.server.requests += [self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if self.path.startswith("/containers/json"):
+            body = json.dumps([{"Id": "other", "Command": "/bin/sh",
+                                "Names": ["/other"]},
+                               {"Id": "prefix",
+                                "Command": "/bin/sh /launch.sh.2",
+                                "Names": ["/task-2"]},
+                               {"Id": "abc123",
+                                "Command": "/bin/sh /launch.sh",
+                                "Names": ["/task-1"]}]).encode()
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.endswith("/json"):
+            cid = self.path.split("/")[2]
+            cmd = {"prefix": ["/launch.sh.2"], "abc123": ["/launch.sh"]}
+            body = json.dumps({"Id": cid,
+                               "Config": {"Cmd": cmd.get(cid)}}).encode()
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/containers/abc123/stats":
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for _ in range(3):
+                self._chunk(json.dumps(self.stats).encode() + b"\n")
+                time.sleep(0.05)
+            # Hold the stream open like the real daemon, until the client
+            # leaves
+            self.server.streaming.wait(5)
+            self._chunk(b"")
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeDocker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TestMonitor(TestCase):
+
+    spin = "import time\nt = time.time()\nwhile time.time() - t < {}: pass"
+
+    def test_proctree_sample(self):
+        cpu, ram, procs = ProcTree(os.getpid()).sample()
+        self.assertTrue(cpu > 0)
+        self.assertTrue(ram > 0)
+        self.assertTrue(os.getpid() in [p[0] for p in procs])
+
+    def test_proctree_walk(self):
+        # Walking the tree down from its root finds what scanning /proc does
+        proc = subprocess.Popen("sleep 5 & sleep 5 & wait", shell=True)
+        time.sleep(0.5)
+        tree = ProcTree(proc.pid)
+        tree.walk = True
+        children = mock.patch.object(
+            ProcTree, "_children",
+            lambda self, pid: [c.pid for c in psutil.Process(pid).children()])
+        with children:
+            walked = sorted(pid for pid, _ in tree._descendants())
+        scanned = sorted(pid for pid, _ in tree._scan())
+        for child in psutil.Process(proc.pid).children(recursive=True):
+            child.kill()
+        proc.kill()
+        proc.wait()
+        self.assertEqual(len(scanned), 3)
+        self.assertEqual(walked, scanned)
+
+    def test_sampler_shared_cgroup(self):
+        # The monitor's own cgroup would count its usage as the task's
+        with mock.patch("clowdr.monitor.CGroup.isolated",
+                        return_value=False), \
+                redirect_stdout(io.StringIO()) as out:
+            sampler = Sampler(os.getpid(), source="cgroup")
+        self.assertEqual(sampler.source, "proc")
+        self.assertIsInstance(sampler.reader, ProcTree)
+        self.assertIn("no cgroup of its own", out.getvalue())
+
+    def test_sampler_rate(self):
+        # Parent shell with a busy child, so the tree has more than one process
+        cmd = "{} -c '{}'; sleep 0.1".format(sys.executable,
+                                             self.spin.format(1.5))
+        start = time.time()
+        proc = subprocess.Popen(cmd, shell=True)
+        sampler = Sampler(proc.pid, interval=0.1, source="proc")
+        sampler.start()
+        proc.wait()
+        sampler.stop()
+        sampler.join()
+        elapsed = time.time() - start
+
+        summary = sampler.summary()
+        self.assertEqual(summary["source"], "proc")
+        self.assertTrue(summary["samples"] >= 10)
+        self.assertTrue(max(sampler.usage.cpu) > 50)
+        self.assertTrue(max(sampler.usage.ram) > 0)
+        # Sampling takes a small fraction of the time it runs for
+        self.assertLess(summary["cpu_time"], 0.05 * elapsed)
+
+    def test_usage_buffer(self):
+        usage = UsageBuffer()
+        for idx in range(1000):
+            usage.append(100.0 + idx, idx % 7, 2.0 * idx)
+        table = usage.toArray()
+        self.assertEqual(table.shape, (1000, 3))
+        self.assertEqual(table[0, 0], 0)
+        self.assertEqual(table[-1, 0], 999)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            csvfile = os.path.join(tmpdir, "usage.csv")
+            usage.toCSV(csvfile)
+            with open(csvfile) as fhandle:
+                lines = fhandle.read().splitlines()
+            self.assertEqual(lines[0], "time,cpu,ram")
+            self.assertEqual([float(v) for v in lines[-1].split(",")],
+                             [999, 999 % 7, 1998])
+
+            UsageBuffer().toCSV(csvfile)
+            with open(csvfile) as fhandle:
+                self.assertEqual(fhandle.read().strip(), "time,cpu,ram")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_binary_usage(self):
+        usage = UsageBuffer()
+        for idx in range(5000):
+            usage.append(1.5e9 + idx * 0.25, idx % 13, 512.0 + idx)
+        table = usage.toArray()
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            binfile = os.path.join(tmpdir, "usage.bin")
+            csvfile = os.path.join(tmpdir, "usage.csv")
+            for dtype in ["float32", "float64"]:
+                for delta in [True, False]:
+                    usage.toBinary(binfile, dtype=dtype, delta=delta)
+                    self.assertEqual(os.path.getsize(binfile),
+                                     16 + 5000 * 3 * (4 if dtype[-2:] == "32"
+                                                      else 8))
+                    data = readUsage(binfile)
+                    for idx, col in enumerate(UsageBuffer.columns):
+                        self.assertTrue(np.allclose(data[col], table[:, idx]))
+
+            exportUsage(binfile, csvfile)
+            data = readUsage(csvfile)
+            self.assertTrue(np.allclose(data["ram"], table[:, 2]))
+
+            UsageBuffer().toBinary(binfile)
+            self.assertEqual(len(readUsage(binfile)["time"]), 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_downsampled_buffer(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            spill = os.path.join(tmpdir, "usage-full.csv")
+            usage = DownsampledBuffer(max_points=200, spill=spill)
+            for idx in range(100000):
+                cpu = 400.0 if idx == 31337 else idx % 100
+                ram = 9000.0 if idx == 77777 else 100 + idx % 10
+                usage.append(5.0 + idx, cpu, ram)
+            usage.close()
+
+            table = usage.toArray()
+            self.assertTrue(len(table) <= 204)
+            self.assertTrue(len(usage.time) <= 200)
+            self.assertEqual(list(table[0]), [0, 0, 100])
+            self.assertEqual(table[-1, 0], 99999)
+            self.assertTrue(all(table[1:, 0] > table[:-1, 0]))
+            self.assertEqual(table[:, 1].max(), 400)
+            self.assertEqual(table[table[:, 1].argmax(), 0], 31337)
+            self.assertEqual(table[:, 2].max(), 9000)
+            self.assertEqual(table[table[:, 2].argmax(), 0], 77777)
+
+            with open(spill) as fhandle:
+                lines = fhandle.read().splitlines()
+            self.assertEqual(len(lines), 100001)
+            self.assertEqual(lines[31338], "31337,400,107")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parse_docker_stats(self):
+        cpu, ram = parseDockerStats(FakeDockerHandler.stats)
+        self.assertAlmostEqual(cpu, 80.0)
+        self.assertAlmostEqual(ram, 200.0)
+        self.assertEqual(parseDockerStats({}), (0.0, 0.0))
+        self.assertEqual(_dockerName(["docker", "run", "--name", "t1", "x"]),
+                         "t1")
+        self.assertEqual(_dockerName(["docker", "run", "--name=t2"]), "t2")
+        self.assertIsNone(_dockerName(["docker", "run", "x", "/launch.sh"]))
+
+    def test_docker_stats_stream(self):
+        tmpdir = tempfile.mkdtemp()
+        sockpath = os.path.join(tmpdir, "docker.sock")
+        server = FakeDocker(sockpath, FakeDockerHandler)
+        server.requests = []
+        server.streaming = threading.Event()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            stream = DockerStats("/launch.sh", sockpath)
+            stream.usage()
+            for _ in range(50):
+                if stream.ram:
+                    break
+                time.sleep(0.05)
+            for _ in range(5):
+                cpu, ram = stream.usage()
+            self.assertEqual(stream.container, "abc123")
+            self.assertAlmostEqual(cpu, 80.0)
+            self.assertAlmostEqual(ram, 200.0)
+
+            # The container is looked up once, by the exact arguments of its
+            # command, and followed over a single stats stream
+            self.assertEqual(server.requests, ["/containers/json",
+                                               "/containers/prefix/json",
+                                               "/containers/abc123/json",
+                                               "/containers/abc123/stats"])
+            stream.close()
+            self.assertFalse(stream._thread.is_alive())
+
+            # Named containers are found by their name
+            named = DockerStats("/launch.sh", sockpath, name="task-2")
+            self.assertEqual(named.find(), "prefix")
+            # Containers which haven't appeared yet are looked up less often
+            missing = DockerStats("/missing.sh", sockpath)
+            server.requests = []
+            for _ in range(5):
+                missing.usage()
+            self.assertEqual(server.requests, ["/containers/json"])
+        finally:
+            server.streaming.set()
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(tmpdir)
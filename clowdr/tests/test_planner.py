@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+from contextlib import redirect_stdout
+import tempfile
+import shutil
+import json
+import time
+import io
+import os
+
+from clowdr.controller import planner
+from clowdr import manifest
+from clowdr import driver
+
+
+class TestPlanner(TestCase):
+
+    def test_simulate(self):
+        costs = [4, 1, 1, 1, 1]
+        plan = planner.simulate(costs, workers=2)
+        self.assertEqual(plan["makespan"], 4)
+        self.assertEqual(plan["busy"], 8)
+        self.assertEqual(plan["utilization"], 1)
+
+        # In-order groups of 2: (4+1), (1+1), (1), vs. balanced: (4), (1+1+1+1)
+        plan = planner.simulate(costs, workers=1, groupby=2, overhead=1)
+        self.assertEqual(plan["groups"], 3)
+        self.assertEqual(plan["makespan"], 11)
+        plan = planner.simulate(costs, workers=3, groupby=2)
+        self.assertEqual(plan["workers"], 3)
+        self.assertEqual(plan["makespan"], 5)
+        plan = planner.simulate(costs, workers=3, groupby=2, balance=True)
+        self.assertEqual(plan["makespan"], 4)
+
+    def test_simulate_large(self):
+        costs = [float(idx % 97) for idx in range(100000)]
+        start = time.time()
+        plan = planner.simulate(costs, workers=500, groupby=4)
+        self.assertLess(time.time() - start, 1)
+        self.assertGreater(plan["utilization"], 0.95)
+
+    def test_task_resources(self):
+        past = {"a.json": {"ram": 100, "cpus": 1.2},
+                "b.json": {"ram": 200, "cpus": None}}
+        resources = planner.taskResources(past)
+        self.assertAlmostEqual(resources["ram"], 200 * planner.HEADROOM)
+        self.assertEqual(resources["cpus"], 2)
+        self.assertEqual(planner.taskResources(past, cpus=4)["cpus"], 4)
+        self.assertEqual(planner.taskResources(), {"ram": 0, "cpus": 1})
+
+        table = planner.report([planner.simulate([3600] * 4, 2)], cpus=2,
+                               price=0.5)
+        self.assertIn("2:00:00", table)
+        self.assertIn("4.00", table)
+
+    def test_plan(self):
+        tmpdir = tempfile.mkdtemp()
+        descriptor = os.path.join(tmpdir, "descriptor.json")
+        with open(descriptor, "w") as fhandle:
+            json.dump({"name": "tool", "tool-version": "1",
+                       "description": "test", "schema-version": "0.5",
+                       "command-line": "echo [X]",
+                       "inputs": [{"id": "x", "name": "X", "type": "String",
+                                   "value-key": "[X]"}]}, fhandle)
+        invocation = os.path.join(tmpdir, "invocation.json")
+        with open(invocation, "w") as fhandle:
+            json.dump({"x": [str(idx) for idx in range(2000)]}, fhandle)
+
+        # Sweeps are planned without storing a file for any of their tasks
+        with mock.patch.object(manifest.Task, "save") as save, \
+                redirect_stdout(io.StringIO()) as out:
+            plans = driver.plan(open(descriptor), invocation, tmpdir,
+                                sweep=["x"], workers=[100])
+        save.assert_not_called()
+        self.assertIn("2000 task(s), 0 with past durations", out.getvalue())
+        self.assertEqual(plans[0]["makespan"], 20)
+        shutil.rmtree(tmpdir)
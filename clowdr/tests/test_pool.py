@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+from contextlib import redirect_stdout
+import subprocess
+import tempfile
+import shutil
+import json
+import time
+import io
+import os
+
+from clowdr.pool import TaskPool, Admission, parseJobs
+from clowdr.task import attemptDir, PROMOTE
+from clowdr import driver
+
+
+def sleeper(taskgroup, **kwargs):
+    time.sleep(float(taskgroup[0]))
+    return [task for task in taskgroup if task == "fail"]
+
+
+def straggler(taskgroup, attempt=0, **kwargs):
+    # Only the first attempt of a task is slow
+    time.sleep(0.1 if attempt else float(taskgroup[0]))
+
+
+def stager(taskgroup, attempt=0, **kwargs):
+    # Each attempt writes its own output, to be moved into place if it's kept
+    stagedir = attemptDir(taskgroup[0], attempt)
+    os.makedirs(stagedir, exist_ok=True)
+    staged = os.path.join(stagedir, "out.txt")
+    final = os.path.join(os.path.dirname(taskgroup[0]), "out.txt")
+    with open(os.path.join(stagedir, PROMOTE), "w") as fhandle:
+        json.dump([[staged, final]], fhandle)
+    with open(staged, "w") as fhandle:
+        fhandle.write("attempt {}".format(attempt))
+    time.sleep(0.1 if attempt else 30 if "slow" in taskgroup[0] else 0.1)
+
+
+def packer(taskgroup, report=None, **kwargs):
+    # Reports its outcome, then keeps on finishing up (e.g. packing traces)
+    report([])
+    time.sleep(float(taskgroup[0]))
+
+
+def spawner(taskgroup, pidfile=None, **kwargs):
+    proc = subprocess.Popen(["sleep", "60"])
+    with open(pidfile, "w") as fhandle:
+        fhandle.write(str(proc.pid))
+    proc.wait()
+
+
+def alive(pid):
+    # Stopped processes may linger as zombies until they are reaped by init
+    try:
+        os.kill(pid, 0)
+        with open("/proc/{}/stat".format(pid)) as fhandle:
+            return fhandle.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (ProcessLookupError, FileNotFoundError):
+        return False
+
+
+def reporter(taskgroup, outdir=None, verbose=False, **kwargs):
+    with open(os.path.join(outdir, taskgroup[0]), "w") as fhandle:
+        fhandle.write(str(verbose))
+
+
+class FakeHandler:
+    def __init__(self, task, **kwargs):
+        time.sleep(0.5)
+        self.output = mock.Mock(exit_code=int(task == "task-2.json"))
+
+    def joinPack(self, **kwargs):
+        pass
+
+
+class VerboseHandler:
+    def __init__(self, task, outdir=None, verbose=False, **kwargs):
+        reporter([task], outdir=outdir, verbose=verbose)
+        self.output = mock.Mock(exit_code=0)
+
+    def joinPack(self, **kwargs):
+        pass
+
+
+class TestPool(TestCase):
+
+    def test_parse_jobs(self):
+        self.assertEqual(parseJobs("3"), 3)
+        self.assertGreaterEqual(parseJobs("auto"), 1)
+        with self.assertRaises(ValueError):
+            parseJobs("0")
+
+    def test_parallel_groups(self):
+        pool = TaskPool(sleeper, jobs=4)
+        start = time.time()
+        results = pool.run([["0.5"], ["0.5"], ["0.5", "fail"], ["0.5"]])
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(sorted(r["exitcode"] for r in results), [0, 0, 0, 1])
+
+    def test_admission(self):
+        admission = Admission(ram=1000, cpus=4)
+        self.assertTrue(admission.fits({"ram": 600, "cpus": 1}))
+        self.assertFalse(admission.fits({"ram": 600, "cpus": 1},
+                                        [{"ram": 600, "cpus": 1}]))
+        self.assertFalse(admission.fits({"ram": 0, "cpus": 2},
+                                        [{"ram": 0, "cpus": 3}]))
+
+        # Two large groups run one after the other; the small one fills in
+        pool = TaskPool(sleeper, jobs=3, admission=admission, poll=0.1)
+        pool.run([["0.5"], ["0.5"], ["0.2"]],
+                 [{"ram": 600, "cpus": 1}, {"ram": 600, "cpus": 1},
+                  {"ram": 100, "cpus": 1}])
+        order = [result["tasks"] for result in pool.results]
+        self.assertEqual(order, [["0.2"], ["0.5"], ["0.5"]])
+        self.assertGreater(pool.results[-1]["duration"], 0.4)
+
+        # A group larger than the host still runs, on its own
+        pool = TaskPool(sleeper, jobs=2, admission=admission, poll=0.1)
+        pool.run([["0"]], [{"ram": 5000, "cpus": 8}])
+        self.assertEqual(pool.results[0]["exitcode"], 0)
+
+    def test_report(self):
+        # Groups which reported their outcome hand their slot back
+        pool = TaskPool(packer, jobs=1)
+        start = time.time()
+        with redirect_stdout(io.StringIO()):
+            results = pool.run([["1"], ["1"], ["1"]])
+        self.assertLess(time.time() - start, 2.5)
+        self.assertEqual([r["exitcode"] for r in results], [0, 0, 0])
+        self.assertTrue(all(r["duration"] < 0.5 for r in results))
+        self.assertEqual(pool.draining, {})
+
+    def test_verbose(self):
+        tmpdir = tempfile.mkdtemp()
+        pool = TaskPool(reporter, jobs=2, verbose=True, outdir=tmpdir)
+        with redirect_stdout(io.StringIO()):
+            pool.run([["a"], ["b"]])
+        for name in ["a", "b"]:
+            with open(os.path.join(tmpdir, name)) as fhandle:
+                self.assertEqual(fhandle.read(), "True")
+        shutil.rmtree(tmpdir)
+
+    def test_terminate(self):
+        tmpdir = tempfile.mkdtemp()
+        pidfile = os.path.join(tmpdir, "pid")
+        pool = TaskPool(spawner, jobs=1, grace=2, pidfile=pidfile)
+        pool.start(["task-0.json"])
+        while not os.path.exists(pidfile) or not os.path.getsize(pidfile):
+            time.sleep(0.05)
+        with open(pidfile) as fhandle:
+            child = int(fhandle.read())
+        pool.terminate()
+        self.assertEqual(pool.running, {})
+        # The tool started by the group is stopped along with it
+        deadline = time.time() + 2
+        while alive(child) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(alive(child))
+        shutil.rmtree(tmpdir)
+
+    def test_speculate(self):
+        pool = TaskPool(straggler, jobs=2, poll=0.1, speculate=0.5,
+                        factor=2)
+        start = time.time()
+        with redirect_stdout(io.StringIO()):
+            results = pool.run([["0.1"], ["30"], ["0.1"], ["0.1"]])
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[-1], dict(results[-1], tasks=["30"],
+                                           exitcode=0, speculative=True))
+        self.assertEqual(pool.running, {})
+
+    def test_speculate_promote(self):
+        # Only the files of the copy which is kept are moved into place
+        tmpdir = tempfile.mkdtemp()
+        groups = [[os.path.join(tmpdir, name, "task-0.json")]
+                  for name in ["a", "b", "c", "slow"]]
+        pool = TaskPool(stager, jobs=2, poll=0.1, speculate=0.5, factor=2)
+        with redirect_stdout(io.StringIO()):
+            pool.run(groups)
+        for name in ["a", "b", "c", "slow"]:
+            with open(os.path.join(tmpdir, name, "out.txt")) as fhandle:
+                self.assertEqual(fhandle.read(), "attempt {}".format(
+                    int(name == "slow")))
+            self.assertEqual(os.listdir(os.path.join(tmpdir, name)),
+                             ["out.txt"])
+        shutil.rmtree(tmpdir)
+
+    def test_runtask_jobs(self):
+        tasks = ["task-{}.json".format(idx) for idx in range(4)]
+        start = time.time()
+        with mock.patch("clowdr.driver.TaskHandler", FakeHandler), \
+                redirect_stdout(io.StringIO()):
+            failed = driver.runtask(tasks, jobs=4, local=True)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(failed, ["task-2.json"])
+
+    def test_runtask_verbose(self):
+        tmpdir = tempfile.mkdtemp()
+        tasks = ["task-{}.json".format(idx) for idx in range(2)]
+        with mock.patch("clowdr.driver.TaskHandler", VerboseHandler), \
+                redirect_stdout(io.StringIO()):
+            driver.runtask(tasks, jobs=2, verbose=True, outdir=tmpdir)
+        for task in tasks:
+            with open(os.path.join(tmpdir, task)) as fhandle:
+                self.assertEqual(fhandle.read(), "True")
+        shutil.rmtree(tmpdir)
+
+    def test_local_admission_history(self):
+        # Admission reads the history of this tool from the provenance
+        # directory, as balancing does, when no other history is given
+        tmpdir = tempfile.mkdtemp()
+        descriptor = os.path.join(tmpdir, "descriptor.json")
+        with open(descriptor, "w") as fhandle:
+            json.dump({"name": "tool", "tool-version": "1",
+                       "description": "test", "schema-version": "0.5",
+                       "command-line": "echo [X]",
+                       "inputs": [{"id": "x", "name": "X", "type": "String",
+                                   "value-key": "[X]"}]}, fhandle)
+        invocation = os.path.join(tmpdir, "invocation.json")
+        with open(invocation, "w") as fhandle:
+            json.dump({"x": ["a", "b"]}, fhandle)
+        provdir = os.path.join(tmpdir, "prov")
+
+        cwd = os.getcwd()
+        with mock.patch("clowdr.driver.TaskPool") as pool, \
+                mock.patch("clowdr.controller.history.loadHistory",
+                           return_value={}) as load, \
+                redirect_stdout(io.StringIO()):
+            driver.local(open(descriptor), invocation, provdir,
+                         sweep=["x"], jobs=2)
+        os.chdir(cwd)
+        pool.return_value.run.assert_called_once()
+        [paths], kwargs = load.call_args
+        self.assertEqual(paths, [provdir])
+        self.assertEqual(os.path.basename(kwargs["descriptor"]),
+                         "descriptor.json")
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+import os.path as op
+import tempfile
+import shutil
+import json
+
+from clowdr.task import TaskHandler
+from clowdr import utils
+
+
+class TestPrefetch(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.descriptor = op.join(self.tmpdir, "descriptor.json")
+        self.container = {"type": "docker", "image": "bids/example:0.0.4"}
+        with open(self.descriptor, "w") as fhandle:
+            json.dump({"name": "example",
+                       "container-image": self.container}, fhandle)
+        self.handler = TaskHandler.__new__(TaskHandler)
+        self.handler.prefetch_summary = {"container": None, "data": None}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_prefetch_pulls_image(self):
+        with mock.patch("clowdr.utils.Popen") as popen:
+            popen.return_value.communicate.return_value = (b"", b"")
+            self.handler.prefetch(self.descriptor, self.tmpdir)
+        popen.assert_called_once_with("docker pull bids/example:0.0.4",
+                                      shell=True, stdout=mock.ANY,
+                                      stderr=mock.ANY, cwd=self.tmpdir)
+        self.assertIsNotNone(self.handler.prefetch_summary["container"])
+
+    def test_prefetch_failure_is_not_fatal(self):
+        with mock.patch("clowdr.utils.getContainer",
+                        side_effect=OSError("no docker")):
+            self.handler.prefetch(self.descriptor, self.tmpdir)
+        self.assertIsNotNone(self.handler.prefetch_summary["container"])
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+from concurrent.futures import ThreadPoolExecutor
+import os.path as op
+import tempfile
+import shutil
+import json
+import os
+
+from clowdr.task import TaskHandler, stageInputs, speculable, workDir, \
+    attemptDir, discardAttempt
+from clowdr import utils
+
+
+class TestProvenance(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bindir = op.join(self.tmpdir, "bin")
+        os.mkdir(self.bindir)
+        reprozip = op.join(self.bindir, "reprozip")
+        with open(reprozip, "w") as fhandle:
+            fhandle.write('#!/bin/sh\n[ "$1" = pack ] && echo rpz > "$3"\n')
+        os.chmod(reprozip, 0o755)
+
+        self.handler = TaskHandler.__new__(TaskHandler)
+        self.handler.task_id = "4"
+        self.handler.localtaskdir = op.join(self.tmpdir, "clowtask_4")
+        self.handler.remotetaskdir = op.join(self.tmpdir, "remote")
+        os.makedirs(self.handler.tracedir())
+        os.mkdir(self.handler.remotetaskdir)
+        utils.findTool.cache_clear()
+
+    def tearDown(self):
+        utils.findTool.cache_clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_tool_cached(self):
+        with mock.patch("clowdr.utils.which",
+                        return_value="/usr/bin/reprozip") as which:
+            for _ in range(3):
+                self.assertEqual(utils.findTool("reprozip"),
+                                 "/usr/bin/reprozip")
+        which.assert_called_once_with("reprozip")
+
+    def test_pack_trace(self):
+        path = self.bindir + os.pathsep + os.environ["PATH"]
+        with mock.patch.dict(os.environ, {"PATH": path}):
+            timings = self.handler.packTrace()
+        packf = op.join(self.handler.remotetaskdir, "task-4-reprozip.rpz")
+        self.assertEqual(timings["file"], packf)
+        self.assertTrue(op.isfile(packf))
+        self.assertGreaterEqual(timings["pack"], 0)
+        self.assertIsNotNone(timings["upload"])
+
+    def test_join_pack(self):
+        # Packs are joined after the task, posting their own timings
+        path = self.bindir + os.pathsep + os.environ["PATH"]
+        with mock.patch.dict(os.environ, {"PATH": path}):
+            pool = ThreadPoolExecutor(max_workers=1)
+            self.handler.packing = pool.submit(self.handler.packTrace)
+            pool.shutdown(wait=False)
+            self.handler.cleanup = [self.handler.localtaskdir]
+            self.handler.joinPack()
+
+        with open(op.join(self.handler.remotetaskdir,
+                          "task-4-reprozip.json")) as fhandle:
+            timings = json.load(fhandle)
+        self.assertEqual(timings["file"],
+                         op.join(self.handler.remotetaskdir,
+                                 "task-4-reprozip.rpz"))
+        self.assertFalse(op.exists(self.handler.localtaskdir))
+        self.assertIsNone(self.handler.packing)
+
+    def test_stream_exec(self):
+        # Streamed logs are merged, as Boutiques merges the tool's own
+        bosh = op.join(self.bindir, "bosh")
+        with open(bosh, "w") as fhandle:
+            fhandle.write('#!/bin/sh\necho out\necho err >&2\nexit 3\n')
+        os.chmod(bosh, 0o755)
+        self.handler.runner_args = []
+        self.handler.runner_kwargs = {}
+        path = self.bindir + os.pathsep + os.environ["PATH"]
+        with mock.patch.dict(os.environ, {"PATH": path}):
+            output = self.handler.streamExec()
+        self.assertEqual(output.exit_code, 3)
+        self.assertTrue(output.merged)
+        self.assertIsNone(output.stderr_file)
+        with open(output.stdout_file) as fhandle:
+            self.assertEqual(fhandle.read(), "out\nerr\n")
+        self.assertFalse(op.exists(self.handler.logfile("stderr")))
+
+    def test_stage_inputs(self):
+        # Attempts find relative input files from their own directory
+        descriptor = op.join(self.tmpdir, "descriptor.json")
+        with open(descriptor, "w") as fhandle:
+            json.dump({"container-image": {"type": "docker", "image": "x"},
+                       "inputs": [{"id": "img", "type": "File"},
+                                  {"id": "imgs", "type": "File"},
+                                  {"id": "name", "type": "String"}]},
+                      fhandle)
+        invocation = op.join(self.tmpdir, "invocation.json")
+        with open(invocation, "w") as fhandle:
+            json.dump({"img": "data/a.nii", "imgs": ["/b.nii", "c.nii"],
+                       "name": "out"}, fhandle)
+        volumes = stageInputs(descriptor, invocation, "/work")
+        with open(invocation) as fhandle:
+            self.assertEqual(json.load(fhandle),
+                             {"img": "/work/data/a.nii",
+                              "imgs": ["/b.nii", "/work/c.nii"],
+                              "name": "out"})
+        self.assertEqual(volumes, ["/work:/work"])
+
+    def test_speculable(self):
+        # Tasks writing outputs to absolute paths aren't copied
+        descriptor = op.join(self.tmpdir, "descriptor.json")
+        with open(descriptor, "w") as fhandle:
+            json.dump({"name": "tool", "tool-version": "1",
+                       "description": "tool", "schema-version": "0.5",
+                       "command-line": "touch [OUT]",
+                       "inputs": [{"id": "out", "name": "out",
+                                   "type": "String", "value-key": "[OUT]"}],
+                       "output-files": [{"id": "res", "name": "res",
+                                         "path-template": "[OUT].txt"}]},
+                      fhandle)
+        taskf = op.join(self.tmpdir, "task-0.json")
+        for out, copied in [("out", True), ("/data/out", False)]:
+            invocation = op.join(self.tmpdir, "invocation.json")
+            with open(invocation, "w") as fhandle:
+                json.dump({"out": out}, fhandle)
+            with open(taskf, "w") as fhandle:
+                json.dump({"tool": descriptor, "invocation": invocation,
+                           "dataloc": ["localhost"]}, fhandle)
+            self.assertEqual(speculable(taskf), copied)
+
+    def test_discard_attempt(self):
+        # Discarded attempts leave neither their files nor their work behind
+        taskf = op.join(self.tmpdir, "remote", "task-4.json")
+        workdir = workDir(taskf, self.tmpdir, 1)
+        self.assertEqual(workdir, op.join(self.tmpdir, "clowtask_4-attempt-1"))
+        self.assertEqual(workDir(taskf, self.tmpdir, 0),
+                         self.handler.localtaskdir)
+        for path in [workdir, attemptDir(taskf, 1)]:
+            os.makedirs(path)
+        discardAttempt(taskf, 1, provdir=self.tmpdir)
+        self.assertFalse(op.exists(workdir))
+        self.assertFalse(op.exists(attemptDir(taskf, 1)))
+        self.assertTrue(op.exists(self.handler.localtaskdir))
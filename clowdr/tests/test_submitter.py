@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+import os.path as op
+import threading
+import tempfile
+import shutil
+import time
+import os
+
+from clowdr.controller.submitter import Submitter, readCursor, CURSOR
+from clowdr.controller import rerunner
+
+
+class TestSubmitter(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rundir = op.join(self.tmpdir, "run", "clowdr")
+        os.makedirs(self.rundir)
+        self.tasks = []
+        for idx in range(12):
+            self.tasks += [op.join(self.rundir, "task-{}.json".format(idx))]
+            open(self.tasks[-1], "w").close()
+        self.cursor = op.join(self.rundir, CURSOR)
+
+        # Stub squeue, listing the jobs in a queue file as pending
+        self.queue = op.join(self.tmpdir, "queue")
+        open(self.queue, "w").close()
+        bindir = op.join(self.tmpdir, "bin")
+        os.mkdir(bindir)
+        with open(op.join(bindir, "squeue"), "w") as fhandle:
+            fhandle.write("#!/bin/sh\ncat {}\n".format(self.queue))
+        os.chmod(op.join(bindir, "squeue"), 0o755)
+        self.env = {"PATH": bindir + os.pathsep + os.environ["PATH"]}
+        self.lock = threading.Lock()
+        self.peak = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, jobs):
+        # Replaced atomically, so squeue never reads a partial queue
+        with open(self.queue + ".tmp", "w") as fhandle:
+            fhandle.writelines(jobs)
+        os.replace(self.queue + ".tmp", self.queue)
+
+    def sbatch(self, taskgroup):
+        # Stub sbatch: queues a pending job
+        with self.lock:
+            with open(self.queue) as fhandle:
+                jobs = fhandle.readlines()
+            jobs += ["{} clowdr-test\n".format(len(jobs) + 100)]
+            self.peak = max(self.peak, len(jobs))
+            self.write(jobs)
+        return len(jobs) + 100
+
+    def drain(self, stop):
+        # Jobs start, one at a time, leaving the queue
+        while not stop.is_set():
+            time.sleep(0.05)
+            with self.lock:
+                with open(self.queue) as fhandle:
+                    jobs = fhandle.readlines()
+                self.write(jobs[1:])
+
+    def test_max_pending(self):
+        groups = [[task] for task in self.tasks]
+        stop = threading.Event()
+        drainer = threading.Thread(target=self.drain, args=(stop,))
+        drainer.start()
+        with mock.patch.dict(os.environ, self.env):
+            submitter = Submitter(self.sbatch, self.cursor, inflight=3,
+                                  max_pending=4, poll=0.02,
+                                  jobname="clowdr")
+            failed = submitter.run(groups)
+        stop.set()
+        drainer.join()
+
+        self.assertEqual(failed, [])
+        self.assertLessEqual(self.peak, 4)
+        self.assertEqual(sorted(readCursor(self.cursor)),
+                         sorted(op.basename(t) for t in self.tasks))
+
+    def test_resume(self):
+        attempts = []
+
+        def flaky(taskgroup):
+            attempts.append(taskgroup)
+            if "task-5.json" in taskgroup[0]:
+                raise OSError("sbatch: error: Socket timed out")
+            return 7
+
+        groups = [[task] for task in self.tasks[:8]]
+        with mock.patch("clowdr.controller.submitter.time.sleep"):
+            submitter = Submitter(flaky, self.cursor, backoff_time=10)
+            failed = submitter.run(groups)
+        self.assertEqual(failed, [[self.tasks[5]]])
+        # Retried with back-off, up to the time limit: 1 + 2 + 4 seconds
+        self.assertEqual(attempts.count([self.tasks[5]]), 4)
+
+        remaining = rerunner.getTasks(self.tmpdir, "run", "unsubmitted")
+        self.assertEqual(sorted(remaining),
+                         sorted([self.tasks[5]] + self.tasks[8:]))
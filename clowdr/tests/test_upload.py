@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+import os.path as op
+import tempfile
+import shutil
+import errno
+import os
+
+from clowdr import utils
+
+
+class TestUpload(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.remote = op.join(self.tmpdir, "remote")
+        os.mkdir(self.remote)
+        self.files = []
+        for idx in range(20):
+            fname = op.join(self.tmpdir, "file-{}.txt".format(idx))
+            with open(fname, "w") as fhandle:
+                fhandle.write("x" * (idx + 1))
+            self.files += [fname]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_post_many(self):
+        uploads = utils.postMany([(f, self.remote) for f in self.files],
+                                 jobs=8)
+        self.assertEqual(len(uploads), len(self.files))
+        for idx, (fname, upload) in enumerate(zip(self.files, uploads)):
+            self.assertEqual(upload["file"], fname)
+            self.assertEqual(upload["bytes"], idx + 1)
+            self.assertEqual(upload["remote"],
+                             [op.join(self.remote, op.basename(fname))])
+            self.assertTrue(op.isfile(upload["remote"][0]))
+
+    def test_post_many_retries(self):
+        post = utils.post
+        calls = []
+
+        def flaky(local, remote, **kwargs):
+            calls.append(local)
+            if calls.count(local) == 1:
+                raise ConnectionResetError("connection reset by peer")
+            return post(local, remote, **kwargs)
+
+        with mock.patch("clowdr.utils.post", side_effect=flaky), \
+                mock.patch("clowdr.utils.time.sleep"):
+            uploads = utils.postMany([(f, self.remote)
+                                      for f in self.files[:3]], jobs=2)
+        self.assertEqual([u["attempts"] for u in uploads], [2, 2, 2])
+
+        with mock.patch("clowdr.utils.post",
+                        side_effect=PermissionError("denied")):
+            with self.assertRaises(PermissionError):
+                utils.postMany([(self.files[0], self.remote)])
+
+        # Local disk failures aren't retried either
+        for error in [OSError(errno.ENOSPC, "No space left on device"),
+                      FileExistsError(errno.EEXIST, "File exists")]:
+            with mock.patch("clowdr.utils.post", side_effect=error) as post:
+                with self.assertRaises(OSError):
+                    utils.postMany([(self.files[0], self.remote)])
+            self.assertEqual(post.call_count, 1)
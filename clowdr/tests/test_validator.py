@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, mock
+import os.path as op
+import tempfile
+import shutil
+import json
+
+from clowdr import __file__ as cfile
+from clowdr.controller import metadata, validator
+
+
+class TestValidator(TestCase):
+
+    cdir = op.abspath(op.join(op.dirname(cfile), op.pardir))
+    descriptor = op.join(cdir, "examples/bids-example/descriptor_d.json")
+    invocation = op.join(cdir, "examples/bids-example/invocation_sweep.json")
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = op.join(self.tmpdir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def consolidate(self, invocation, **kwargs):
+        return metadata.consolidateTask(self.descriptor, invocation,
+                                        op.join(self.tmpdir, "prov"),
+                                        "localhost", validate=True,
+                                        validation_cache=self.cachedir,
+                                        **kwargs)
+
+    def test_validate(self):
+        sweep = ["participant_label", "analysis_level"]
+        [tasks, _] = self.consolidate(self.invocation, sweep=sweep)
+        self.assertEqual(validator.validateTasks(self.descriptor, tasks,
+                                                 cachedir=self.cachedir), {})
+
+        # Validated invocations aren't validated again
+        with mock.patch.object(validator, "ProcessPoolExecutor") as pool:
+            self.consolidate(self.invocation, sweep=sweep, manifest=True)
+        pool.assert_not_called()
+
+    def test_invalid(self):
+        with open(self.invocation) as fhandle:
+            invo = json.load(fhandle)
+        invo["participant_label"] = ["01"]
+        invo["analysis_level"] = ["participant", "everything"]
+        invocation = op.join(self.tmpdir, "invocation.json")
+        with open(invocation, "w") as fhandle:
+            json.dump(invo, fhandle)
+
+        [tasks, _] = metadata.consolidateTask(self.descriptor, invocation,
+                                              op.join(self.tmpdir, "prov"),
+                                              "localhost",
+                                              sweep=["analysis_level"])
+        invalid = validator.validateTasks(self.descriptor, tasks,
+                                          cachedir=self.cachedir)
+        self.assertEqual(list(invalid), [tasks[1]])
+        self.assertIn("everything", invalid[tasks[1]])
+
+        with self.assertRaises(SystemExit) as error:
+            self.consolidate(invocation, sweep=["analysis_level"])
+        self.assertIn("1 of 2 invocation(s) are invalid", str(error.exception))
+        self.assertIn("task-1.json", str(error.exception))
@@ -1,12 +1,22 @@
 #!/usr/bin/env python
 
-from shutil import copy, copytree, rmtree, SameFileError
+from shutil import copy, copytree, rmtree, which, SameFileError, \
+    Error as CopyError
 from subprocess import Popen, PIPE, CalledProcessError
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
 import os.path as op
 import random as rnd
+import tempfile
+import errno
+import getpass
 import string
 import boto3
 import time
+import json
 import csv
 import sys
 import os
@@ -33,6 +43,25 @@ def backoff(function, posargs, optargs, backoff_time=36000, **kwargs):
             fib_lo, fib_hi = fib_hi, fib_lo + fib_hi
 
 
+@lru_cache(maxsize=None)
+def findTool(name):
+    """findTool
+    Locates an executable on the PATH. The lookup is cached, so that it runs
+    once per process (and is inherited by forked workers).
+
+    Parameters
+    ----------
+    name : str
+        Name of the executable
+
+    Returns
+    -------
+    str or None
+        Path of the executable, or None if it wasn't found
+    """
+    return which(name)
+
+
 def getContainer(savedir, container, **kwargs):
     if container["type"] == "singularity":
         name = container.get("image")
@@ -43,21 +72,26 @@ def getContainer(savedir, container, **kwargs):
         elif not index.endswith("://"):
             index = index + "://"
         if kwargs.get("simg"):
-            return get(kwargs["simg"], local + ".simg")
+            return get(kwargs["simg"], op.join(savedir, local + ".simg"))
         else:
             cmd = "singularity pull --name \"{}.simg\" {}{}".format(local,
                                                                     index,
                                                                     name)
-            if kwargs.get("verbose"):
-                print(cmd)
-            p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-            stdout = p.communicate()
-            if kwargs.get("verbose"):
-                try:
-                    print(stdout.decode('utf-8'))
-                except Exception as e:
-                    print(stdout)
-            return stdout
+    elif container["type"] == "docker":
+        cmd = "docker pull {}".format(container.get("image"))
+    else:
+        return None
+
+    if kwargs.get("verbose"):
+        print(cmd)
+    p = Popen(cmd, shell=True, stdout=PIPE, stderr=PIPE, cwd=savedir)
+    stdout = p.communicate()
+    if kwargs.get("verbose"):
+        try:
+            print(stdout.decode('utf-8'))
+        except Exception as e:
+            print(stdout)
+    return stdout
 
 
 def truepath(path):
@@ -72,6 +106,41 @@ def randstring(k):
                     for _ in range(k)])
 
 
+def cacheDir(name):
+    # Per-user directory in which a cache is kept when none is given, e.g.
+    # "/tmp/clowdr-bids-<user>"
+    return op.join(tempfile.gettempdir(),
+                   "clowdr-{}-{}".format(name, getpass.getuser()))
+
+
+def loadCache(cachefile):
+    # Reads a JSON cache; missing or partial caches are empty
+    try:
+        with open(cachefile) as fhandle:
+            return json.load(fhandle)
+    except (IOError, ValueError):
+        return {}
+
+
+def saveCache(cachefile, content, **kwargs):
+    # Written aside then moved, so that concurrent launches never read a
+    # partial cache; kwargs are passed on to "json.dump"
+    os.makedirs(op.dirname(cachefile), exist_ok=True)
+    tmpfile = "{}.{}".format(cachefile, randstring(8))
+    with open(tmpfile, "w") as fhandle:
+        json.dump(content, fhandle, sort_keys=True, **kwargs)
+    os.replace(tmpfile, cachefile)
+
+
+def chunks(iterable, size):
+    # Splits an iterable into lists of "size" items, lazily
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
 def splitS3Path(path):
     return re.match('^s3://([a-zA-Z0-9_-]+)/([a-zA-Z0-9_/.-]+)',
                     path).group(1, 2)
@@ -121,6 +190,87 @@ def post(local, remote, **kwargs):
             return [op.realpath(remote)]
 
 
+def _transient(error):
+    # Errors worth retrying: network hiccups, throttling, and 5xx responses.
+    # Local failures (missing or conflicting paths, full or read-only disks,
+    # partly copied directories) would only fail again
+    if isinstance(error, (FileNotFoundError, FileExistsError,
+                          IsADirectoryError, NotADirectoryError,
+                          PermissionError, CopyError)):
+        return False
+    if isinstance(error, OSError) and \
+       error.errno in [errno.ENOSPC, errno.EDQUOT, errno.EROFS]:
+        return False
+    if isinstance(error, ClientError):
+        code = str(error.response.get("Error", {}).get("Code", ""))
+        return (code.startswith("5") or code in ["SlowDown", "Throttling",
+                                                 "RequestTimeout",
+                                                 "InternalError",
+                                                 "ServiceUnavailable"])
+    return isinstance(error, (OSError, BotoCoreError, S3UploadFailedError))
+
+
+def _size(local):
+    if op.isfile(local):
+        return op.getsize(local)
+    return sum(op.getsize(op.join(root, f))
+               for root, dirs, files in os.walk(local)
+               for f in files)
+
+
+def _timedPost(local, remote, retries=3, **kwargs):
+    attempt = 0
+    while True:
+        start = time.time()
+        try:
+            posted = post(local, remote, **kwargs)
+            break
+        except Exception as e:
+            attempt += 1
+            if attempt > retries or not _transient(e):
+                raise
+            if kwargs.get("verbose"):
+                print("Upload of {} failed ({}). Retrying...".format(local, e))
+            time.sleep(min(2 ** attempt, 30))
+    duration = time.time() - start
+    nbytes = _size(local)
+    return {"file": local,
+            "remote": posted,
+            "bytes": nbytes,
+            "seconds": duration,
+            "attempts": attempt + 1,
+            "MBps": nbytes / 1024 / 1024 / duration if duration else None}
+
+
+def postMany(transfers, jobs=4, retries=3, **kwargs):
+    """postMany
+    Uploads several files (or directories) concurrently through a bounded
+    pool of threads, retrying transient errors with exponential back-off.
+
+    Parameters
+    ----------
+    transfers : list
+        List of (local, remote) pairs, as would be passed to "post"
+    jobs : int
+        Maximum number of concurrent uploads
+    retries : int
+        Number of times a transient failure is retried before giving up
+
+    Returns
+    -------
+    list
+        One record per transfer, in order, with the remote path(s) written,
+        the number of bytes, the duration, and the throughput (in MB/s).
+    """
+    if not transfers:
+        return []
+    with ThreadPoolExecutor(max_workers=max(int(jobs), 1)) as pool:
+        futures = [pool.submit(_timedPost, local, remote, retries=retries,
+                               **kwargs)
+                   for local, remote in transfers]
+        return [future.result() for future in futures]
+
+
 def remove(local):
     try:
         if op.isfile(local):